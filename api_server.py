@@ -0,0 +1,339 @@
+# Local Multimodal AI Chat - Multimodal chat application with Gemini
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Headless HTTP API for the chat pipeline.
+
+Serves the same ChatAPIHandler, VectorDB and DatabaseManager code as app.py,
+without Streamlit reruns:
+
+    python api_server.py --workers 4
+    uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST   /auth/token                  exchange a username and password for a bearer token
+    DELETE /auth/token                  revoke the token of the request
+    POST   /chat                        answer a message
+    POST   /chat/stream                 same, as server-sent events
+    POST   /ingest                      queue uploaded PDFs for the knowledge base
+    GET    /ingest/jobs                 list ingestion jobs
+    GET    /ingest/jobs/{job_id}        progress of one ingestion job
+    GET    /documents                   the user's ingested documents
+    DELETE /documents/{document_id}     remove one of them from the knowledge base
+    DELETE /documents                   remove all of them
+    POST   /transcribe                  transcribe an uploaded audio clip
+    GET    /sessions                    list the user's chat sessions
+    GET    /sessions/{session_id}       messages of one session
+    DELETE /sessions/{session_id}       delete one session
+    GET    /health, /metrics
+
+Every endpoint but /health and /metrics needs an ``Authorization: Bearer``
+token from POST /auth/token, and acts for the user it was issued to: a
+user only sees and changes their own sessions and documents. Tokens live in
+the users database, so every worker accepts them. When ``api_server.api_key``
+is set, all requests must also send it in the X-API-Key header.
+
+Handlers are async. The blocking model, Chroma and SQLite calls run in the
+threadpool, so one worker serves many requests at once. Workers keep no
+per-client state, so any number of them can sit behind a load balancer.
+"""
+import argparse
+import asyncio
+import json
+import uuid
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from auth_handler import get_auth_handler
+from password_hashing import PasswordPoolBusy
+from chat_api_handler import ChatAPIHandler
+from database_operations import db_manager
+from ingestion_jobs import get_ingestion_queue
+from session_archive import get_session_archiver
+from telemetry import render_prometheus
+from utils import get_config
+
+config = get_config()
+server_config = config.get("api_server", {})
+
+@asynccontextmanager
+async def lifespan(app):
+    get_session_archiver()
+    yield
+
+app = FastAPI(title="Local Multimodal AI Chat API", lifespan=lifespan)
+
+def check_api_key(x_api_key: Optional[str] = Header(default=None)):
+    expected = get_config().get("api_server", {}).get("api_key")
+    if expected and x_api_key != expected:
+        raise HTTPException(status_code=401, detail="Invalid or missing X-API-Key header")
+
+bearer = HTTPBearer(auto_error=False)
+
+def current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    """The user the request's bearer token was issued to."""
+    username = None
+    if credentials is not None:
+        username = get_auth_handler().user_for_api_token(credentials.credentials)
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid or missing bearer token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return username
+
+def check_session_owner(session_id, username):
+    """Raise 404 unless ``session_id`` is new or belongs to ``username``."""
+    exists, owner = db_manager.message_repo.session_owner(session_id)
+    # Sessions of other users (and legacy ones without an owner) look missing
+    if exists and owner != username:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+class TokenRequest(BaseModel):
+    username: str
+    password: str
+
+class ChatRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+    endpoint: str = "gemini"
+    model: Optional[str] = None
+    pdf_chat: bool = False
+    retrieved_documents: int = 4
+    # Restrict PDF chat to these documents (ids from GET /documents)
+    document_ids: Optional[List[str]] = None
+
+class ChatResponse(BaseModel):
+    session_id: str
+    answer: str
+
+def load_history(session_id):
+    return [
+        {"role": msg["sender_type"], "content": msg["content"]}
+        for msg in db_manager.message_repo.load_messages(session_id)
+        if msg["message_type"] == "text"
+    ]
+
+def load_prompt_history(session_id):
+    # Only the messages the model sees, not the whole session
+    prompt_messages = get_config().get("session_memory", {}).get("prompt_messages", 8)
+    if not prompt_messages:
+        return []
+    return [
+        {"role": msg["sender_type"], "content": msg["content"]}
+        for msg in db_manager.message_repo.load_last_k_text_messages(session_id, prompt_messages)
+    ]
+
+def resolve_request(request: ChatRequest, username):
+    if request.endpoint not in ("gemini", "openai"):
+        raise HTTPException(status_code=400, detail=f"Unknown endpoint: {request.endpoint}")
+    session_id = request.session_id or uuid.uuid4().hex
+    model = request.model or get_config()[request.endpoint]["model"]
+    return session_id, model
+
+def run_chat_turn(request: ChatRequest, session_id, model, username):
+    check_session_owner(session_id, username)
+    chat_history = load_prompt_history(session_id)
+    db_manager.message_repo.save_message(session_id, "user", "text", request.message,
+                                         username=username)
+    answer = ChatAPIHandler.chat(
+        user_input=request.message,
+        chat_history=chat_history,
+        endpoint=request.endpoint,
+        model=model,
+        pdf_chat=request.pdf_chat,
+        retrieved_documents=request.retrieved_documents,
+        username=username,
+        document_ids=request.document_ids,
+    )
+    db_manager.message_repo.save_message(session_id, "assistant", "text", answer,
+                                         username=username)
+    return answer
+
+@app.post("/auth/token", dependencies=[Depends(check_api_key)])
+async def issue_token(request: TokenRequest):
+    auth = get_auth_handler()
+    try:
+        authenticated = await run_in_threadpool(auth.login_user, request.username, request.password)
+    except (PasswordPoolBusy, FuturesTimeoutError):
+        raise HTTPException(status_code=503, detail="Too many logins at once, try again shortly")
+    if not authenticated:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    token = await run_in_threadpool(auth.issue_api_token, request.username)
+    return {"token": token, "token_type": "bearer", "username": request.username}
+
+@app.delete("/auth/token", dependencies=[Depends(check_api_key), Depends(current_user)])
+async def revoke_token(credentials: HTTPAuthorizationCredentials = Depends(bearer)):
+    await run_in_threadpool(get_auth_handler().revoke_api_token, credentials.credentials)
+    return {"status": "revoked"}
+
+@app.post("/chat", response_model=ChatResponse, dependencies=[Depends(check_api_key)])
+async def chat(request: ChatRequest, username: str = Depends(current_user)):
+    session_id, model = resolve_request(request, username)
+    answer = await run_in_threadpool(run_chat_turn, request, session_id, model, username)
+    return ChatResponse(session_id=session_id, answer=answer)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream", dependencies=[Depends(check_api_key)])
+async def chat_stream(request: ChatRequest, username: str = Depends(current_user)):
+    session_id, model = resolve_request(request, username)
+    await run_in_threadpool(check_session_owner, session_id, username)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    def produce():
+        # Runs the whole blocking stream on one worker thread, handing each
+        # piece to the event loop as soon as the model produces it
+        pieces = []
+        try:
+            chat_history = load_prompt_history(session_id)
+            db_manager.message_repo.save_message(session_id, "user", "text", request.message,
+                                                 username=username)
+            for piece in ChatAPIHandler.chat_stream(
+                user_input=request.message,
+                chat_history=chat_history,
+                endpoint=request.endpoint,
+                model=model,
+                pdf_chat=request.pdf_chat,
+                retrieved_documents=request.retrieved_documents,
+                username=username,
+                document_ids=request.document_ids,
+            ):
+                pieces.append(piece)
+                loop.call_soon_threadsafe(queue.put_nowait, piece)
+            answer = "".join(pieces)
+            db_manager.message_repo.save_message(session_id, "assistant", "text", answer,
+                                                 username=username)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    async def events():
+        producer = loop.run_in_executor(None, produce)
+        answer = []
+        failed = False
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                failed = True
+                yield sse_event("error", {"session_id": session_id, "detail": str(item)})
+                continue
+            answer.append(item)
+            yield sse_event("delta", {"text": item})
+        await producer
+        # A failed turn ends with its error event, never with done
+        if not failed:
+            yield sse_event("done", {"session_id": session_id, "answer": "".join(answer)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/ingest", status_code=202, dependencies=[Depends(check_api_key)])
+async def ingest(files: List[UploadFile] = File(...), chunk_size: int = Form(1000),
+                 chunk_overlap: int = Form(200), username: str = Depends(current_user)):
+    if chunk_overlap >= chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_overlap must be smaller than chunk_size")
+    queue = get_ingestion_queue()
+    job_ids = []
+    for file in files:
+        pdf_bytes = await file.read()
+        job_ids.append(await run_in_threadpool(queue.submit, file.filename, pdf_bytes, username,
+                                               chunk_size, chunk_overlap))
+    return {"jobs": job_ids, "status": "queued"}
+
+@app.get("/ingest/jobs", dependencies=[Depends(check_api_key)])
+async def list_ingestion_jobs(limit: int = 20, username: str = Depends(current_user)):
+    jobs = await run_in_threadpool(get_ingestion_queue().list_jobs, username, limit)
+    return {"jobs": jobs}
+
+@app.get("/ingest/jobs/{job_id}", dependencies=[Depends(check_api_key)])
+async def get_ingestion_job(job_id: str, username: str = Depends(current_user)):
+    job = await run_in_threadpool(get_ingestion_queue().get_status, job_id)
+    if job is None or job["username"] != username:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/documents", dependencies=[Depends(check_api_key)])
+async def list_documents(username: str = Depends(current_user)):
+    documents = await run_in_threadpool(get_ingestion_queue().list_documents, username)
+    return {"documents": documents}
+
+@app.delete("/documents/{document_id}", dependencies=[Depends(check_api_key)])
+async def delete_document(document_id: str, username: str = Depends(current_user)):
+    if not await run_in_threadpool(get_ingestion_queue().delete_document, document_id, username):
+        raise HTTPException(status_code=409, detail="Unknown document, or still being ingested")
+    return {"document_id": document_id, "status": "deleted"}
+
+@app.delete("/documents", dependencies=[Depends(check_api_key)])
+async def clear_documents(username: str = Depends(current_user)):
+    await run_in_threadpool(get_ingestion_queue().clear_user, username)
+    return {"username": username, "status": "cleared"}
+
+@app.post("/transcribe", dependencies=[Depends(check_api_key), Depends(current_user)])
+async def transcribe(file: UploadFile = File(...)):
+    from audio_handler import transcribe_audio
+    audio_bytes = await file.read()
+    text = await run_in_threadpool(transcribe_audio, audio_bytes)
+    return {"text": text}
+
+@app.get("/sessions", dependencies=[Depends(check_api_key)])
+async def list_sessions(username: str = Depends(current_user)):
+    sessions = await run_in_threadpool(db_manager.message_repo.get_all_chat_history_ids, username)
+    return {"sessions": sessions}
+
+@app.get("/sessions/{session_id}", dependencies=[Depends(check_api_key)])
+async def get_session(session_id: str, username: str = Depends(current_user)):
+    await run_in_threadpool(check_session_owner, session_id, username)
+    messages = await run_in_threadpool(load_history, session_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "messages": messages}
+
+@app.delete("/sessions/{session_id}", dependencies=[Depends(check_api_key)])
+async def delete_session(session_id: str, username: str = Depends(current_user)):
+    await run_in_threadpool(check_session_owner, session_id, username)
+    await run_in_threadpool(db_manager.message_repo.delete_chat_history, session_id)
+    return {"session_id": session_id, "status": "deleted"}
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the headless chat API server.")
+    parser.add_argument("--host", default=server_config.get("host", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=server_config.get("port", 8000))
+    parser.add_argument("--workers", type=int, default=server_config.get("workers", 1))
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
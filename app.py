@@ -15,9 +15,9 @@
 
 import streamlit as st
 from chat_api_handler import ChatAPIHandler
-from utils import get_timestamp, load_config, get_avatar, list_available_models, command
+from utils import get_timestamp, get_config, get_avatar, list_available_models, list_gemini_models, command
 from audio_handler import transcribe_audio
-from pdf_handler import add_documents_to_db
+from ingestion_jobs import get_ingestion_queue
 from html_templates import css
 from database_operations import (
     get_db_manager,
@@ -27,21 +27,12 @@ from database_operations import (
     DEFAULT_CHUNK_SIZE,
     DEFAULT_CHUNK_OVERLAP
 )
-# vectordb_handler.py
-import os
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules['pysqlite3']
-
-import chromadb
-from langchain.embeddings import OpenAIEmbeddings # Assuming you use OpenAI embeddings
-# ... rest of your code
-import sqlite3
-from auth_handler import show_login_page
-import os
-import shutil # Import shutil for directory operations
-
-config = load_config()
+from auth_handler import show_login_page, is_session_authenticated, logout
+from telemetry import observe, start_metrics_server
+from session_archive import get_session_archiver
+from session_memory import ConversationMemory
+
+config = get_config()
 
 def toggle_pdf_chat():
     st.session_state.pdf_chat = True
@@ -84,21 +75,21 @@ def initialize_session_state():
     if "session_key" not in st.session_state:
         st.session_state.session_key = get_timestamp()
 
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-        # Load messages from database when initializing
-        db_manager = get_db_manager()
-        stored_messages = db_manager.message_repo.load_messages(st.session_state.session_key)
-        if stored_messages:
-            st.session_state.messages = [
-                {"role": msg["sender_type"], "content": msg["content"]}
-                for msg in stored_messages if msg["message_type"] == "text"
-            ]
+    if "chat_memory_length" not in st.session_state:
+        # Earlier messages sent to the model with each question
+        st.session_state["chat_memory_length"] = config.get("session_memory", {}).get("prompt_messages", 8)
+
+    if "conversation" not in st.session_state:
+        # Only the tail of the session is held; older messages are paged in on demand
+        st.session_state.conversation = ConversationMemory.from_config(
+            prompt_messages=st.session_state["chat_memory_length"]
+        )
+        st.session_state.conversation.load(get_db_manager().message_repo, st.session_state.session_key)
 
     if "endpoint_to_use" not in st.session_state:
         st.session_state["endpoint_to_use"] = "gemini"
     if "model_to_use" not in st.session_state:
-        st.session_state["model_to_use"] = "gemini-pro"
+        st.session_state["model_to_use"] = get_config()["gemini"]["model"]
     if "pdf_chat" not in st.session_state:
         st.session_state["pdf_chat"] = False
     if "retrieved_documents" not in st.session_state:
@@ -112,29 +103,124 @@ def initialize_session_state():
         st.session_state["chunk_size"] = 1000  # Default chunk size
     if "chunk_overlap" not in st.session_state:
         st.session_state["chunk_overlap"] = 200  # Default overlap
-    if "chat_memory_length" not in st.session_state:
-        st.session_state["chat_memory_length"] = 4  # Default chat memory length
 
 # --- NEW FUNCTION FOR CLEARING PDF DATA ---
 def clear_pdf_data():
     """
-    Deletes the ChromaDB directory where PDF embeddings are stored.
+    Deletes the current user's PDF embeddings (their Chroma collection).
+    Other users' documents and the shared collection are left alone.
     Also clears the current chat session and forces a UI rerun.
     """
-    chroma_db_path = "./chroma_db"
-    if os.path.exists(chroma_db_path):
-        try:
-            shutil.rmtree(chroma_db_path)
-            st.success("PDF knowledge base (ChromaDB) cleared successfully!")
-            # Clear current chat messages as they were based on old PDF data
-            st.session_state.messages = []
-            # Force a new chat session to ensure a clean slate after clearing PDF data
-            st.session_state.session_key = get_timestamp()
-            st.rerun() # Rerun to refresh the UI and reflect the cleared state
-        except Exception as e:
-            st.error(f"Error clearing PDF knowledge base: {e}")
-    else:
-        st.info("No PDF knowledge base found to clear.")
+    try:
+        get_ingestion_queue().clear_user(st.session_state['username'])
+        st.success("Your PDF knowledge base was cleared successfully!")
+        # Clear current chat messages as they were based on old PDF data
+        st.session_state.conversation.clear()
+        # Force a new chat session to ensure a clean slate after clearing PDF data
+        st.session_state.session_key = get_timestamp()
+        st.rerun() # Rerun to refresh the UI and reflect the cleared state
+    except Exception as e:
+        st.error(f"Error clearing PDF knowledge base: {e}")
+
+def show_pdf_documents():
+    """List the user's ingested PDFs, with a search filter and per-document delete."""
+    queue = get_ingestion_queue()
+    documents = queue.list_documents(st.session_state['username'])
+    names = {document["job_id"]: document["file_name"] for document in documents}
+    # Drop deleted documents from the filter before the widget validates it
+    st.session_state["pdf_document_filter"] = [
+        job_id for job_id in st.session_state.get("pdf_document_filter", []) if job_id in names
+    ]
+    if not documents:
+        return
+    st.multiselect("Search only in", options=list(names), format_func=names.get,
+                   key="pdf_document_filter", placeholder="All documents")
+    for document in documents:
+        name_col, delete_col = st.columns([3, 1])
+        name_col.caption(document["file_name"])
+        if delete_col.button("Delete", key=f"delete_document_{document['job_id']}"):
+            queue.delete_document(document["job_id"], st.session_state['username'])
+            st.rerun()
+
+SEARCH_PAGE_SIZE = 10
+
+def open_chat_session(chat_history_id):
+    st.session_state.session_key = chat_history_id
+    st.session_state.conversation.load(st.session_state.db_manager.message_repo, chat_history_id)
+
+def show_session_memory():
+    usage = st.session_state.conversation.memory_usage()
+    st.caption(f"Session memory: {usage['messages']} messages, {usage['prompts']} prompts, "
+               f"{usage['total_bytes'] / 1024:.0f} of {usage['max_bytes'] / 1024:.0f} KiB")
+
+def show_chat_search():
+    search_query = st.text_input("Search chats", key="chat_search_query")
+    if not search_query:
+        st.session_state["chat_search_page"] = 0
+        return
+
+    if st.session_state.get("chat_search_last_query") != search_query:
+        st.session_state["chat_search_last_query"] = search_query
+        st.session_state["chat_search_page"] = 0
+    page = st.session_state.get("chat_search_page", 0)
+
+    # Fetch one extra row to know whether there is a next page
+    results = st.session_state.db_manager.message_repo.search_messages(
+        search_query,
+        username=st.session_state['username'],
+        limit=SEARCH_PAGE_SIZE + 1,
+        offset=page * SEARCH_PAGE_SIZE
+    )
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+
+    if not results:
+        st.caption("No matching messages.")
+    for result in results:
+        st.markdown(f"`{result['chat_history_id']}` ({result['sender_type']}): {result['snippet']}")
+        if st.button("Open", key=f"open_search_result_{result['message_id']}"):
+            open_chat_session(result['chat_history_id'])
+            st.rerun()
+
+    prev_col, next_col = st.columns(2)
+    if page > 0 and prev_col.button("Previous", key="chat_search_prev"):
+        st.session_state["chat_search_page"] = page - 1
+        st.rerun()
+    if has_next and next_col.button("Next", key="chat_search_next"):
+        st.session_state["chat_search_page"] = page + 1
+        st.rerun()
+
+INGESTION_JOBS_SHOWN = 5
+
+def submit_pdf_uploads(pdf_files):
+    """Queue each newly uploaded PDF once; the uploader returns them on every rerun."""
+    submitted = st.session_state.setdefault("submitted_uploads", {})
+    queue = get_ingestion_queue()
+    for pdf_file in pdf_files:
+        if pdf_file.file_id in submitted:
+            continue
+        submitted[pdf_file.file_id] = queue.submit(
+            pdf_file.name,
+            pdf_file.getvalue(),
+            username=st.session_state['username'],
+            chunk_size=st.session_state.chunk_size,
+            chunk_overlap=st.session_state.chunk_overlap
+        )
+
+@st.fragment(run_every=2)
+def show_ingestion_progress():
+    # Reruns on its own every two seconds without rerunning the whole page
+    jobs = get_ingestion_queue().list_jobs(st.session_state['username'], limit=INGESTION_JOBS_SHOWN)
+    for job in jobs:
+        if job["status"] == "failed":
+            st.error(f"{job['file_name']}: {job['error']}")
+        elif job["status"] == "done":
+            st.progress(1.0, text=f"{job['file_name']}: done ({job['total_chunks']} chunks)")
+        elif job["total_chunks"]:
+            st.progress(job["progress"], text=f"{job['file_name']}: "
+                                              f"{job['done_chunks']}/{job['total_chunks']} chunks")
+        else:
+            st.progress(0.0, text=f"{job['file_name']}: {job['status']}")
 
 def show_chat_interface():
     st.title(f"AI Chat Assistant - Welcome {st.session_state['username']}!")
@@ -152,24 +238,21 @@ def show_chat_interface():
                 index=0
             )
             if selected_session != "New Session":
-                st.session_state.session_key = selected_session
                 # Load messages for selected session
-                stored_messages = st.session_state.db_manager.message_repo.load_messages(selected_session)
-                st.session_state.messages = [
-                    {"role": msg["sender_type"], "content": msg["content"]}
-                    for msg in stored_messages if msg["message_type"] == "text"
-                ]
+                open_chat_session(selected_session)
                 st.rerun()
 
+        show_chat_search()
+
         # Clear chat history button (for current session's text chat)
         if st.button("Clear Chat History"):
             db_manager = get_db_manager()
             db_manager.message_repo.delete_chat_history(st.session_state.session_key)
-            st.session_state.messages = []
+            st.session_state.conversation.clear()
             st.rerun()
 
         # --- NEW BUTTON FOR CLEARING PDF DATA ---
-        # This button specifically targets the ChromaDB (PDF embeddings)
+        # This button specifically targets the user's ChromaDB collection (PDF embeddings)
         if st.button("Clear PDF Knowledge Base"):
             clear_pdf_data()
 
@@ -185,8 +268,9 @@ def show_chat_interface():
             models = ["gpt-3.5-turbo", "gpt-4"]
             default_index = 0 if st.session_state["model_to_use"] == "gpt-3.5-turbo" else 1
         else:
-            models = ["gemini-pro"]
-            default_index = 0
+            models = list_gemini_models() or [get_config()["gemini"]["model"]]
+            model_to_use = st.session_state["model_to_use"]
+            default_index = models.index(model_to_use) if model_to_use in models else 0
 
         st.session_state["model_to_use"] = st.selectbox(
             "Select Model",
@@ -212,30 +296,38 @@ def show_chat_interface():
             )
 
             if pdf_files:
-                add_documents_to_db(pdf_files)
+                submit_pdf_uploads(pdf_files)
+            show_ingestion_progress()
+            show_pdf_documents()
+
+        show_session_memory()
 
         # Logout button
         if st.button("Logout"):
-            st.session_state['logged_in'] = False
-            st.session_state['username'] = None
+            logout()
             st.rerun()
 
     # Chat interface
-    for message in st.session_state.messages:
+    conversation = st.session_state.conversation
+    if conversation.can_load_older() and st.button("Show older messages"):
+        conversation.load_older(st.session_state.db_manager.message_repo, st.session_state.session_key)
+        st.rerun()
+    for message in conversation.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     if user_input := st.chat_input("What is your question?"):
         # Save user message to database
         db_manager = get_db_manager()
-        db_manager.message_repo.save_message(
+        message_id = db_manager.message_repo.save_message(
             st.session_state.session_key,
             "user",
             "text",
-            user_input
+            user_input,
+            username=st.session_state['username']
         )
 
-        st.session_state.messages.append({"role": "user", "content": user_input})
+        conversation.append("user", user_input, message_id)
         with st.chat_message("user"):
             st.markdown(user_input)
 
@@ -253,22 +345,43 @@ def show_chat_interface():
             if uploaded_file is not None:
                 image = uploaded_file.read()
 
-            llm_answer = ChatAPIHandler.chat(user_input=user_input, chat_history=st.session_state.messages, image=image)
+            # The prompt (with any retrieved context) goes to this copy, not to the transcript
+            prompt_history = conversation.prompt_history()
+            llm_answer = ChatAPIHandler.chat(
+                user_input=user_input,
+                chat_history=prompt_history,
+                image=image,
+                username=st.session_state['username'],
+                document_ids=st.session_state.get("pdf_document_filter") or None
+            )
 
             # Save assistant message to database
-            db_manager.message_repo.save_message(
+            answer_id = db_manager.message_repo.save_message(
                 st.session_state.session_key,
                 "assistant",
                 "text",
-                llm_answer
+                llm_answer,
+                username=st.session_state['username']
             )
 
             message_placeholder.markdown(llm_answer)
-        st.session_state.messages.append({"role": "assistant", "content": llm_answer})
+        conversation.append("assistant", llm_answer, answer_id)
+        if not prompt_history or prompt_history[-1]["role"] != "user":
+            # Gemini's image chat does not add the question to the history it is given
+            prompt_history.append({"role": "user", "content": user_input})
+        conversation.record_turn(prompt_history, llm_answer)
+        observe("session_memory_bytes", conversation.memory_usage()["total_bytes"],
+                "Memory held per chat session after each turn")
 
 def main():
+    start_metrics_server()
+    get_session_archiver()
     initialize_session_state()
 
+    # Expired or revoked session tokens send the user back to the login page
+    if st.session_state['logged_in'] and not is_session_authenticated():
+        logout()
+
     # Show login page if not logged in
     if not st.session_state['logged_in']:
         show_login_page()
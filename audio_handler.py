@@ -1,10 +1,86 @@
-from transformers import pipeline
-import librosa
 import io
-from utils import load_config, timeit
+from utils import get_config, on_config_reload, timeit
+from telemetry import increment, span
+import numpy as np
 import os
 import subprocess
-config = load_config()
+import threading
+
+# Whisper's feature extractor expects 16 kHz audio
+SAMPLE_RATE = 16000
+
+VAD_DEFAULTS = {
+    "enabled": True,
+    "frame_ms": 30,
+    "threshold_db": 12,
+    "min_level_db": -50,
+    "speech_level_db": -30,
+    "min_speech_ms": 120,
+    "min_silence_ms": 300,
+    "padding_ms": 150,
+}
+
+class TransformersWhisper:
+    """``config["whisper_model"]`` through the transformers pipeline, in full precision."""
+
+    name = "transformers"
+
+    def __init__(self, model):
+        from transformers import pipeline
+        #device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        device = "cpu"
+        self.pipe = pipeline(
+            task="automatic-speech-recognition",
+            model=model,
+            chunk_length_s=30,
+            device=device,
+        )
+
+    def transcribe(self, audio):
+        return self.pipe(audio, batch_size=1)["text"]
+
+def create_transcriber(settings=None):
+    """Build the speech recognizer described by ``settings`` (the ``whisper`` config section)."""
+    if settings is None:
+        settings = get_config().get("whisper", {})
+    backend = settings.get("backend", "transformers")
+    if backend == "transformers":
+        return TransformersWhisper(get_config()["whisper_model"])
+    if backend == "onnx":
+        from whisper_onnx import OnnxWhisper
+        onnx_settings = settings.get("onnx", {})
+        return OnnxWhisper(
+            model_path=onnx_settings["model_path"],
+            quantized=onnx_settings.get("quantized", True),
+            intra_op_threads=onnx_settings.get("intra_op_threads", 0),
+            language=onnx_settings.get("language"),
+            max_new_tokens=onnx_settings.get("max_new_tokens", 224),
+        )
+    raise ValueError(f"Unknown Whisper backend: {backend}")
+
+_transcriber = None
+_transcriber_lock = threading.Lock()
+
+def get_transcriber():
+    """Build the configured speech recognizer on first use and reuse it afterwards.
+
+    transformers, onnxruntime and the model weights take seconds to load, so
+    none of them is touched until the first transcription.
+    """
+    global _transcriber
+    if _transcriber is None:
+        with _transcriber_lock:
+            if _transcriber is None:
+                _transcriber = create_transcriber()
+    return _transcriber
+
+def _reset_transcriber(old, new):
+    # Transcriptions already running keep the old model
+    global _transcriber
+    with _transcriber_lock:
+        _transcriber = None
+
+on_config_reload(_reset_transcriber, sections=("whisper", "whisper_model"))
 
 def convert_webm_to_wav_ffmpeg(audio_bytes):
     # Save the WebM bytes to a file
@@ -34,29 +110,98 @@ def convert_webm_to_wav_ffmpeg(audio_bytes):
     return wav_io
 
 def convert_bytes_to_array(audio_bytes):
+    import librosa
     try:
         audio_bytes_io = io.BytesIO(audio_bytes)
-        audio, sample_rate = librosa.load(audio_bytes)
+        audio, sample_rate = librosa.load(audio_bytes_io, sr=SAMPLE_RATE)
     except Exception as e:
         print("Audio error, trying to convert to wav.")
         wav_io = convert_webm_to_wav_ffmpeg(audio_bytes)
-        audio, sample_rate = librosa.load(wav_io)
+        audio, sample_rate = librosa.load(wav_io, sr=SAMPLE_RATE)
 
     print(sample_rate)
     return audio
 
+def detect_speech(audio, sample_rate=SAMPLE_RATE, settings=None):
+    """Return the speech segments of ``audio`` as ``(start, end)`` pairs in seconds.
+
+    An energy detector: a frame is speech when its level is ``threshold_db``
+    above the noise floor (the quietest tenth of the frames), but never below
+    ``min_level_db``. The threshold is also kept ``threshold_db`` below the
+    loudest frame, for clips that are mostly speech and so have few quiet
+    frames to measure the floor from. A clip whose level hardly varies (less
+    than ``threshold_db``) is either speech throughout or only room noise:
+    it counts as speech if its median level reaches ``speech_level_db``.
+    Pauses shorter than ``min_silence_ms`` stay inside a segment, blips
+    shorter than ``min_speech_ms`` are dropped, and every segment is padded by
+    ``padding_ms`` so word onsets and endings are kept.
+    """
+    settings = {**VAD_DEFAULTS, **(settings or {})}
+    frame = max(1, int(sample_rate * settings["frame_ms"] / 1000))
+    count = len(audio) // frame
+    if count == 0:
+        return []
+    frames = np.asarray(audio[:count * frame], dtype=np.float32).reshape(count, frame)
+    levels = 20 * np.log10(np.maximum(np.sqrt(np.mean(frames ** 2, axis=1)), 1e-10))
+    noise_floor = np.percentile(levels, 10)
+    if levels.max() - noise_floor >= settings["threshold_db"]:
+        threshold = max(settings["min_level_db"],
+                        min(noise_floor + settings["threshold_db"], levels.max() - settings["threshold_db"]))
+    elif np.median(levels) >= settings["speech_level_db"]:
+        threshold = max(settings["min_level_db"], levels.max() - settings["threshold_db"])
+    else:
+        return []
+
+    # Runs of speech frames as [start, end) frame indices
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], (levels > threshold).astype(np.int8), [0]))))
+    runs = []
+    min_silence = settings["min_silence_ms"] / settings["frame_ms"]
+    for start, end in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] < min_silence:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    segments = []
+    frame_s = frame / sample_rate
+    duration = len(audio) / sample_rate
+    padding = settings["padding_ms"] / 1000
+    for start, end in runs:
+        if (end - start) * frame_s * 1000 < settings["min_speech_ms"]:
+            continue
+        start_s = max(0.0, float(start * frame_s - padding))
+        end_s = min(duration, float(end * frame_s + padding))
+        if segments and start_s <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end_s)
+        else:
+            segments.append((start_s, end_s))
+    return segments
+
+def trim_silence(audio, sample_rate=SAMPLE_RATE, settings=None):
+    """Return ``audio`` with only its speech segments kept, and the segments."""
+    settings = {**VAD_DEFAULTS, **get_config().get("vad", {}), **(settings or {})}
+    duration = len(audio) / sample_rate
+    if not settings["enabled"]:
+        return audio, [(0.0, duration)] if len(audio) else []
+    with span("audio.vad", seconds=round(duration, 2)) as vad_span:
+        segments = detect_speech(audio, sample_rate, settings)
+        speech = np.concatenate(
+            [audio[int(start * sample_rate):int(end * sample_rate)] for start, end in segments]
+        ) if segments else audio[:0]
+        vad_span.set_attribute("segments", len(segments))
+    speech_seconds = len(speech) / sample_rate
+    increment("audio_seconds_total", speech_seconds, "Recorded audio by VAD decision", kind="speech")
+    increment("audio_seconds_total", duration - speech_seconds, "Recorded audio by VAD decision", kind="silence")
+    return speech, segments
+
 @timeit
 def transcribe_audio(audio_bytes):
-    #device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    device = "cpu"
-    pipe = pipeline(
-        task="automatic-speech-recognition",
-        model=config["whisper_model"],
-        chunk_length_s=30,
-        device=device,
-    )   
-
     audio_array = convert_bytes_to_array(audio_bytes)
-    prediction = pipe(audio_array, batch_size=1)["text"]
+    speech, segments = trim_silence(audio_array)
+    if not segments:
+        # Nothing to transcribe, so do not even load the model
+        print("No speech detected, skipping transcription.")
+        return ""
+    prediction = get_transcriber().transcribe(speech)
 
     return prediction
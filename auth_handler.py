@@ -1,60 +1,205 @@
 import streamlit as st
-import sqlite3
 import hashlib
-import os
-from datetime import datetime
+import sqlite3
+import secrets
+import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from database_operations import DatabaseConnection
+from password_hashing import PasswordHasher, PasswordWorkerPool, PasswordPoolBusy
+from utils import get_config
+
+auth_config = get_config().get("auth", {})
+
+# Upper bound on how long a login waits for a free hashing worker
+PASSWORD_HASH_TIMEOUT = 30
 
 class AuthHandler:
-    def __init__(self):
-        self.db_path = "users.db"
+    """User store backed by one long-lived SQLite connection.
+
+    Use ``get_auth_handler()`` rather than constructing this directly, so the
+    connection is opened and the schema is set up once per process instead of
+    on every Streamlit rerun. The same SQL strings are reused on the one
+    connection, so sqlite3's statement cache keeps them prepared.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or auth_config.get("users_database_path", "users.db")
+        self.db = DatabaseConnection(self.db_path)
+        # sqlite3 connections are not safe for concurrent use across threads
+        self._lock = threading.Lock()
+        self.hasher = PasswordHasher(
+            n=auth_config.get("scrypt_n", 2 ** 14),
+            r=auth_config.get("scrypt_r", 8),
+            p=auth_config.get("scrypt_p", 1)
+        )
+        self.hash_pool = PasswordWorkerPool(
+            self.hasher,
+            max_workers=auth_config.get("hash_workers", 2),
+            max_pending=auth_config.get("max_pending_hashes", 32)
+        )
+        self.sessions = SessionTokenCache(auth_config.get("session_ttl_seconds", 1800))
+        # Verified against for unknown usernames, so a failed login takes as
+        # long whether or not the user exists
+        self._dummy_hash = self.hasher.hash(secrets.token_urlsafe(16))
         self.setup_database()
 
     def setup_database(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                    (username TEXT PRIMARY KEY, 
-                     password TEXT NOT NULL,
-                     email TEXT UNIQUE NOT NULL,
-                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        conn.commit()
-        conn.close()
+        with self._lock:
+            conn = self.db.connection
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS users
+                        (username TEXT PRIMARY KEY, 
+                         password TEXT NOT NULL,
+                         email TEXT UNIQUE NOT NULL,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            # Bearer tokens of the HTTP API, stored hashed so a copy of the
+            # database does not hand out working tokens
+            conn.execute('''CREATE TABLE IF NOT EXISTS api_tokens
+                        (token_hash TEXT PRIMARY KEY,
+                         username TEXT NOT NULL,
+                         expires_at REAL NOT NULL)''')
+            conn.commit()
 
     def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        return self.hash_pool.hash(password, timeout=PASSWORD_HASH_TIMEOUT)
 
     def register_user(self, username, email, password):
+        hashed_pw = self.hash_password(password)
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            hashed_pw = self.hash_password(password)
-            c.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                     (username, email, hashed_pw))
-            conn.commit()
-            conn.close()
+            with self._lock, self.db.connection as conn:
+                conn.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                             (username, email, hashed_pw))
             return True
         except sqlite3.IntegrityError:
             return False
 
     def login_user(self, username, password):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        hashed_pw = self.hash_password(password)
-        c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed_pw))
-        result = c.fetchone()
-        conn.close()
-        return result is not None
+        """Verify credentials, upgrading legacy or outdated hashes on success."""
+        with self._lock:
+            row = self.db.connection.execute(
+                "SELECT password FROM users WHERE username=?", (username,)
+            ).fetchone()
+        if row is None:
+            self.hash_pool.verify(password, self._dummy_hash, timeout=PASSWORD_HASH_TIMEOUT)
+            return False
+        stored_hash = row[0]
+        if self.hasher.is_legacy(stored_hash):
+            # A SHA-256 check takes microseconds; spend a scrypt's time here too,
+            # so timing does not tell legacy accounts apart
+            self.hash_pool.verify(password, self._dummy_hash, timeout=PASSWORD_HASH_TIMEOUT)
+        if not self.hash_pool.verify(password, stored_hash, timeout=PASSWORD_HASH_TIMEOUT):
+            return False
+        if self.hasher.needs_rehash(stored_hash):
+            new_hash = self.hash_password(password)
+            with self._lock, self.db.connection as conn:
+                conn.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                             (new_hash, username, stored_hash))
+        return True
+
+    def issue_api_token(self, username):
+        """Create a bearer token for the HTTP API; only its hash is stored."""
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + auth_config.get("api_token_ttl_days", 30) * 86400
+        with self._lock, self.db.connection as conn:
+            conn.execute("DELETE FROM api_tokens WHERE expires_at < ?", (time.time(),))
+            conn.execute("INSERT INTO api_tokens (token_hash, username, expires_at) VALUES (?, ?, ?)",
+                         (_token_hash(token), username, expires_at))
+        return token
+
+    def user_for_api_token(self, token):
+        """Return the username an API token was issued to, or None if it is unknown or expired."""
+        with self._lock:
+            row = self.db.connection.execute(
+                "SELECT username FROM api_tokens WHERE token_hash=? AND expires_at >= ?",
+                (_token_hash(token), time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def revoke_api_token(self, token):
+        with self._lock, self.db.connection as conn:
+            conn.execute("DELETE FROM api_tokens WHERE token_hash=?", (_token_hash(token),))
+
+    def check_availability(self, username, email):
+        """Return ``(username_taken, email_taken)`` using a single query."""
+        with self._lock:
+            row = self.db.connection.execute(
+                "SELECT EXISTS(SELECT 1 FROM users WHERE username=?), "
+                "EXISTS(SELECT 1 FROM users WHERE email=?)",
+                (username, email)
+            ).fetchone()
+        return bool(row[0]), bool(row[1])
 
     def user_exists(self, username=None, email=None):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
         if username:
-            c.execute("SELECT 1 FROM users WHERE username=?", (username,))
+            return self.check_availability(username, None)[0]
         elif email:
-            c.execute("SELECT 1 FROM users WHERE email=?", (email,))
-        result = c.fetchone() is not None
-        conn.close()
-        return result
+            return self.check_availability(None, email)[1]
+        return False
+
+    def close(self):
+        self.hash_pool.shutdown()
+        self.db.close()
+
+def _token_hash(token):
+    # Tokens are 256 random bits, so a fast hash is enough
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class SessionTokenCache:
+    """Short-lived tokens for users who already passed password verification.
+
+    A token is kept in st.session_state after login, so reruns only need a
+    dictionary lookup instead of another password check. Expiry slides
+    forward every time a token is used.
+    """
+
+    def __init__(self, ttl_seconds=1800):
+        self.ttl_seconds = ttl_seconds
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._tokens[token] = (username, time.monotonic() + self.ttl_seconds)
+        return token
+
+    def validate(self, token):
+        """Return the username for a live token, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            username, expires_at = entry
+            if expires_at < now:
+                del self._tokens[token]
+                return None
+            self._tokens[token] = (username, now + self.ttl_seconds)
+            return username
+
+    def revoke(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for token in [t for t, (_, expires_at) in self._tokens.items() if expires_at < now]:
+                del self._tokens[token]
+
+_auth_handler = None
+_auth_handler_lock = threading.Lock()
+
+def get_auth_handler():
+    """Return the process-wide AuthHandler, creating it on first use."""
+    global _auth_handler
+    if _auth_handler is None:
+        with _auth_handler_lock:
+            if _auth_handler is None:
+                _auth_handler = AuthHandler()
+    return _auth_handler
 
 def show_login_page():
     st.title("Welcome to AI Chat")
@@ -65,7 +210,7 @@ def show_login_page():
     if 'username' not in st.session_state:
         st.session_state['username'] = None
 
-    auth = AuthHandler()
+    auth = get_auth_handler()
 
     # Tabs for Login and Sign Up
     tab1, tab2 = st.tabs(["Login", "Sign Up"])
@@ -77,13 +222,24 @@ def show_login_page():
         login_password = st.text_input("Password", type="password", key="login_password")
         
         if st.button("Login"):
-            if auth.login_user(login_username, login_password):
+            try:
+                authenticated = auth.login_user(login_username, login_password)
+            except PasswordPoolBusy as e:
+                st.warning(str(e))
+                authenticated = False
+            except FuturesTimeoutError:
+                st.warning("Login is taking too long, please try again.")
+                authenticated = False
+            else:
+                if not authenticated:
+                    st.error("Invalid username or password")
+            if authenticated:
+                auth.sessions.purge_expired()
+                st.session_state['auth_token'] = auth.sessions.issue(login_username)
                 st.session_state['logged_in'] = True
                 st.session_state['username'] = login_username
                 st.success(f"Welcome back, {login_username}!")
                 st.rerun()
-            else:
-                st.error("Invalid username or password")
 
     # Sign Up Tab
     with tab2:
@@ -96,17 +252,42 @@ def show_login_page():
         if st.button("Sign Up"):
             if new_password != confirm_password:
                 st.error("Passwords do not match!")
-            elif auth.user_exists(username=new_username):
+                return
+            username_taken, email_taken = auth.check_availability(new_username, new_email)
+            if username_taken:
                 st.error("Username already exists!")
-            elif auth.user_exists(email=new_email):
+            elif email_taken:
                 st.error("Email already registered!")
             elif len(new_password) < 6:
                 st.error("Password must be at least 6 characters long!")
             elif not '@' in new_email:
                 st.error("Please enter a valid email address!")
             else:
-                if auth.register_user(new_username, new_email, new_password):
+                try:
+                    registered = auth.register_user(new_username, new_email, new_password)
+                except PasswordPoolBusy as e:
+                    st.warning(str(e))
+                    return
+                except FuturesTimeoutError:
+                    st.warning("Registration is taking too long, please try again.")
+                    return
+                if registered:
                     st.success("Registration successful! Please login.")
                     st.session_state['logged_in'] = False  # Ensure user needs to login
                 else:
-                    st.error("Registration failed. Please try again.") 
\ No newline at end of file
+                    st.error("Registration failed. Please try again.")
+
+def is_session_authenticated():
+    """Check the cached session token instead of re-verifying the password."""
+    token = st.session_state.get('auth_token')
+    if not token:
+        return False
+    username = get_auth_handler().sessions.validate(token)
+    return username is not None and username == st.session_state.get('username')
+
+def logout():
+    token = st.session_state.pop('auth_token', None)
+    if token:
+        get_auth_handler().sessions.revoke(token)
+    st.session_state['logged_in'] = False
+    st.session_state['username'] = None
@@ -0,0 +1,124 @@
+"""Latency, real-time factor and word error rate of the Whisper backends.
+
+Run from the repository root:
+
+    python benchmarks/bench_asr.py --testset ./asr_testset
+    python benchmarks/bench_asr.py --testset ./asr_testset --backends onnx --threads 1 2 4
+
+The test set is a directory of recordings (any format librosa or ffmpeg can
+read), each with a reference transcript of the same name: ``clip1.wav`` and
+``clip1.txt``. Every backend is built from the ``whisper`` section of
+config.yaml, warmed up on the first clip, then times every clip. WER is
+computed over the whole set, after lowercasing and removing punctuation.
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# Modules under test read config.yaml relative to the working directory
+os.chdir(REPO_ROOT)
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".webm", ".m4a")
+
+def load_testset(directory):
+    from audio_handler import convert_bytes_to_array
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        reference_path = os.path.join(directory, stem + ".txt")
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.exists(reference_path):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            audio = convert_bytes_to_array(f.read())
+        with open(reference_path, encoding="utf-8") as f:
+            reference = f.read()
+        clips.append({"name": name, "audio": audio, "reference": reference})
+    return clips
+
+def normalize(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+def edit_distance(reference, hypothesis):
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+def run_backend(label, settings, clips, vad):
+    from audio_handler import SAMPLE_RATE, create_transcriber, trim_silence
+
+    start = time.perf_counter()
+    transcriber = create_transcriber(settings)
+    load_s = time.perf_counter() - start
+    transcriber.transcribe(clips[0]["audio"])
+
+    latencies, errors, words, audio_s = [], 0, 0, 0.0
+    for clip in clips:
+        audio = clip["audio"]
+        start = time.perf_counter()
+        if vad:
+            audio, _ = trim_silence(audio)
+        hypothesis = transcriber.transcribe(audio) if len(audio) else ""
+        latencies.append(time.perf_counter() - start)
+        reference = normalize(clip["reference"])
+        errors += edit_distance(reference, normalize(hypothesis))
+        words += len(reference)
+        audio_s += len(clip["audio"]) / SAMPLE_RATE
+
+    result = {
+        "backend": label,
+        "load_s": load_s,
+        "median_latency_s": statistics.median(latencies),
+        "real_time_factor": sum(latencies) / audio_s,
+        "wer": errors / max(words, 1),
+    }
+    print(f"{label:<28} {load_s:>7.2f}s {result['median_latency_s']:>9.3f}s {result['real_time_factor']:>7.3f} "
+          f"{result['wer']:>7.2%}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--testset", required=True, help="directory of recordings and .txt transcripts")
+    parser.add_argument("--backends", nargs="+", default=["transformers", "onnx"], choices=["transformers", "onnx"])
+    parser.add_argument("--threads", nargs="+", type=int, help="onnx intra-op thread counts to compare")
+    parser.add_argument("--vad", action="store_true", help="trim silence first, as transcribe_audio does")
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    from utils import get_config
+
+    clips = load_testset(args.testset)
+    if not clips:
+        sys.exit(f"No recordings with transcripts in {args.testset}")
+    print(f"{len(clips)} clips from {args.testset}")
+
+    base_settings = get_config().get("whisper", {})
+    report = []
+    print(f"\n{'backend':<28} {'load':>8} {'latency':>10} {'RTF':>7} {'WER':>7}")
+    for backend in args.backends:
+        settings = copy.deepcopy(base_settings)
+        settings["backend"] = backend
+        if backend == "onnx" and args.threads:
+            for threads in args.threads:
+                settings.setdefault("onnx", {})["intra_op_threads"] = threads
+                report.append(run_backend(f"onnx[threads={threads}]", settings, clips, args.vad))
+        else:
+            report.append(run_backend(backend, settings, clips, args.vad))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": report}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
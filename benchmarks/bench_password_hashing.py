@@ -0,0 +1,79 @@
+"""Measure login throughput for different scrypt cost settings.
+
+Run from the repository root:
+
+    python benchmarks/bench_password_hashing.py --workers 2 --logins 40
+
+For each candidate ``n`` it reports the latency of a single verification and
+the logins per second the bounded worker pool sustains, so ``auth.scrypt_n``
+and ``auth.hash_workers`` in config.yaml can be sized against expected peak
+login rates.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_hashing import PasswordHasher, PasswordWorkerPool
+
+def bench_cost(n, r, p, workers, logins):
+    hasher = PasswordHasher(n=n, r=r, p=p)
+    encoded = hasher.hash("correct horse battery staple")
+
+    latencies = []
+    for _ in range(5):
+        start = time.perf_counter()
+        hasher.verify("correct horse battery staple", encoded)
+        latencies.append(time.perf_counter() - start)
+
+    pool = PasswordWorkerPool(hasher, max_workers=workers, max_pending=logins)
+    # Simulate a burst of sessions all logging in at once
+    with ThreadPoolExecutor(max_workers=logins) as clients:
+        start = time.perf_counter()
+        results = list(clients.map(
+            lambda _: pool.verify("correct horse battery staple", encoded), range(logins)
+        ))
+        elapsed = time.perf_counter() - start
+    pool.shutdown()
+    assert all(results)
+
+    return {
+        "n": n,
+        "memory_mib": 128 * r * n / (1024 * 1024),
+        "verify_ms": statistics.median(latencies) * 1000,
+        "logins_per_s": logins / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--costs", type=int, nargs="+", default=[2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16],
+                        help="scrypt n values to try (powers of two)")
+    parser.add_argument("-r", type=int, default=8)
+    parser.add_argument("-p", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2, help="hashing worker threads")
+    parser.add_argument("--logins", type=int, default=40, help="concurrent logins per burst")
+    parser.add_argument("--target-ms", type=float, default=250.0,
+                        help="highest acceptable single-login verification time")
+    args = parser.parse_args()
+
+    print(f"{'n':>8} {'MiB/hash':>9} {'verify ms':>10} {'logins/s':>9}")
+    recommended = None
+    for n in args.costs:
+        result = bench_cost(n, args.r, args.p, args.workers, args.logins)
+        print(f"{result['n']:>8} {result['memory_mib']:>9.1f} {result['verify_ms']:>10.1f} "
+              f"{result['logins_per_s']:>9.1f}")
+        if result["verify_ms"] <= args.target_ms:
+            recommended = result
+
+    if recommended:
+        print(f"\nHighest cost within {args.target_ms:.0f} ms: scrypt_n={recommended['n']} "
+              f"({recommended['logins_per_s']:.1f} logins/s with {args.workers} workers)")
+    else:
+        print(f"\nNo tested cost verifies within {args.target_ms:.0f} ms")
+
+if __name__ == "__main__":
+    main()
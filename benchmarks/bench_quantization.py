@@ -0,0 +1,110 @@
+"""Memory savings and recall loss of SimpleVectorDB's storage modes.
+
+Run from the repository root:
+
+    python benchmarks/bench_quantization.py --vectors 100000 --dim 768
+    python benchmarks/bench_quantization.py --db-path ./simple_db --queries 500
+
+Without ``--db-path`` the vectors are synthetic: unit vectors scattered
+around random cluster centres, so that nearest neighbours are meaningful.
+With it, the exact vectors of an existing SimpleVectorDB are used. Queries
+are stored vectors plus noise. For every storage mode (and with re-ranking,
+for the quantized ones) the report shows the memory held for search,
+recall@k against exact float32 search, and the median query time.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+from benchmarks.fakes import FakeEmbedder, random_unit_matrix
+
+def clustered_vectors(count, dim, clusters, spread, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = random_unit_matrix(clusters, dim, seed=seed + 1)
+    vectors = centres[rng.integers(0, clusters, count)] + rng.standard_normal((count, dim), dtype=np.float32) * spread
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def make_queries(vectors, count, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)] + \
+        rng.standard_normal((count, vectors.shape[1]), dtype=np.float32) * noise
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def evaluate(db, queries, truth, k):
+    recalls, durations = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = db.search_by_vector(query, k)
+        durations.append(time.perf_counter() - start)
+        recalls.append(len(set(found) & set(expected)) / k)
+    return statistics.mean(recalls), statistics.median(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-path", help="use the vectors of an existing SimpleVectorDB")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=0.05, help="noise around each cluster centre")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=0.03)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-candidates", type=int, default=100)
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    from embeddings import GeminiEmbeddingProvider
+    from vectordb_handler import SimpleVectorDB
+
+    if args.db_path:
+        source = SimpleVectorDB(args.db_path, embedder=GeminiEmbeddingProvider(client=FakeEmbedder()),
+                                storage="float32")
+        vectors = np.array(source.exact)
+        print(f"{len(vectors)} vectors of dimension {vectors.shape[1]} from {args.db_path}")
+    else:
+        vectors = clustered_vectors(args.vectors, args.dim, args.clusters, args.spread)
+        print(f"{len(vectors)} synthetic vectors of dimension {args.dim}")
+    embedder = GeminiEmbeddingProvider(client=FakeEmbedder(vectors.shape[1]))
+    queries = make_queries(vectors, args.queries, args.query_noise)
+    # Ground truth: exact float32 search
+    truth = [np.argsort(-(vectors @ query))[:args.k] for query in queries]
+
+    cases = [("float32", 0), ("float16", 0), ("float16", args.rerank_candidates),
+             ("int8", 0), ("int8", args.rerank_candidates)]
+    report = []
+    print(f"\n{'storage':<10} {'rerank':>7} {'search memory':>14} {'saving':>8} {'recall@' + str(args.k):>10} "
+          f"{'query':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage, rerank in cases:
+            db_path = os.path.join(tmp, storage)
+            db = SimpleVectorDB(db_path, embedder=embedder, storage=storage, rerank_candidates=rerank)
+            if not db.texts:
+                db.add_embeddings([str(i) for i in range(len(vectors))], vectors)
+            memory = db.memory_usage()
+            recall, query_s = evaluate(db, queries, truth, args.k)
+            saving = 1 - memory["search_bytes"] / memory["float32_bytes"]
+            report.append({"storage": storage, "rerank_candidates": rerank, "search_bytes": memory["search_bytes"],
+                           "float32_bytes": memory["float32_bytes"], "saving": saving,
+                           "recall": recall, "median_query_s": query_s})
+            print(f"{storage:<10} {rerank or '-':>7} {memory['search_bytes'] / 2 ** 20:>11.1f} MiB "
+                  f"{saving:>7.0%} {recall:>10.4f} {query_s * 1000:>8.2f}ms")
+            del db
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": report}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
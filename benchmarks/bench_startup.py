@@ -0,0 +1,103 @@
+"""Measure how long ``import app`` takes in a fresh interpreter.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py --runs 5
+
+Each run starts a new Python process, so the numbers match a container
+restart. The script fails (exit code 1) if the median import time exceeds
+the budget, or if importing app pulls in any of the heavy libraries that
+should only load once their feature is used.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall time allowed for `import app` before the login page can render
+IMPORT_BUDGET_MS = 1500
+
+# Must not be imported until the feature that needs them is used
+DEFERRED_MODULES = [
+    "chromadb",
+    "google.generativeai",
+    "langchain",
+    "librosa",
+    "onnxruntime",
+    "PIL",
+    "pypdfium2",
+    "torch",
+    "transformers",
+]
+
+PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({'elapsed': elapsed, "
+    "'loaded': sorted(m for m in %r if m in sys.modules)}))\n"
+) % (DEFERRED_MODULES,)
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def run_probe():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=REPO_ROOT,
+                            capture_output=True, text=True)
+    process_elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import app failed:\n{result.stderr}")
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    probe["process_elapsed"] = process_elapsed
+    return probe
+
+def slowest_app_imports(limit):
+    """Return the slowest modules imported directly by app, per -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # importtime indents two spaces per level; app itself sits at one space
+        if match and len(match.group(3)) == 3:
+            timings.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(timings, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    probes = [run_probe() for _ in range(args.runs)]
+    import_ms = statistics.median(p["elapsed"] for p in probes) * 1000
+    process_ms = statistics.median(p["process_elapsed"] for p in probes) * 1000
+    loaded = sorted({m for p in probes for m in p["loaded"]})
+
+    print(f"import app: {import_ms:.0f} ms median over {args.runs} runs "
+          f"({process_ms:.0f} ms including interpreter start)")
+    print("Slowest imports made by app:")
+    for cumulative_ms, module in slowest_app_imports(args.top):
+        print(f"  {cumulative_ms:8.1f} ms  {module}")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: deferred modules imported at startup: {', '.join(loaded)}")
+        failed = True
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import time {import_ms:.0f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print(f"OK: within {args.budget_ms:.0f} ms budget")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Offline stand-ins for the benchmarks: a deterministic embedder and synthetic inputs.
+
+Nothing here touches the network, and the same arguments always produce the
+same output, so benchmark runs are comparable across machines and commits.
+"""
+import hashlib
+import io
+import math
+import random
+import struct
+import wave
+
+import numpy as np
+
+WORDS = (
+    "retrieval augmented generation embeds document chunks into vectors and "
+    "answers questions from the closest passages found in the knowledge base "
+    "while the chat history keeps earlier turns available to the language model"
+).split()
+
+class FakeEmbedder:
+    """Drop-in for the Gemini embedding model used by VectorDB and SimpleVectorDB.
+
+    Every text maps to a fixed unit vector derived from its SHA-256 digest.
+    """
+
+    def __init__(self, dim=768):
+        self.dim = dim
+        self.calls = 0
+
+    def embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        return vector
+
+    def embed_content(self, model=None, content=None, **kwargs):
+        self.calls += 1
+        # Like genai.embed_content, a list of texts gets a list of embeddings
+        if isinstance(content, list):
+            return {"embedding": [self.embed(text).tolist() for text in content]}
+        return {"embedding": self.embed(content).tolist()}
+
+def random_unit_matrix(rows, dim, seed=0):
+    """Return ``rows`` random unit vectors as a float32 matrix."""
+    matrix = np.random.default_rng(seed).standard_normal((rows, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+def make_text(words, seed=0):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def make_texts(count, words=150, seed=0):
+    return [make_text(words, seed=seed + i) for i in range(count)]
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages=10, lines_per_page=40, seed=0):
+    """Build a valid text-only PDF with ``pages`` pages of generated prose."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_numbers = []
+    for page in range(pages):
+        lines = [make_text(12, seed=seed * 100003 + page * 1000 + line) for line in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(
+            f"({_pdf_escape(line)}) '" for line in lines
+        ) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes))
+        content_number = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number
+        )
+        page_numbers.append(len(objects))
+    kids = " ".join(f"{number} 0 R" for number in page_numbers).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref_offset = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+              % (len(objects) + 1, xref_offset))
+    return out.getvalue()
+
+def make_wav(seconds=5.0, sample_rate=16000, speech_ratio=0.6, seed=0):
+    """Build a mono 16-bit WAV: tone bursts standing in for speech, separated by silence."""
+    rng = random.Random(seed)
+    total = int(seconds * sample_rate)
+    burst = int(0.5 * sample_rate)
+    samples = []
+    while len(samples) < total:
+        if rng.random() < speech_ratio:
+            frequency = rng.uniform(120, 300)
+            samples.extend(
+                int(12000 * math.sin(2 * math.pi * frequency * i / sample_rate) + rng.gauss(0, 300))
+                for i in range(burst)
+            )
+        else:
+            samples.extend(int(rng.gauss(0, 30)) for _ in range(burst))
+    samples = [max(-32768, min(32767, s)) for s in samples[:total]]
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(struct.pack(f"<{len(samples)}h", *samples))
+    return out.getvalue()
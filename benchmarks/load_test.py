@@ -0,0 +1,269 @@
+"""Drive many concurrent chat sessions against a local stub LLM server.
+
+Run from the repository root:
+
+    python benchmarks/load_test.py --sessions 50 --turns 5 --endpoint gemini
+    python benchmarks/load_test.py --sessions 20 --mode pdf --latency-ms 800 --error-rate 0.05
+    python benchmarks/load_test.py --sessions 10 --mode ingest --pdf-pages 20
+
+Each simulated session runs in its own thread, like a Streamlit session, and
+goes through the same code as app.py: save the user message, call
+ChatAPIHandler.chat, save the answer. In ``ingest`` mode every turn also
+uploads a synthetic PDF through add_documents_to_db. Model and embedding
+calls go to benchmarks/stub_llm_server.py. The tool starts the stub unless
+``--stub-url`` is given. Chroma and the chat database use a temporary
+directory, so the real data is never touched.
+
+Reports p50/p95/p99 turn latency, throughput, time spent waiting on SQLite
+writes, and resident memory per session.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+from benchmarks.fakes import make_pdf, make_text
+from benchmarks.stub_llm_server import ERROR_MESSAGE
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak rather than current RSS, but the best available off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_stub(args):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "benchmarks", "stub_llm_server.py"),
+         "--port", str(port),
+         "--latency-ms", str(args.latency_ms),
+         "--jitter-ms", str(args.jitter_ms),
+         "--embed-latency-ms", str(args.embed_latency_ms),
+         "--error-rate", str(args.error_rate)],
+        stdout=subprocess.PIPE, text=True
+    )
+    process.stdout.readline()  # wait for the "listening" line
+    return process, f"http://127.0.0.1:{port}"
+
+def fetch_stub_stats(url):
+    try:
+        with urllib.request.urlopen(f"{url}/stats", timeout=5) as response:
+            return json.load(response)
+    except OSError:
+        return None
+
+def is_error_answer(answer):
+    return (not isinstance(answer, str) or ERROR_MESSAGE in answer
+            or answer.startswith("Error") or answer.startswith("All models failed"))
+
+class Session(threading.Thread):
+    def __init__(self, number, args, db_manager, start_barrier):
+        super().__init__(name=f"session-{number}", daemon=True)
+        self.number = number
+        self.args = args
+        self.db_manager = db_manager
+        self.start_barrier = start_barrier
+        self.chat_history = []
+        self.turn_latencies = []
+        self.ingest_latencies = []
+        self.db_waits = []
+        self.errors = 0
+
+    def timed_save(self, sender_type, content):
+        start = time.perf_counter()
+        self.db_manager.message_repo.save_message(
+            f"load-test-{self.number}", sender_type, "text", content, username=f"user{self.number}"
+        )
+        self.db_waits.append(time.perf_counter() - start)
+
+    def run(self):
+        from chat_api_handler import ChatAPIHandler
+        from pdf_handler import add_documents_to_db
+
+        self.start_barrier.wait()
+        for turn in range(self.args.turns):
+            start = time.perf_counter()
+            try:
+                if self.args.mode == "ingest":
+                    pdf = io.BytesIO(make_pdf(pages=self.args.pdf_pages, seed=self.number * 1000 + turn))
+                    ingest_start = time.perf_counter()
+                    add_documents_to_db([pdf], chunk_size=1000, chunk_overlap=200)
+                    self.ingest_latencies.append(time.perf_counter() - ingest_start)
+
+                user_input = make_text(20, seed=self.number * 1000 + turn)
+                self.timed_save("user", user_input)
+                self.chat_history.append({"role": "user", "content": user_input})
+                answer = ChatAPIHandler.chat(
+                    user_input=user_input,
+                    chat_history=self.chat_history,
+                    endpoint=self.args.endpoint,
+                    model=self.args.model,
+                    pdf_chat=self.args.mode in ("pdf", "ingest"),
+                    retrieved_documents=self.args.retrieved_documents,
+                )
+                if is_error_answer(answer):
+                    self.errors += 1
+                self.timed_save("assistant", str(answer))
+                self.chat_history.append({"role": "assistant", "content": str(answer)})
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name} turn {turn} failed: {e}", file=sys.__stderr__)
+            self.turn_latencies.append(time.perf_counter() - start)
+            if self.args.think_ms:
+                time.sleep(self.args.think_ms / 1000)
+
+def configure_app(args, stub_url, workdir):
+    """Point the shared config at the stub server and a throwaway data directory."""
+    from utils import get_config
+    config = get_config()
+    config["gemini"]["api_endpoint"] = stub_url
+    config["openai"]["base_url"] = f"{stub_url}/v1"
+    config["chromadb"]["chromadb_path"] = os.path.join(workdir, "chroma_db")
+    # Opened as soon as database_operations is imported
+    config["chat_sessions_database_path"] = os.path.join(workdir, "chat_sessions.db")
+    config["session_archive"] = {**config.get("session_archive", {}), "directory": os.path.join(workdir, "archive")}
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per session")
+    parser.add_argument("--mode", choices=["chat", "pdf", "ingest"], default="chat")
+    parser.add_argument("--endpoint", choices=["gemini", "openai"], default="gemini")
+    parser.add_argument("--model", default=None, help="defaults to the configured model for the endpoint")
+    parser.add_argument("--retrieved-documents", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between turns")
+    parser.add_argument("--stub-url", help="use an already running stub server")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="also write the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own print output")
+    args = parser.parse_args()
+
+    stub_process = None
+    stub_url = args.stub_url
+    if not stub_url:
+        stub_process, stub_url = start_stub(args)
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    try:
+        configure_app(args, stub_url, workdir)
+        from utils import get_config
+        if args.model is None:
+            args.model = get_config()[args.endpoint]["model"]
+
+        from database_operations import DatabaseManager
+        db_manager = DatabaseManager(get_config()["chat_sessions_database_path"])
+
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            if args.mode == "pdf":
+                # One shared knowledge base for every session
+                from pdf_handler import add_documents_to_db
+                add_documents_to_db([io.BytesIO(make_pdf(pages=args.pdf_pages))],
+                                    chunk_size=1000, chunk_overlap=200)
+
+            # Load everything the sessions need before measuring memory
+            import chat_api_handler  # noqa: F401
+            import pdf_handler  # noqa: F401
+            if args.endpoint == "gemini" or args.mode != "chat":
+                from utils import get_genai
+                get_genai()
+            if args.mode != "chat":
+                import vectordb_handler  # noqa: F401
+
+            rss_before = rss_bytes()
+            start_barrier = threading.Barrier(args.sessions + 1)
+            sessions = [Session(i, args, db_manager, start_barrier) for i in range(args.sessions)]
+            for session in sessions:
+                session.start()
+            start_barrier.wait()
+            started = time.perf_counter()
+            for session in sessions:
+                session.join()
+            elapsed = time.perf_counter() - started
+            rss_after = rss_bytes()
+
+        turn_latencies = [t for s in sessions for t in s.turn_latencies]
+        ingest_latencies = [t for s in sessions for t in s.ingest_latencies]
+        db_waits = [t for s in sessions for t in s.db_waits]
+        errors = sum(s.errors for s in sessions)
+        report = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+            "wall_time_s": elapsed,
+            "turns": len(turn_latencies),
+            "errors": errors,
+            "throughput_turns_per_s": len(turn_latencies) / elapsed if elapsed else None,
+            "turn_latency_s": percentiles(turn_latencies),
+            "ingest_latency_s": percentiles(ingest_latencies),
+            "sqlite_write_wait_s": dict(percentiles(db_waits), total=sum(db_waits)),
+            "memory_per_session_bytes": max(0, rss_after - rss_before) / args.sessions,
+            "rss_bytes": rss_after,
+            "stub_stats": fetch_stub_stats(stub_url),
+        }
+        db_manager.close()
+    finally:
+        if stub_process:
+            stub_process.terminate()
+            stub_process.wait()
+
+    def ms(value):
+        return "n/a" if value is None else f"{value * 1000:.1f} ms"
+
+    print(f"{args.sessions} sessions x {args.turns} turns ({args.mode}, {args.endpoint}) "
+          f"in {report['wall_time_s']:.2f} s")
+    print(f"  throughput:        {report['throughput_turns_per_s']:.2f} turns/s")
+    print(f"  errors:            {errors} of {report['turns']} turns")
+    latency = report["turn_latency_s"]
+    print(f"  turn latency:      p50 {ms(latency['p50'])}  p95 {ms(latency['p95'])}  p99 {ms(latency['p99'])}")
+    if ingest_latencies:
+        ingest = report["ingest_latency_s"]
+        print(f"  ingest latency:    p50 {ms(ingest['p50'])}  p95 {ms(ingest['p95'])}  p99 {ms(ingest['p99'])}")
+    waits = report["sqlite_write_wait_s"]
+    print(f"  sqlite write wait: p50 {ms(waits['p50'])}  p95 {ms(waits['p95'])}  p99 {ms(waits['p99'])}  "
+          f"total {waits['total']:.2f} s")
+    print(f"  memory/session:    {report['memory_per_session_bytes'] / 1024:.0f} KiB "
+          f"(RSS {report['rss_bytes'] / 1024 / 1024:.0f} MiB)")
+    if report["stub_stats"]:
+        print(f"  stub server:       {report['stub_stats']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
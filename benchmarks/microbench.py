@@ -0,0 +1,278 @@
+"""Microbenchmarks for the ingestion and retrieval hot paths.
+
+Run from the repository root:
+
+    python benchmarks/microbench.py                         # default sizes
+    python benchmarks/microbench.py --full                  # up to 1M vectors
+    python benchmarks/microbench.py --save-baseline         # record a baseline
+    python benchmarks/microbench.py --baseline benchmarks/results/baseline.json
+
+Everything runs offline: embeddings come from benchmarks.fakes.FakeEmbedder,
+and PDFs and audio are generated. Stores and databases live in temporary
+directories, including the chat database that importing database_operations
+opens, so the app's data is never touched. Results are written as JSON. When a baseline
+is given, every case whose median got slower than ``--threshold`` is reported,
+and the exit code is 1.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# Modules under test read config.yaml relative to the working directory
+os.chdir(REPO_ROOT)
+
+from benchmarks.fakes import FakeEmbedder, make_pdf, make_texts, make_wav, random_unit_matrix
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, "latest.json")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+
+def isolate_app_data(workdir):
+    """Point the paths the app opens on import at ``workdir``; call before importing app modules."""
+    from utils import get_config
+    config = get_config()
+    config["chat_sessions_database_path"] = os.path.join(workdir, "chat_sessions.db")
+    config["session_archive"] = {**config.get("session_archive", {}), "directory": os.path.join(workdir, "archive")}
+
+def measure(fn, repeat, setup=None, teardown=None):
+    """Time ``fn`` ``repeat`` times, calling ``setup`` before and ``teardown`` after each run, untimed."""
+    durations = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state) if setup else fn()
+        durations.append(time.perf_counter() - start)
+        if teardown:
+            teardown(state)
+    return {
+        "median_s": statistics.median(durations),
+        "min_s": min(durations),
+        "max_s": max(durations),
+        "runs": repeat,
+    }
+
+def bench_extract_text_from_pdf(args, record):
+    from pdf_handler import extract_text_from_pdf
+    for pages in args.pdf_pages:
+        pdf_bytes = make_pdf(pages=pages)
+        result = measure(lambda: extract_text_from_pdf(pdf_bytes), args.repeat)
+        result["pages_per_s"] = pages / result["median_s"]
+        record(f"extract_text_from_pdf[pages={pages}]", result)
+
+def bench_get_text_chunks(args, record):
+    from pdf_handler import get_text_chunks
+    for megabytes in args.text_mb:
+        size = megabytes * 1024 * 1024
+        text = " ".join(make_texts(200)) + " "
+        text = (text * (size // len(text) + 1))[:size]
+        result = measure(lambda: get_text_chunks(text, chunk_size=1000, chunk_overlap=200), args.repeat)
+        result["mb_per_s"] = megabytes / result["median_s"]
+        record(f"get_text_chunks[mb={megabytes}]", result)
+
+def bench_simple_vectordb(args, record):
+    from vectordb_handler import SimpleVectorDB
+    embedder = FakeEmbedder(dim=args.dim)
+
+    for count in args.add_sizes:
+        texts = make_texts(count, words=40)
+
+        def setup():
+            tmp = tempfile.TemporaryDirectory()
+            return tmp, SimpleVectorDB(db_path=tmp.name, model=embedder)
+
+        def run(state):
+            tmp, db = state
+            db.add_texts(texts)
+
+        result = measure(run, args.repeat, setup=setup, teardown=lambda state: state[0].cleanup())
+        result["texts_per_s"] = count / result["median_s"]
+        record(f"SimpleVectorDB.add_texts[n={count},dim={args.dim}]", result)
+
+    for count in args.vector_sizes:
+        vectors = random_unit_matrix(count, args.dim)
+        for storage in ("float32", "int8"):
+            with tempfile.TemporaryDirectory() as tmp:
+                db = SimpleVectorDB(db_path=tmp, model=embedder, storage=storage)
+                # Bulk-load precomputed vectors; embedding cost is measured above
+                db.add_embeddings([f"chunk {i}" for i in range(count)], vectors)
+                queries = iter(make_texts(args.repeat * 2, words=8, seed=count))
+                result = measure(lambda: db.similarity_search(next(queries), k=4), args.repeat)
+                result["queries_per_s"] = 1 / result["median_s"]
+                record(f"SimpleVectorDB.similarity_search[n={count},dim={args.dim},storage={storage}]", result)
+                del db
+
+def bench_message_repository(args, record):
+    from database_operations import DatabaseManager
+
+    for rows in args.message_rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = DatabaseManager(os.path.join(tmp, "bench.db"))
+            repo = manager.message_repo
+            texts = make_texts(200, words=60)
+            sessions = max(1, rows // 50)
+            # Bulk-fill so each timed case starts from a large table
+            with manager.db_connection.connection as conn:
+                conn.executemany(
+                    "INSERT INTO messages (chat_history_id, sender_type, message_type, text_content) "
+                    "VALUES (?, ?, 'text', ?)",
+                    ((f"session-{i % sessions}", "user" if i % 2 else "assistant", texts[i % len(texts)])
+                     for i in range(rows))
+                )
+                conn.commit()
+            big_session = "session-big"
+            with manager.db_connection.connection as conn:
+                conn.executemany(
+                    "INSERT INTO messages (chat_history_id, sender_type, message_type, text_content) "
+                    "VALUES (?, 'user', 'text', ?)",
+                    ((big_session, texts[i % len(texts)]) for i in range(args.session_length))
+                )
+                conn.commit()
+
+            saves = 200
+            result = measure(
+                lambda: [repo.save_message("session-new", "user", "text", texts[i % len(texts)])
+                         for i in range(saves)],
+                args.repeat
+            )
+            result["saves_per_s"] = saves / result["median_s"]
+            record(f"MessageRepository.save_message[rows={rows}]", result)
+
+            record(f"MessageRepository.load_messages[rows={rows},session={args.session_length}]",
+                   measure(lambda: repo.load_messages(big_session), args.repeat))
+            record(f"MessageRepository.load_last_k_text_messages[rows={rows}]",
+                   measure(lambda: repo.load_last_k_text_messages(big_session, 4), args.repeat))
+            record(f"MessageRepository.get_all_chat_history_ids[rows={rows}]",
+                   measure(repo.get_all_chat_history_ids, args.repeat))
+            manager.close()
+
+def bench_convert_bytes_to_array(args, record):
+    from audio_handler import convert_bytes_to_array
+    for seconds in args.audio_seconds:
+        wav_bytes = make_wav(seconds=seconds)
+        result = measure(lambda: convert_bytes_to_array(wav_bytes), args.repeat)
+        result["realtime_factor"] = result["median_s"] / seconds
+        record(f"convert_bytes_to_array[seconds={seconds}]", result)
+
+def bench_trim_silence(args, record):
+    import wave
+    import numpy as np
+    from audio_handler import trim_silence
+    for seconds in args.audio_seconds:
+        with wave.open(io.BytesIO(make_wav(seconds=seconds)), "rb") as wav_file:
+            audio = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2").astype(np.float32) / 32768
+        result = measure(lambda: trim_silence(audio), args.repeat)
+        # Share of the recording that still goes to Whisper
+        result["kept_ratio"] = len(trim_silence(audio)[0]) / len(audio)
+        record(f"trim_silence[seconds={seconds}]", result)
+
+        # Room noise only, as in a push-to-talk clip nobody spoke into
+        noise = np.random.default_rng(0).normal(0, 10 ** (-40 / 20), int(seconds * 16000)).astype(np.float32)
+        result = measure(lambda: trim_silence(noise), args.repeat)
+        result["kept_ratio"] = len(trim_silence(noise)[0]) / len(noise)
+        record(f"trim_silence[noise_only,seconds={seconds}]", result)
+        if result["kept_ratio"]:
+            raise RuntimeError(f"VAD kept {result['kept_ratio']:.0%} of a noise-only clip")
+
+BENCHMARKS = {
+    "pdf": bench_extract_text_from_pdf,
+    "chunks": bench_get_text_chunks,
+    "vectordb": bench_simple_vectordb,
+    "messages": bench_message_repository,
+    "audio": bench_convert_bytes_to_array,
+    "vad": bench_trim_silence,
+}
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the names of regressed cases."""
+    regressions = []
+    print(f"\n{'case':<70} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "median_s" not in base or "median_s" not in result:
+            continue
+        change = result["median_s"] / base["median_s"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<70} {base['median_s'] * 1000:>8.2f}ms {result['median_s'] * 1000:>8.2f}ms "
+              f"{change * 100:>+7.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run a subset")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--full", action="store_true", help="include the 1M-vector and 1M-row cases")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension for vector cases")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write {DEFAULT_BASELINE}")
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    args.pdf_pages = [10, 100]
+    args.text_mb = [1, 10]
+    args.add_sizes = [1000, 10000]
+    args.vector_sizes = [10000, 100000] + ([1000000] if args.full else [])
+    args.message_rows = [10000, 100000] + ([1000000] if args.full else [])
+    args.session_length = 1000
+    args.audio_seconds = [5, 30]
+
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        print(f"{name:<70} {result['median_s'] * 1000:>10.2f} ms")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        isolate_app_data(workdir)
+        for key in args.only or list(BENCHMARKS):
+            try:
+                BENCHMARKS[key](args, record)
+            except ImportError as e:
+                print(f"{key}: skipped ({e})")
+                results[f"{key}[skipped]"] = {"skipped": str(e)}
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "dim": args.dim,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {DEFAULT_BASELINE}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than baseline by more than "
+                  f"{args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Local stand-in for the Gemini and OpenAI HTTP APIs.
+
+Run from the repository root:
+
+    python benchmarks/stub_llm_server.py --port 8765 --latency-ms 400 --error-rate 0.02
+
+Then point the app at it in config.yaml (``gemini.api_endpoint`` and
+``openai.base_url``) or let benchmarks/load_test.py start it for you.
+
+Routes:
+    POST /v1beta/models/<model>:generateContent     Gemini text generation
+    POST /v1beta/models/<model>:streamGenerateContent  Gemini streamed generation
+    POST /v1beta/models/<model>:embedContent        Gemini embeddings
+    POST /v1beta/models/<model>:batchEmbedContents  Gemini batched embeddings
+    POST /v1/chat/completions                       OpenAI chat completions, streamed if "stream" is set
+    GET  /v1/models                                 OpenAI model listing
+    GET  /stats                                     request and error counters
+
+Generation requests wait ``latency-ms`` (plus jitter) before answering.
+Embedding requests wait ``embed-latency-ms``. A fraction ``error-rate`` of
+requests fails with HTTP 500.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ERROR_MESSAGE = "stub injected error"
+
+class StubState:
+    def __init__(self, latency_ms, jitter_ms, embed_latency_ms, error_rate, dim, seed):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.embed_latency_ms = embed_latency_ms
+        self.error_rate = error_rate
+        self.dim = dim
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "generate": 0, "embed": 0, "chat_completions": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters[key] += 1
+
+    def should_fail(self):
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.counters["errors"] += 1
+            return failed
+
+    def sleep(self, base_ms):
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        time.sleep(max(0.0, base_ms + jitter) / 1000)
+
+    def embedding(self, text):
+        # Deterministic unit vector, so retrieval results are stable between runs
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dim)]
+        norm = sum(v * v for v in vector) ** 0.5
+        return [v / norm for v in vector]
+
+def _gemini_text(content):
+    if isinstance(content, dict):
+        return " ".join(part.get("text", "") for part in content.get("parts", []))
+    return str(content)
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _fail(self):
+            self._send(500, {"error": {"code": 500, "message": ERROR_MESSAGE, "status": "INTERNAL"}})
+
+        def _stream_chat_completion(self, request, text, prompt_chars):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": request.get("model", "stub")}
+            for word in text.split(" "):
+                chunk = dict(base, choices=[{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(text) // 4,
+                     "total_tokens": (prompt_chars + len(text)) // 4}
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/stats":
+                with state.lock:
+                    self._send(200, dict(state.counters))
+            elif path == "/v1/models":
+                self._send(200, {"object": "list", "data": [
+                    {"id": "gpt-3.5-turbo", "object": "model"},
+                    {"id": "gpt-4", "object": "model"},
+                ]})
+            else:
+                self._send(404, {"error": {"code": 404, "message": f"Unknown route {path}"}})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            request = self._read_json()
+
+            if path.endswith(":generateContent") or path.endswith(":streamGenerateContent"):
+                state.count("generate")
+                state.sleep(state.latency_ms)
+                if state.should_fail():
+                    return self._fail()
+                prompt = " ".join(_gemini_text(c) for c in request.get("contents", []))
+                text = f"Stub answer to a {len(prompt)}-character prompt."
+                usage = {
+                    "promptTokenCount": len(prompt) // 4,
+                    "candidatesTokenCount": len(text) // 4,
+                    "totalTokenCount": (len(prompt) + len(text)) // 4,
+                }
+                if path.endswith(":streamGenerateContent"):
+                    # The REST transport reads a streamed JSON array of partial responses
+                    words = text.split(" ")
+                    return self._send(200, [
+                        {
+                            "candidates": [{
+                                "content": {"parts": [{"text": word + " "}], "role": "model"},
+                                "index": 0,
+                                **({"finishReason": "STOP"} if i == len(words) - 1 else {}),
+                            }],
+                            **({"usageMetadata": usage} if i == len(words) - 1 else {}),
+                        }
+                        for i, word in enumerate(words)
+                    ])
+                self._send(200, {
+                    "candidates": [{
+                        "content": {"parts": [{"text": text}], "role": "model"},
+                        "finishReason": "STOP",
+                        "index": 0,
+                    }],
+                    "usageMetadata": usage,
+                })
+            elif path.endswith(":embedContent"):
+                state.count("embed")
+                state.sleep(state.embed_latency_ms)
+                if state.should_fail():
+                    return self._fail()
+                self._send(200, {"embedding": {"values": state.embedding(_gemini_text(request.get("content", "")))}})
+            elif path.endswith(":batchEmbedContents"):
+                state.count("embed")
+                state.sleep(state.embed_latency_ms)
+                if state.should_fail():
+                    return self._fail()
+                self._send(200, {"embeddings": [
+                    {"values": state.embedding(_gemini_text(item.get("content", "")))}
+                    for item in request.get("requests", [])
+                ]})
+            elif path == "/v1/chat/completions":
+                state.count("chat_completions")
+                state.sleep(state.latency_ms)
+                if state.should_fail():
+                    return self._fail()
+                messages = request.get("messages", [])
+                prompt_chars = sum(len(json.dumps(m.get("content", ""))) for m in messages)
+                text = f"Stub answer to {len(messages)} messages."
+                if request.get("stream"):
+                    return self._stream_chat_completion(request, text, prompt_chars)
+                self._send(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_chars // 4,
+                        "completion_tokens": len(text) // 4,
+                        "total_tokens": (prompt_chars + len(text)) // 4,
+                    },
+                })
+            else:
+                self._send(404, {"error": {"code": 404, "message": f"Unknown route {path}"}})
+
+    return StubHandler
+
+def make_server(host="127.0.0.1", port=8765, latency_ms=300.0, jitter_ms=0.0,
+                embed_latency_ms=20.0, error_rate=0.0, dim=768, seed=0):
+    state = StubState(latency_ms, jitter_ms, embed_latency_ms, error_rate, dim, seed)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="generation latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter on latency")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, args.jitter_ms,
+                         args.embed_latency_ms, args.error_rate, args.dim, args.seed)
+    print(f"Stub LLM server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
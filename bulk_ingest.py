@@ -0,0 +1,348 @@
+# Local Multimodal AI Chat - Multimodal chat application with Gemini
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Bulk-load a directory tree of PDFs into the configured Chroma collection.
+
+By default the files go to the shared collection, which every user searches
+alongside their own uploads; ``--username`` loads them for one user only.
+
+    python bulk_ingest.py /data/corpus --extract-workers 8 --embed-workers 8
+    python bulk_ingest.py /data/corpus --restart        # ignore the checkpoint
+
+The work runs as a pipeline, with a bounded queue between each stage:
+
+    extract (process pool) -> chunk -> embed (threads) -> write (one thread)
+
+Text extraction is CPU-bound and runs across processes. Embedding waits on
+the model API and runs on threads. The writer upserts to Chroma in batches of
+``--write-batch`` chunks. Bounded queues keep memory flat: a slow stage makes
+the earlier ones wait instead of buffering the whole corpus.
+
+Each file is recorded in a checkpoint database once all of its chunks are
+written. A rerun skips files that are recorded and unchanged (same size and
+mtime). Any other file has its earlier chunks deleted before it is written
+again, so a file that changed or was interrupted half-way leaves no stale
+chunks behind.
+
+If a stage fails, the others stop and the loader exits with status 1.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from database_operations import BaseRepository, DatabaseConnection
+from pdf_handler import get_text_chunks
+from utils import get_config
+
+config = get_config()
+ingestion_config = config.get("ingestion", {})
+
+# Queue sentinel: the producing stage has finished
+_DONE = object()
+
+# How often a stage blocked on a queue checks whether another stage failed
+_STOP_CHECK_SECONDS = 0.5
+
+class _Stopped(Exception):
+    """Another stage failed; unwinds a stage without reporting it as failed too."""
+
+class BulkCheckpointRepository(BaseRepository):
+    """Files already loaded by the bulk loader, keyed by absolute path."""
+
+    def create_table(self) -> None:
+        with self.db.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bulk_ingest_files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    pages INTEGER,
+                    chunks INTEGER,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                );
+            """)
+
+    def load_completed(self) -> Dict[str, Any]:
+        """Map path -> (size, mtime) for every fully written file."""
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT path, size, mtime FROM bulk_ingest_files WHERE status = 'done'"
+            ).fetchall()
+            return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+    def record(self, path: str, size: int, mtime: float, status: str, pages: Optional[int] = None,
+               chunks: Optional[int] = None, error: Optional[str] = None) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bulk_ingest_files "
+                "(path, size, mtime, status, pages, chunks, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime, status, pages, chunks, error, time.time())
+            )
+
+    def clear(self) -> None:
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM bulk_ingest_files")
+
+def find_pdfs(root):
+    """Yield (path, size, mtime) for every PDF under ``root``, in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".pdf"):
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                stat = os.stat(path)
+                yield path, stat.st_size, stat.st_mtime
+
+def extract_file(path):
+    """Process-pool task: return (path, pages, text) or raise."""
+    from pdf_handler import extract_pages_from_pdf
+    pages = extract_pages_from_pdf(path)
+    return path, len(pages), "\n".join(pages)
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.files = self.pages = self.chunks = self.skipped = self.failed = 0
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def rates(self):
+        elapsed = time.perf_counter() - self.started
+        return elapsed, self.pages / elapsed if elapsed else 0.0, self.chunks / elapsed if elapsed else 0.0
+
+class BulkIngestor:
+    def __init__(self, checkpoint, vector_db, args):
+        self.checkpoint = checkpoint
+        self.vector_db = vector_db
+        self.args = args
+        self.stats = Stats()
+        self.extracted = queue.Queue(maxsize=args.queue_size)
+        self.to_embed = queue.Queue(maxsize=args.queue_size)
+        self.to_write = queue.Queue(maxsize=args.queue_size)
+        # path -> [size, mtime, pages, chunks, chunks still to be written]
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.failed = threading.Event()
+
+    def run(self, files):
+        stages = [threading.Thread(target=self._guard, args=(self._extract_stage, files), name="extract")]
+        stages.append(threading.Thread(target=self._guard, args=(self._chunk_stage,), name="chunk"))
+        stages += [threading.Thread(target=self._guard, args=(self._embed_stage,), name=f"embed-{i}")
+                   for i in range(self.args.embed_workers)]
+        stages.append(threading.Thread(target=self._guard, args=(self._write_stage,), name="write"))
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+        for stage in stages:
+            stage.join()
+        return not self.failed.is_set()
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except _Stopped:
+            pass
+        except Exception as e:
+            # Everything written so far is in the checkpoint, so a rerun continues from there
+            print(f"Bulk ingestion stage {threading.current_thread().name} failed: {str(e)}",
+                  file=sys.stderr)
+            self.failed.set()
+
+    def _put(self, q, item):
+        # A plain put() would block forever once the consuming stage has stopped
+        while True:
+            if self.failed.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=_STOP_CHECK_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        while True:
+            if self.failed.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=_STOP_CHECK_SECONDS)
+            except queue.Empty:
+                pass
+
+    def _extract_stage(self, files):
+        # Keep a bounded number of files in flight in the process pool
+        max_in_flight = self.args.extract_workers * 2
+        # Spawned, not forked: this process already runs Chroma's native threads
+        with ProcessPoolExecutor(max_workers=self.args.extract_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            in_flight = {}
+            files = iter(files)
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    entry = next(files, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(extract_file, entry[0])] = entry
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, size, mtime = in_flight.pop(future)
+                    try:
+                        _, pages, text = future.result()
+                    except Exception as e:
+                        print(f"Could not extract {path}: {str(e)}", file=sys.stderr)
+                        self.checkpoint.record(path, size, mtime, "failed", error=str(e))
+                        self.stats.add(failed=1)
+                        continue
+                    self._put(self.extracted, (path, size, mtime, pages, text))
+        self._put(self.extracted, _DONE)
+
+    def _chunk_stage(self):
+        batch_size = self.args.embed_batch
+        while (item := self._get(self.extracted)) is not _DONE:
+            path, size, mtime, pages, text = item
+            chunks = get_text_chunks(text, self.args.chunk_size, self.args.chunk_overlap)
+            if not chunks:
+                self.checkpoint.record(path, size, mtime, "done", pages=pages, chunks=0)
+                self.stats.add(files=1, pages=pages)
+                continue
+            with self.pending_lock:
+                self.pending[path] = [size, mtime, pages, len(chunks), len(chunks)]
+            # Also the document id, so one file can be deleted or searched alone
+            prefix = hashlib.sha1(path.encode()).hexdigest()[:16]
+            # An earlier version of the file may have had more chunks than this one
+            self.vector_db.delete_document(prefix)
+            for start in range(0, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                positions = range(start, start + len(batch))
+                ids = [f"{prefix}-{i}" for i in positions]
+                metadatas = [{"document_id": prefix, "source": path, "chunk": i,
+                              "chunk_overlap": self.args.chunk_overlap} for i in positions]
+                self._put(self.to_embed, (path, batch, ids, metadatas))
+        for _ in range(self.args.embed_workers):
+            self._put(self.to_embed, _DONE)
+
+    def _embed_stage(self):
+        while (item := self._get(self.to_embed)) is not _DONE:
+            path, texts, ids, metadatas = item
+            self._put(self.to_write, (path, texts, self.vector_db.embed_texts(texts), ids, metadatas))
+        self._put(self.to_write, _DONE)
+
+    def _write_stage(self):
+        producers_left = self.args.embed_workers
+        texts, embeddings, ids, metadatas, paths = [], [], [], [], []
+        while producers_left:
+            item = self._get(self.to_write)
+            if item is _DONE:
+                producers_left -= 1
+            else:
+                path, batch_texts, batch_embeddings, batch_ids, batch_metadatas = item
+                texts += batch_texts
+                embeddings += batch_embeddings
+                ids += batch_ids
+                metadatas += batch_metadatas
+                paths += [path] * len(batch_texts)
+            if len(texts) >= self.args.write_batch or (not producers_left and texts):
+                self._flush(texts, embeddings, ids, metadatas, paths)
+                texts, embeddings, ids, metadatas, paths = [], [], [], [], []
+
+    def _flush(self, texts, embeddings, ids, metadatas, paths):
+        self.vector_db.add_embeddings(texts, embeddings, ids, metadatas)
+        self.stats.add(chunks=len(texts))
+        written = {}
+        for path in paths:
+            written[path] = written.get(path, 0) + 1
+        for path, count in written.items():
+            with self.pending_lock:
+                entry = self.pending[path]
+                entry[4] -= count
+                if entry[4] > 0:
+                    continue
+                del self.pending[path]
+            size, mtime, pages, chunks, _ = entry
+            self.checkpoint.record(path, size, mtime, "done", pages=pages, chunks=chunks)
+            self.stats.add(files=1, pages=pages)
+        elapsed, pages_per_s, chunks_per_s = self.stats.rates()
+        print(f"[{elapsed:7.1f}s] files {self.stats.files}  chunks {self.stats.chunks}  "
+              f"{pages_per_s:.1f} pages/s  {chunks_per_s:.1f} chunks/s", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load a directory tree of PDFs into Chroma.")
+    parser.add_argument("root", help="directory to search for PDFs, recursively")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1,
+                        help="processes extracting text")
+    parser.add_argument("--embed-workers", type=int, default=4, help="threads calling the embedding model")
+    parser.add_argument("--embed-batch", type=int, default=32, help="chunks per embedding task")
+    parser.add_argument("--write-batch", type=int, default=2000, help="chunks per Chroma upsert")
+    parser.add_argument("--queue-size", type=int, default=64, help="capacity of each queue between stages")
+    parser.add_argument("--checkpoint", default=ingestion_config.get("bulk_checkpoint_path",
+                                                                     "./bulk_ingest_checkpoint.db"))
+    parser.add_argument("--restart", action="store_true", help="forget the checkpoint and load every file")
+    parser.add_argument("--username", help="load into this user's collection instead of the shared one")
+    args = parser.parse_args()
+
+    if args.chunk_overlap >= args.chunk_size:
+        parser.error("--chunk-overlap must be smaller than --chunk-size")
+
+    checkpoint = BulkCheckpointRepository(DatabaseConnection(args.checkpoint))
+    checkpoint.create_table()
+    if args.restart:
+        checkpoint.clear()
+    completed = checkpoint.load_completed()
+
+    from vectordb_handler import load_vectordb
+    vector_db = load_vectordb(args.username)
+    # Chroma rejects upserts larger than its maximum batch size
+    args.write_batch = min(args.write_batch, vector_db.client.get_max_batch_size())
+
+    ingestor = BulkIngestor(checkpoint, vector_db, args)
+
+    def files_to_load():
+        for path, size, mtime in find_pdfs(args.root):
+            if completed.get(path) == (size, mtime):
+                ingestor.stats.add(skipped=1)
+                continue
+            yield path, size, mtime
+
+    completed_ok = ingestor.run(files_to_load())
+
+    stats = ingestor.stats
+    elapsed, pages_per_s, chunks_per_s = stats.rates()
+    print(f"Loaded {stats.files} files ({stats.pages} pages, {stats.chunks} chunks) in {elapsed:.1f} s")
+    print(f"  throughput: {pages_per_s:.1f} pages/s, {chunks_per_s:.1f} chunks/s")
+    print(f"  skipped (already loaded): {stats.skipped}, failed: {stats.failed}")
+    if not completed_ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,18 @@
-from utils import convert_bytes_to_base64_with_prefix, load_config, convert_bytes_to_base64
-from vectordb_handler import load_vectordb
-from dotenv import load_dotenv
+from utils import convert_bytes_to_base64_with_prefix, get_genai, get_config
+from telemetry import span, increment
 import streamlit as st
 import requests
+import json
 import os
-import google.generativeai as genai
-import PIL.Image
 import io
-# vectordb_handler.py
-import os
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules['pysqlite3']
-
-import chromadb
-# ... rest of your imports and code
-
-load_dotenv()
-config = load_config()
 
-# Configure Gemini
-genai.configure(
-    api_key=config["gemini"]["api_key"],
-    transport="rest"
-)
+def record_token_usage(endpoint, model, prompt_tokens, completion_tokens):
+    if prompt_tokens:
+        increment("llm_tokens_total", prompt_tokens, "Tokens sent to and received from models",
+                  endpoint=endpoint, model=model, kind="prompt")
+    if completion_tokens:
+        increment("llm_tokens_total", completion_tokens, "Tokens sent to and received from models",
+                  endpoint=endpoint, model=model, kind="completion")
 
 class GeminiChatAPIHandler:
     AVAILABLE_MODELS = [
@@ -39,55 +28,100 @@ class GeminiChatAPIHandler:
     def __init__(self):
         pass
 
+    @classmethod
+    def generate(cls, model_name, contents):
+        """Run one generate_content call, traced and with token usage recorded."""
+        with span("llm.call", endpoint="gemini", model=model_name) as call_span:
+            model = get_genai().GenerativeModel(model_name)
+            response = model.generate_content(contents)
+            # Not streamed, so the first token arrives with the whole answer
+            call_span.mark_first_token()
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                record_token_usage("gemini", model_name, usage.prompt_token_count,
+                                   usage.candidates_token_count)
+            return response.text
+
     @classmethod
     def try_models(cls, prompt):
         """Try different models and return the first successful response"""
         for model_name in cls.AVAILABLE_MODELS:
             try:
                 print(f"Trying model: {model_name}")
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
+                text = cls.generate(model_name, prompt)
                 print(f"Success with model: {model_name}")
-                return response.text
+                return text
             except Exception as e:
                 print(f"Error with model {model_name}: {str(e)}")
+                increment("llm_retries_total", 1, "Model calls retried with another model",
+                          endpoint="gemini", model=model_name)
                 continue
         return "All models failed. Please check your API key and permissions."
 
     @classmethod
-    def api_call(cls, chat_history):
-        try:
-            # Initialize the model with the correct model name
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
+    def build_prompt(cls, chat_history):
+        with span("prompt.build", messages=len(chat_history)):
             # Prepare the conversation as a single string with clear separation
             messages = []
             for message in chat_history:
                 prefix = "User: " if message["role"] == "user" else "Assistant: "
                 messages.append(f"{prefix}{message['content']}")
-            
-            # Generate response
-            prompt = "\n".join(messages)
-            response = model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            print(f"Error with gemini-2.0-flash, trying gemini-pro: {str(e)}")
+            return "\n".join(messages)
+
+    @classmethod
+    def api_call(cls, chat_history, model=None):
+        # Starts with the model picked in the UI (or the configured one) and
+        # falls back to the configured model
+        configured = get_config()["gemini"]["model"]
+        model_names = list(dict.fromkeys([model or configured, configured]))
+        prompt = cls.build_prompt(chat_history)
+
+        for model_name, next_model in zip(model_names, model_names[1:] + [None]):
             try:
-                # Fallback to gemini-pro if flash fails
-                model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(prompt)
-                return response.text
+                return cls.generate(model_name, prompt)
             except Exception as e:
-                print(f"Error with gemini-pro: {str(e)}")
-                return f"Error: {str(e)}"
+                if next_model is None:
+                    print(f"Error with {model_name}: {str(e)}")
+                    return f"Error: {str(e)}"
+                print(f"Error with {model_name}, trying {next_model}: {str(e)}")
+                increment("llm_retries_total", 1, "Model calls retried with another model",
+                          endpoint="gemini", model=model_name)
+
+    @classmethod
+    def api_call_stream(cls, chat_history, model=None):
+        """Yield the answer in pieces as Gemini generates it.
+
+        If the stream fails before anything was sent, falls back to api_call.
+        """
+        model_name = model or get_config()["gemini"]["model"]
+        prompt = cls.build_prompt(chat_history)
+        started = False
+        try:
+            with span("llm.call", endpoint="gemini", model=model_name, stream=True) as call_span:
+                response = get_genai().GenerativeModel(model_name).generate_content(prompt, stream=True)
+                for chunk in response:
+                    if not started:
+                        call_span.mark_first_token()
+                        started = True
+                    yield chunk.text
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    record_token_usage("gemini", model_name, usage.prompt_token_count,
+                                       usage.candidates_token_count)
+        except Exception as e:
+            if started:
+                print(f"Gemini stream interrupted: {str(e)}")
+                yield f"\nError: {str(e)}"
+                return
+            print(f"Error streaming with {model_name}, retrying without streaming: {str(e)}")
+            yield cls.api_call(chat_history, model=model)
 
     @classmethod
-    def image_chat(cls, user_input, chat_history, image):
+    def image_chat(cls, user_input, chat_history, image, model=None):
         try:
-            model = genai.GenerativeModel('gemini-pro-vision')
+            import PIL.Image
             img = PIL.Image.open(io.BytesIO(image))
-            response = model.generate_content([user_input, img])
-            return response.text
+            return cls.generate('gemini-pro-vision', [user_input, img])
         except Exception as e:
             print(f"Error with image chat: {str(e)}")
             return f"Error: {str(e)}"
@@ -97,9 +131,9 @@ class OpenAIChatAPIHandler:
         pass
 
     @classmethod
-    def api_call(cls, chat_history):
+    def api_call(cls, chat_history, model=None):
         data = {
-            "model": st.session_state["model_to_use"],
+            "model": model or st.session_state["model_to_use"],
             "messages": chat_history,
             "stream": False
         }
@@ -109,20 +143,71 @@ class OpenAIChatAPIHandler:
             "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"
         }
 
-        response = requests.post(
-            url="https://api.openai.com/v1/chat/completions",
-            json=data,
-            headers=headers
-        )
-        print(response.json())
+        base_url = get_config()["openai"].get("base_url", "https://api.openai.com/v1")
+        with span("llm.call", endpoint="openai", model=data["model"]) as call_span:
+            response = requests.post(
+                url=f"{base_url}/chat/completions",
+                json=data,
+                headers=headers
+            )
+            call_span.mark_first_token()
         json_response = response.json()
+        print(json_response)
         if "error" in json_response.keys():
             return json_response["error"]["message"]
-        else:
-            return response.json()["choices"][0]["message"]["content"]
+        usage = json_response.get("usage") or {}
+        record_token_usage("openai", data["model"], usage.get("prompt_tokens"),
+                           usage.get("completion_tokens"))
+        return json_response["choices"][0]["message"]["content"]
 
     @classmethod
-    def image_chat(cls, user_input, chat_history, image):
+    def api_call_stream(cls, chat_history, model=None):
+        """Yield the answer in pieces from OpenAI's server-sent event stream."""
+        model = model or st.session_state["model_to_use"]
+        data = {
+            "model": model,
+            "messages": chat_history,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"
+        }
+
+        base_url = get_config()["openai"].get("base_url", "https://api.openai.com/v1")
+        with span("llm.call", endpoint="openai", model=model, stream=True) as call_span:
+            with requests.post(url=f"{base_url}/chat/completions", json=data,
+                               headers=headers, stream=True) as response:
+                if response.status_code != 200:
+                    try:
+                        yield response.json()["error"]["message"]
+                    except (ValueError, KeyError):
+                        yield f"Error: HTTP {response.status_code}"
+                    return
+                started = False
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[len(b"data: "):]
+                    if payload == b"[DONE]":
+                        break
+                    event = json.loads(payload)
+                    usage = event.get("usage")
+                    if usage:
+                        record_token_usage("openai", model, usage.get("prompt_tokens"),
+                                           usage.get("completion_tokens"))
+                    for choice in event.get("choices", []):
+                        delta = choice.get("delta", {}).get("content")
+                        if delta:
+                            if not started:
+                                call_span.mark_first_token()
+                                started = True
+                            yield delta
+
+    @classmethod
+    def image_chat(cls, user_input, chat_history, image, model=None):
         chat_history.append({
             "role": "user",
             "content": [
@@ -130,17 +215,23 @@ class OpenAIChatAPIHandler:
                 {"type": "image_url", "image_url": {"url": convert_bytes_to_base64_with_prefix(image)}}
             ]
         })
-        return cls.api_call(chat_history)
+        return cls.api_call(chat_history, model=model)
 
 class ChatAPIHandler:
     def __init__(self):
         pass
 
     @classmethod
-    def chat(cls, user_input, chat_history, image=None):
-        endpoint = st.session_state["endpoint_to_use"]
+    def resolve_handler(cls, endpoint=None, model=None, pdf_chat=None):
+        """Fill in unset settings from st.session_state and pick the endpoint handler."""
+        if endpoint is None:
+            endpoint = st.session_state["endpoint_to_use"]
+        if model is None:
+            model = st.session_state["model_to_use"]
+        if pdf_chat is None:
+            pdf_chat = st.session_state.get("pdf_chat", False)
         print(f"Endpoint to use: {endpoint}")
-        print(f"Model to use: {st.session_state['model_to_use']}")
+        print(f"Model to use: {model}")
         
         if endpoint == "openai":
             handler = OpenAIChatAPIHandler
@@ -148,17 +239,60 @@ class ChatAPIHandler:
             handler = GeminiChatAPIHandler
         else:
             raise ValueError(f"Unknown endpoint: {endpoint}")
+        return handler, endpoint, model, pdf_chat
+
+    @classmethod
+    def add_user_turn(cls, user_input, chat_history, pdf_chat, retrieved_documents=None,
+                      username=None, document_ids=None):
+        """Append the user turn, with retrieved PDF context in PDF chat mode.
 
-        if st.session_state.get("pdf_chat", False):
-            vector_db = load_vectordb()
-            retrieved_documents = vector_db.similarity_search(user_input, k=st.session_state.retrieved_documents)
-            context = "\n".join([item.page_content for item in retrieved_documents])
+        Context comes from ``username``'s documents (and the shared ones),
+        narrowed to ``document_ids`` if given.
+        """
+        if not pdf_chat:
+            chat_history.append({"role": "user", "content": user_input})
+            return
+        if retrieved_documents is None:
+            retrieved_documents = st.session_state.retrieved_documents
+        with span("vectordb.load"):
+            # chromadb is heavy to import, so only load it for PDF chat
+            from vectordb_handler import load_vectordb
+            vector_db = load_vectordb(username)
+        from context_builder import build_context, context_settings
+        settings = context_settings()
+        # Over-fetch, so merged and duplicate chunks leave room for other passages
+        query_embedding, candidates = vector_db.search_candidates(
+            user_input, k=retrieved_documents * settings["overfetch"], document_ids=document_ids
+        )
+        with span("prompt.context", candidates=len(candidates)) as context_span:
+            passages = build_context(candidates, query_embedding, retrieved_documents, settings)
+            context_span.set_attribute("documents", len(passages))
+            context = "\n".join([item.page_content for item in passages])
             template = f"Answer the user question based on this context: {context}\nUser Question: {user_input}"
             chat_history.append({"role": "user", "content": template})
-            return handler.api_call(chat_history)
-        
-        if image:
-            return handler.image_chat(user_input, chat_history, image)
-        
-        chat_history.append({"role": "user", "content": user_input})
-        return handler.api_call(chat_history)
\ No newline at end of file
+
+    @classmethod
+    def chat(cls, user_input, chat_history, image=None, endpoint=None, model=None,
+             pdf_chat=None, retrieved_documents=None, username=None, document_ids=None):
+        """Answer ``user_input``, appending the prompt sent to the model to ``chat_history``.
+
+        Settings that are not passed explicitly are read from st.session_state,
+        so the Streamlit app can keep calling this with just the message.
+        """
+        handler, endpoint, model, pdf_chat = cls.resolve_handler(endpoint, model, pdf_chat)
+
+        with span("chat.turn", endpoint=endpoint, model=model, pdf_chat=bool(pdf_chat), image=bool(image)):
+            if image and not pdf_chat:
+                return handler.image_chat(user_input, chat_history, image, model=model)
+            cls.add_user_turn(user_input, chat_history, pdf_chat, retrieved_documents, username, document_ids)
+            return handler.api_call(chat_history, model=model)
+
+    @classmethod
+    def chat_stream(cls, user_input, chat_history, endpoint=None, model=None,
+                    pdf_chat=None, retrieved_documents=None, username=None, document_ids=None):
+        """Like chat, but yields the answer in pieces as the model produces them."""
+        handler, endpoint, model, pdf_chat = cls.resolve_handler(endpoint, model, pdf_chat)
+
+        with span("chat.turn", endpoint=endpoint, model=model, pdf_chat=bool(pdf_chat), stream=True):
+            cls.add_user_turn(user_input, chat_history, pdf_chat, retrieved_documents, username, document_ids)
+            yield from handler.api_call_stream(chat_history, model=model)
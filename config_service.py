@@ -0,0 +1,222 @@
+"""config.yaml, parsed and validated once per process and reloaded when it changes.
+
+    from utils import get_config, on_config_reload
+
+    model = get_config()["gemini"]["model"]
+    on_config_reload(lambda old, new: reset_client(), sections=("gemini",))
+
+``get_config()`` returns the current config as a plain dict, which is never
+modified: a reload swaps in a new dict. The file's mtime is checked at most
+every ``config.reload_check_seconds`` (2 s by default), on access and from a
+watcher thread, so edits are picked up without restarting the process.
+
+Values read at the time of use (model names, chunk and batch sizes, context
+and TTL settings) change on the next request. Objects built from the config
+(the Gemini client, embedding provider, Whisper model, vector DB handles)
+are dropped by the reload hooks of their modules and rebuilt on next use.
+Paths, ports, worker counts and the telemetry exporter are only read at
+startup and still need a restart.
+
+A file that fails to parse or validate is rejected with ConfigError at
+startup; on reload it is reported and the previous config stays in use.
+"""
+import os
+import threading
+import time
+
+import yaml
+
+class ConfigError(ValueError):
+    """config.yaml cannot be parsed or does not match SCHEMA."""
+
+# Types of the known settings; a tuple allows any of its types, None allows
+# null. Keys marked REQUIRED must be present. Unknown keys are accepted.
+REQUIRED = "required"
+NUMBER = (int, float)
+
+SCHEMA = {
+    "gemini": {
+        "api_key": (str, REQUIRED),
+        "model": (str, REQUIRED),
+        "vision_model": str,
+        "embedding_model": str,
+        "api_endpoint": (str, None),
+    },
+    "openai": {"api_key": (str, None), "model": (str, REQUIRED), "base_url": str},
+    "ollama": {"base_url": str, "model": str},
+    "whisper_model": (str, REQUIRED),
+    "whisper": {
+        "backend": str,
+        "onnx": {"model_path": str, "quantized": bool, "intra_op_threads": int,
+                 "language": (str, None), "max_new_tokens": int},
+    },
+    "vad": {"enabled": bool, "threshold_db": NUMBER, "min_level_db": NUMBER, "speech_level_db": NUMBER,
+            "min_speech_ms": NUMBER, "min_silence_ms": NUMBER, "padding_ms": NUMBER},
+    "embeddings": {
+        "provider": str,
+        "batch_size": int,
+        "onnx": {"model_path": str, "max_length": int, "intra_op_threads": int, "pooling": str,
+                 "normalize": bool},
+    },
+    "simple_vectordb": {"storage": str, "rerank_candidates": int},
+    "context": {"overfetch": int, "token_budget": int, "mmr_lambda": NUMBER, "duplicate_threshold": NUMBER,
+                "chars_per_token": NUMBER},
+    "single_flight": {"query_embedding_ttl_seconds": NUMBER, "retrieval_ttl_seconds": NUMBER,
+                      "model_list_ttl_seconds": NUMBER},
+    "chromadb": {"chromadb_path": (str, REQUIRED), "collection_name": (str, REQUIRED), "search_shared": bool},
+    "chat_sessions_database_path": (str, REQUIRED),
+    "session_archive": {"directory": str, "idle_days": NUMBER, "check_interval_hours": NUMBER,
+                        "compression_level": int, "vacuum_free_ratio": NUMBER},
+    "session_memory": {"window_messages": int, "page_size": int, "max_window_messages": int,
+                       "prompt_messages": int, "max_bytes": int},
+    "ingestion": {"spool_dir": str, "workers": int, "batch_size": int, "poll_interval_seconds": NUMBER,
+                  "stale_after_seconds": NUMBER, "max_attempts": int, "retry_delay_seconds": NUMBER,
+                  "bulk_checkpoint_path": str},
+    "auth": {"users_database_path": str, "scrypt_n": int, "scrypt_r": int, "scrypt_p": int, "hash_workers": int,
+             "max_pending_hashes": int, "session_ttl_seconds": NUMBER,
+             "api_token_ttl_days": NUMBER},
+    "api_server": {"host": str, "port": int, "workers": int, "api_key": (str, None)},
+    "telemetry": {"enabled": bool, "exporter": str, "prometheus_port": int, "log_spans": bool,
+                  "service_name": str},
+    "config": {"reload_check_seconds": NUMBER},
+}
+
+# Settings whose value must be one of a fixed set
+CHOICES = {
+    ("whisper", "backend"): ("transformers", "onnx"),
+    ("embeddings", "provider"): ("gemini", "onnx"),
+    ("embeddings", "onnx", "pooling"): ("mean", "cls"),
+    ("simple_vectordb", "storage"): ("float32", "float16", "int8"),
+    ("telemetry", "exporter"): ("prometheus", "otel"),
+}
+
+def _check(value, spec, path, problems):
+    if isinstance(spec, dict):
+        if not isinstance(value, dict):
+            problems.append(f"{path}: expected a section, got {type(value).__name__}")
+            return
+        for key, key_spec in spec.items():
+            key_path = f"{path}.{key}" if path else key
+            if key in value:
+                _check(value[key], key_spec, key_path, problems)
+            elif isinstance(key_spec, tuple) and REQUIRED in key_spec:
+                problems.append(f"{key_path}: missing")
+        return
+    allowed = spec if isinstance(spec, tuple) else (spec,)
+    if value is None:
+        if None not in allowed:
+            problems.append(f"{path}: must not be empty")
+        return
+    types = tuple(t for t in allowed if isinstance(t, type))
+    for t in allowed:
+        if isinstance(t, tuple):
+            types += t
+    # bool is an int subclass, but true is no valid worker count
+    if isinstance(value, bool) and bool not in types or not isinstance(value, types):
+        names = " or ".join(t.__name__ for t in types)
+        problems.append(f"{path}: expected {names}, got {type(value).__name__} {value!r}")
+
+def validate(data):
+    """Raise ConfigError listing every setting that does not match SCHEMA."""
+    if not isinstance(data, dict):
+        raise ConfigError("config.yaml must be a mapping of sections")
+    problems = []
+    _check(data, SCHEMA, "", problems)
+    for path, choices in CHOICES.items():
+        value = data
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None and value not in choices:
+            problems.append(f"{'.'.join(path)}: {value!r} is not one of {', '.join(choices)}")
+    if problems:
+        raise ConfigError("Invalid config.yaml:\n  " + "\n  ".join(problems))
+    return data
+
+def parse_config(file_path):
+    try:
+        with open(file_path, "r") as f:
+            data = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise ConfigError(f"Cannot parse {file_path}: {str(e)}") from e
+    return validate(data)
+
+def changed_sections(old, new):
+    """Top-level keys whose value differs between two configs."""
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+class ConfigService:
+    def __init__(self, file_path="config.yaml"):
+        # Scripts may change the working directory after the first read
+        self.file_path = os.path.abspath(file_path)
+        self._mtime = os.stat(file_path).st_mtime_ns
+        self._config = parse_config(file_path)
+        self._checked_at = time.monotonic()
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.version = 1
+
+    @property
+    def check_interval(self):
+        return self._config.get("config", {}).get("reload_check_seconds", 2)
+
+    def get(self):
+        """The current config; reloads first if the file changed since the last check."""
+        if self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self._config
+
+    def on_reload(self, callback, sections=None):
+        """Call ``callback(old, new)`` after reloads that change any of ``sections`` (or any at all)."""
+        with self._lock:
+            self._hooks.append((callback, set(sections) if sections else None))
+
+    def reload(self, force=False):
+        """Re-read the file if its mtime changed (always with ``force``). Returns True if the config changed."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.file_path).st_mtime_ns
+            except OSError as e:
+                print(f"Cannot check {self.file_path}: {str(e)}")
+                return False
+            if mtime == self._mtime and not force:
+                return False
+            self._mtime = mtime
+            try:
+                new = parse_config(self.file_path)
+            except (ConfigError, OSError) as e:
+                print(f"Ignoring changes to {self.file_path}: {str(e)}")
+                return False
+            old = self._config
+            changed = changed_sections(old, new)
+            if not changed:
+                return False
+            self._config = new
+            self.version += 1
+            hooks = [callback for callback, sections in self._hooks if sections is None or sections & changed]
+        print(f"Reloaded {self.file_path}: {', '.join(sorted(changed))} changed")
+        for callback in hooks:
+            try:
+                callback(old, new)
+            except Exception as e:
+                print(f"Config reload hook {getattr(callback, '__qualname__', callback)} failed: {str(e)}")
+        return True
+
+    def start_watcher(self):
+        """Check the file in the background, so hooks run even when nothing reads the config."""
+        with self._lock:
+            if self._watcher is not None or not self.check_interval:
+                return
+            self._watcher = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while self.check_interval:
+            time.sleep(self.check_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Config reload failed: {str(e)}")
+        with self._lock:
+            self._watcher = None
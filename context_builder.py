@@ -0,0 +1,164 @@
+"""Assemble retrieved PDF chunks into the context of a PDF-mode prompt.
+
+    passages = build_context(candidates, query_embedding, max_passages=4)
+
+``candidates`` are over-fetched Documents from VectorDB.search_candidates.
+They go through three steps:
+
+1. Merge: chunks of the same document with consecutive chunk numbers become
+   one passage, and the ``chunk_overlap`` characters they share (recorded in
+   the chunk metadata at ingestion) are kept once. Chunks stored without it
+   stay separate passages.
+2. Select: passages are picked by maximal marginal relevance, trading
+   similarity to the query against similarity to passages already picked.
+   A passage too similar to one already picked is dropped as a duplicate.
+3. Pack: passages are added until ``token_budget`` is reached.
+
+Token counts are estimated from the text length (``chars_per_token``), which
+is close enough for budgeting and needs no tokenizer.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from telemetry import increment, observe
+from utils import get_config
+
+@dataclass
+class Passage:
+    text: str
+    relevance: float
+    embedding: Optional[np.ndarray] = None
+    sources: List[str] = field(default_factory=list)
+
+    # Lets a Passage stand in for a Document when building the prompt
+    @property
+    def page_content(self):
+        return self.text
+
+def context_settings():
+    settings = get_config().get("context", {})
+    return {
+        "overfetch": settings.get("overfetch", 3),
+        "token_budget": settings.get("token_budget", 2000),
+        "mmr_lambda": settings.get("mmr_lambda", 0.7),
+        "duplicate_threshold": settings.get("duplicate_threshold", 0.95),
+        "chars_per_token": settings.get("chars_per_token", 4),
+    }
+
+def estimate_tokens(text, chars_per_token=4):
+    return max(1, len(text) // chars_per_token)
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def merge_overlap(first, second, overlap):
+    """Join two consecutive chunks; ``second`` starts with the last ``overlap`` characters of ``first``."""
+    return first + second[overlap:]
+
+def merge_adjacent(candidates, query_embedding=None):
+    """Turn retrieved Documents into Passages, merging runs of adjacent chunks."""
+    query = _unit(query_embedding) if query_embedding is not None else None
+
+    def relevance(document):
+        if query is not None and document.embedding is not None:
+            return float(_unit(document.embedding) @ query)
+        # Chroma's cosine distance
+        return 1.0 - (document.distance or 0.0)
+
+    groups = {}
+    passages = []
+    for document in candidates:
+        document_id = document.metadata.get("document_id")
+        chunk = document.metadata.get("chunk")
+        if document_id is None or chunk is None or document.metadata.get("chunk_overlap") is None:
+            passages.append(Passage(document.page_content, relevance(document),
+                                    _unit(document.embedding) if document.embedding is not None else None,
+                                    [document.metadata.get("source", "")]))
+        else:
+            groups.setdefault(document_id, {})[chunk] = document
+
+    for chunks in groups.values():
+        run = []
+        for number in sorted(chunks):
+            if run and number != run[-1][0] + 1:
+                passages.append(_passage_from_run(run, relevance))
+                run = []
+            run.append((number, chunks[number]))
+        passages.append(_passage_from_run(run, relevance))
+    return passages
+
+def _passage_from_run(run, relevance):
+    documents = [document for _, document in run]
+    text = documents[0].page_content
+    for document in documents[1:]:
+        text = merge_overlap(text, document.page_content, document.metadata["chunk_overlap"])
+    embeddings = [_unit(d.embedding) for d in documents if d.embedding is not None]
+    embedding = _unit(np.mean(embeddings, axis=0)) if embeddings else None
+    return Passage(text, max(relevance(d) for d in documents), embedding,
+                   [documents[0].metadata.get("source", "")])
+
+def select_passages(passages, max_passages, token_budget, mmr_lambda=0.7,
+                    duplicate_threshold=0.95, chars_per_token=4):
+    """Greedy MMR selection of ``passages`` into ``token_budget`` tokens."""
+    remaining = sorted(passages, key=lambda p: p.relevance, reverse=True)
+    selected, seen_texts = [], set()
+    budget = token_budget
+    duplicates = over_budget = 0
+
+    while remaining and len(selected) < max_passages and budget > 0:
+        best_index, best_score, best_redundancy = None, None, 0.0
+        for index, passage in enumerate(remaining):
+            redundancy = max(
+                (float(passage.embedding @ s.embedding) for s in selected
+                 if passage.embedding is not None and s.embedding is not None),
+                default=0.0,
+            )
+            score = mmr_lambda * passage.relevance - (1 - mmr_lambda) * redundancy
+            if best_score is None or score > best_score:
+                best_index, best_score, best_redundancy = index, score, redundancy
+        # By position: Passage equality would compare the embedding arrays
+        best = remaining.pop(best_index)
+
+        if best_redundancy >= duplicate_threshold or best.text in seen_texts:
+            duplicates += 1
+            continue
+        tokens = estimate_tokens(best.text, chars_per_token)
+        if tokens > budget:
+            if selected:
+                # Something shorter may still fit
+                over_budget += 1
+                continue
+            # The single most relevant passage is too long: keep its start
+            best = Passage(best.text[:budget * chars_per_token], best.relevance, best.embedding, best.sources)
+            tokens = budget
+        selected.append(best)
+        seen_texts.add(best.text)
+        budget -= tokens
+
+    increment("context_passages_dropped_total", duplicates, "Retrieved passages left out of the prompt",
+              reason="duplicate")
+    increment("context_passages_dropped_total", over_budget, "Retrieved passages left out of the prompt",
+              reason="budget")
+    return selected
+
+def build_context(candidates, query_embedding, max_passages, settings=None):
+    """Merge, deduplicate and pack ``candidates`` (best first) into passages."""
+    settings = settings or context_settings()
+    passages = merge_adjacent(candidates, query_embedding)
+    increment("context_chunks_merged_total", len(candidates) - len(passages),
+              "Retrieved chunks merged into an adjacent chunk")
+    selected = select_passages(
+        passages,
+        max_passages=max_passages,
+        token_budget=settings["token_budget"],
+        mmr_lambda=settings["mmr_lambda"],
+        duplicate_threshold=settings["duplicate_threshold"],
+        chars_per_token=settings["chars_per_token"],
+    )
+    observe("context_tokens", sum(estimate_tokens(p.text, settings["chars_per_token"]) for p in selected),
+            "Estimated tokens of retrieved context per PDF-mode turn")
+    return selected
@@ -1,9 +1,15 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Union
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple, Union
+import base64
+import hashlib
+import json
 import sqlite3
 import streamlit as st
-from utils import load_config
+from utils import get_config
+from telemetry import span, increment
 import threading
+import time
 import os # Added this import for directory operations
 
 # Constants
@@ -13,12 +19,18 @@ DEFAULT_CHUNK_SIZE = 1024
 DEFAULT_CHUNK_OVERLAP = 50
 
 class DatabaseConnection:
-    """Handles database connection management with thread safety."""
+    """Handles database connection management with thread safety.
+
+    One connection is shared by every thread. Repositories use it through
+    ``transaction()``, which serialises access so two sessions never interleave
+    statements on the same connection.
+    """
     
     def __init__(self, db_path: str):
         self.db_path = db_path
         self._connection = None
         self._lock = threading.Lock()
+        self._use_lock = threading.RLock()
 
     @property
     def connection(self) -> sqlite3.Connection:
@@ -29,11 +41,23 @@ class DatabaseConnection:
                 if db_dir: # Only create directory if a path is specified (not just a filename)
                     os.makedirs(db_dir, exist_ok=True)
                 
-                self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                # Wait for locks held by other processes (e.g. API server workers)
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
                 # It's good practice to set a row_factory for easier data access
                 self._connection.row_factory = sqlite3.Row 
+                # WAL lets readers in other processes proceed while one writes
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
             return self._connection
 
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Use the connection exclusively; commits on success, rolls back on error."""
+        with self._use_lock:
+            conn = self.connection
+            with conn:
+                yield conn
+
     def close(self) -> None:
         with self._lock:
             if self._connection:
@@ -50,11 +74,80 @@ class BaseRepository(ABC):
     def create_table(self) -> None:
         pass
 
+class SessionArchive:
+    """Zstandard-compressed files holding the messages of archived sessions.
+
+    One file per session, named after a hash of the session id (ids are
+    timestamps, which are not valid file names everywhere). The
+    ``archived_sessions`` table is the index from session id to file.
+    """
+
+    def __init__(self, directory: str, level: int = 10):
+        self.directory = directory
+        self.level = level
+
+    def path_for(self, chat_history_id: str) -> str:
+        digest = hashlib.sha256(chat_history_id.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json.zst")
+
+    def write(self, chat_history_id: str, rows: List[Dict[str, Any]]) -> Tuple[str, int]:
+        """Write the messages of one session; returns the file path and its size."""
+        import zstandard
+
+        messages = [
+            dict(row, blob_content=base64.b64encode(row['blob_content']).decode('ascii')
+                 if row['blob_content'] is not None else None)
+            for row in rows
+        ]
+        data = json.dumps({'chat_history_id': chat_history_id, 'messages': messages}).encode('utf-8')
+        compressed = zstandard.ZstdCompressor(level=self.level).compress(data)
+        path = self.path_for(chat_history_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Complete before the messages are deleted, even across a crash
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(compressed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return path, len(compressed)
+
+    @staticmethod
+    def read(path: str) -> List[Dict[str, Any]]:
+        import zstandard
+
+        with open(path, 'rb') as f:
+            data = zstandard.ZstdDecompressor().decompress(f.read())
+        messages = json.loads(data)['messages']
+        for message in messages:
+            if message['blob_content'] is not None:
+                message['blob_content'] = base64.b64decode(message['blob_content'])
+        return messages
+
+    @staticmethod
+    def remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 class MessageRepository(BaseRepository):
-    """Handles all message-related database operations."""
-    
+    """Handles all message-related database operations.
+
+    Sessions without new messages for a while can be moved out of the
+    ``messages`` table into a SessionArchive (see ``archive_session``). Every
+    method that reads or writes one session restores it first, so callers
+    never see the difference; listing includes archived sessions, but
+    full-text search only covers the sessions in the database.
+    """
+
+    def __init__(self, db_connection: DatabaseConnection, archive: Optional[SessionArchive] = None):
+        super().__init__(db_connection)
+        self.search_enabled = False
+        self.archive = archive
+
     def create_table(self) -> None:
-        with self.db.connection as conn:
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
@@ -63,31 +156,148 @@ class MessageRepository(BaseRepository):
                     sender_type TEXT NOT NULL,
                     message_type TEXT NOT NULL,
                     text_content TEXT,
-                    blob_content BLOB
+                    blob_content BLOB,
+                    username TEXT
+                );
+            """)
+            # Older databases were created without the owner column
+            columns = [row['name'] for row in cursor.execute("PRAGMA table_info(messages)")]
+            if 'username' not in columns:
+                cursor.execute("ALTER TABLE messages ADD COLUMN username TEXT")
+            # Loading and paging one session reads a range of this index
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_chat_history "
+                "ON messages (chat_history_id, message_id)"
+            )
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_activity'"
+            )
+            needs_backfill = cursor.fetchone() is None
+            # Time of the last message per session, to find idle sessions
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS session_activity (
+                    chat_history_id TEXT PRIMARY KEY,
+                    username TEXT,
+                    last_active REAL NOT NULL
+                );
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_session_activity_last_active "
+                "ON session_activity (last_active)"
+            )
+            if needs_backfill:
+                # Existing sessions count as active now, so they are archived
+                # only after a full idle period
+                cursor.execute(
+                    "INSERT OR IGNORE INTO session_activity (chat_history_id, username, last_active) "
+                    "SELECT chat_history_id, MAX(username), ? FROM messages GROUP BY chat_history_id",
+                    (time.time(),)
+                )
+            # Messages saved before the owner column existed have no username.
+            # Once per database (user_version 0 -> 1), give them the owner
+            # recorded for their session, so per-user search finds them.
+            # Sessions without a recorded owner stay unowned.
+            if cursor.execute("PRAGMA user_version").fetchone()[0] < 1:
+                cursor.execute("""
+                    UPDATE messages SET username = (
+                        SELECT s.username FROM session_activity s WHERE s.chat_history_id = messages.chat_history_id
+                    ) WHERE username IS NULL
+                """)
+                cursor.execute("PRAGMA user_version = 1")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS archived_sessions (
+                    chat_history_id TEXT PRIMARY KEY,
+                    username TEXT,
+                    archive_path TEXT NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    archived_bytes INTEGER NOT NULL,
+                    last_active REAL NOT NULL,
+                    archived_at REAL NOT NULL
                 );
             """)
             conn.commit()
+        self.create_search_index()
+
+    def create_search_index(self) -> None:
+        """Create the FTS5 index over text_content and the triggers that keep it in sync.
+
+        The index is an external-content table, so the text is not stored twice.
+        If this SQLite build has no FTS5 support, search is disabled.
+        """
+        try:
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+                )
+                needs_rebuild = cursor.fetchone() is None
+                cursor.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        text_content,
+                        content='messages',
+                        content_rowid='message_id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    );
+                """)
+                cursor.execute("""
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts(rowid, text_content)
+                        VALUES (new.message_id, new.text_content);
+                    END;
+                """)
+                cursor.execute("""
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts(messages_fts, rowid, text_content)
+                        VALUES ('delete', old.message_id, old.text_content);
+                    END;
+                """)
+                cursor.execute("""
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text_content ON messages BEGIN
+                        INSERT INTO messages_fts(messages_fts, rowid, text_content)
+                        VALUES ('delete', old.message_id, old.text_content);
+                        INSERT INTO messages_fts(rowid, text_content)
+                        VALUES (new.message_id, new.text_content);
+                    END;
+                """)
+                if needs_rebuild:
+                    # Index messages that were stored before the index existed
+                    cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+                conn.commit()
+            self.search_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search disabled: {str(e)}")
+            self.search_enabled = False
 
-    def save_message(self, chat_history_id: str, sender_type: str, 
-                     message_type: str, content: Union[str, bytes]) -> None:
-        with self.db.connection as conn:
+    def save_message(self, chat_history_id: str, sender_type: str,
+                     message_type: str, content: Union[str, bytes],
+                     username: Optional[str] = None) -> int:
+        """Store one message and return its message_id."""
+        with span("db.save_message", message_type=message_type), self.db.transaction() as conn:
+            self._restore(conn, chat_history_id)
             cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO session_activity (chat_history_id, username, last_active) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_history_id) DO UPDATE SET last_active = excluded.last_active",
+                (chat_history_id, username, time.time())
+            )
             if message_type == 'text':
                 cursor.execute(
-                    'INSERT INTO messages (chat_history_id, sender_type, message_type, text_content) '
-                    'VALUES (?, ?, ?, ?)',
-                    (chat_history_id, sender_type, message_type, content)
+                    'INSERT INTO messages (chat_history_id, sender_type, message_type, text_content, username) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (chat_history_id, sender_type, message_type, content, username)
                 )
             else:
                 cursor.execute(
-                    'INSERT INTO messages (chat_history_id, sender_type, message_type, blob_content) '
-                    'VALUES (?, ?, ?, ?)',
-                    (chat_history_id, sender_type, message_type, sqlite3.Binary(content))
+                    'INSERT INTO messages (chat_history_id, sender_type, message_type, blob_content, username) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (chat_history_id, sender_type, message_type, sqlite3.Binary(content), username)
                 )
             conn.commit()
+            return cursor.lastrowid
 
     def load_messages(self, chat_history_id: str) -> List[Dict[str, Any]]:
-        with self.db.connection as conn:
+        with span("db.load_messages"), self.db.transaction() as conn:
+            self._restore(conn, chat_history_id)
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT message_id, sender_type, message_type, text_content, blob_content "
@@ -104,16 +314,19 @@ class MessageRepository(BaseRepository):
                 for row in cursor.fetchall()
             ]
 
-    def load_last_k_text_messages(self, chat_history_id: str, k: int) -> List[Dict[str, Any]]:
-        with self.db.connection as conn:
+    def load_last_k_text_messages(self, chat_history_id: str, k: int,
+                                  before_message_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The last ``k`` text messages, or the ``k`` before ``before_message_id``, oldest first."""
+        with span("db.load_last_k_text_messages", k=k), self.db.transaction() as conn:
+            self._restore(conn, chat_history_id)
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT message_id, sender_type, message_type, text_content
                 FROM messages
-                WHERE chat_history_id = ? AND message_type = 'text'
+                WHERE chat_history_id = ? AND message_type = 'text' AND message_id < ?
                 ORDER BY message_id DESC
                 LIMIT ?
-            """, (chat_history_id, k))
+            """, (chat_history_id, before_message_id if before_message_id is not None else 2 ** 63 - 1, k))
             
             # Fetch all and reverse to maintain chronological order
             return [
@@ -127,76 +340,538 @@ class MessageRepository(BaseRepository):
             ]
 
     def delete_chat_history(self, chat_history_id: str) -> None:
-        with self.db.connection as conn:
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM messages WHERE chat_history_id = ?", (chat_history_id,))
+            cursor.execute("DELETE FROM session_activity WHERE chat_history_id = ?", (chat_history_id,))
+            archived = cursor.execute(
+                "SELECT archive_path FROM archived_sessions WHERE chat_history_id = ?", (chat_history_id,)
+            ).fetchone()
+            cursor.execute("DELETE FROM archived_sessions WHERE chat_history_id = ?", (chat_history_id,))
             conn.commit()
+        if archived:
+            SessionArchive.remove(archived['archive_path'])
 
-    def get_all_chat_history_ids(self) -> List[str]:
-        """Get all unique chat history IDs from the messages table."""
-        with self.db.connection as conn:
+    def get_all_chat_history_ids(self, username: Optional[str] = None) -> List[str]:
+        """Get all unique chat history IDs, archived ones included, optionally for one user."""
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT chat_history_id FROM messages ORDER BY chat_history_id ASC")
+            if username is None:
+                cursor.execute(
+                    "SELECT DISTINCT chat_history_id FROM messages "
+                    "UNION SELECT chat_history_id FROM archived_sessions ORDER BY chat_history_id ASC"
+                )
+            else:
+                cursor.execute(
+                    "SELECT DISTINCT chat_history_id FROM messages WHERE username = ? "
+                    "UNION SELECT chat_history_id FROM archived_sessions WHERE username = ? "
+                    "ORDER BY chat_history_id ASC",
+                    (username, username)
+                )
             return [row['chat_history_id'] for row in cursor.fetchall()]
 
+    def session_owner(self, chat_history_id: str) -> Tuple[bool, Optional[str]]:
+        """Whether the session exists, and the user it belongs to (None if saved without one)."""
+        with self.db.transaction() as conn:
+            exists = False
+            for sql in (
+                "SELECT username FROM session_activity WHERE chat_history_id = ?",
+                "SELECT username FROM archived_sessions WHERE chat_history_id = ?",
+                "SELECT username FROM messages WHERE chat_history_id = ? ORDER BY message_id LIMIT 1",
+            ):
+                row = conn.execute(sql, (chat_history_id,)).fetchone()
+                if row is not None:
+                    exists = True
+                    if row['username'] is not None:
+                        return True, row['username']
+            return exists, None
+
+    def list_idle_sessions(self, idle_before: float, limit: int = 100) -> List[str]:
+        """Sessions without a new message since ``idle_before`` (a Unix time), idlest first."""
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT chat_history_id FROM session_activity WHERE last_active < ? "
+                "ORDER BY last_active LIMIT ?",
+                (idle_before, limit)
+            ).fetchall()
+            return [row['chat_history_id'] for row in rows]
+
+    def archive_session(self, chat_history_id: str, idle_before: float) -> bool:
+        """Move one session's messages into its archive file.
+
+        Does nothing (and returns False) unless the session is still idle
+        since ``idle_before`` once the write lock is held, so a message saved
+        meanwhile, by this or another process, is never lost.
+        """
+        if self.archive is None:
+            return False
+        with span("db.archive_session"), self.db.transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            activity = conn.execute(
+                "SELECT username, last_active FROM session_activity WHERE chat_history_id = ?",
+                (chat_history_id,)
+            ).fetchone()
+            if activity is None or activity['last_active'] >= idle_before:
+                return False
+            if conn.execute(
+                "SELECT 1 FROM archived_sessions WHERE chat_history_id = ?", (chat_history_id,)
+            ).fetchone():
+                # An earlier archive could not be restored; never overwrite it
+                return False
+            rows = [dict(row) for row in conn.execute(
+                "SELECT message_id, sender_type, message_type, text_content, blob_content, username "
+                "FROM messages WHERE chat_history_id = ? ORDER BY message_id",
+                (chat_history_id,)
+            )]
+            if rows:
+                path, size = self.archive.write(chat_history_id, rows)
+                conn.execute(
+                    "INSERT OR REPLACE INTO archived_sessions (chat_history_id, username, archive_path, "
+                    "message_count, archived_bytes, last_active, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chat_history_id, activity['username'], path, len(rows), size,
+                     activity['last_active'], time.time())
+                )
+                conn.execute("DELETE FROM messages WHERE chat_history_id = ?", (chat_history_id,))
+            conn.execute("DELETE FROM session_activity WHERE chat_history_id = ?", (chat_history_id,))
+        if rows:
+            increment("sessions_archived_total", 1, "Chat sessions moved to the archive")
+        return bool(rows)
+
+    def _restore(self, conn: sqlite3.Connection, chat_history_id: str) -> None:
+        """Move an archived session back into the messages table, if it is archived."""
+        if self.archive is None:
+            return
+        if conn.execute(
+            "SELECT 1 FROM archived_sessions WHERE chat_history_id = ?", (chat_history_id,)
+        ).fetchone() is None:
+            return
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        # Checked again under the write lock: another process may have restored it
+        archived = conn.execute(
+            "SELECT username, archive_path FROM archived_sessions WHERE chat_history_id = ?",
+            (chat_history_id,)
+        ).fetchone()
+        if archived is None:
+            return
+        with span("db.restore_session"):
+            try:
+                messages = self.archive.read(archived['archive_path'])
+            except (OSError, ValueError) as e:
+                # Keep the index entry, so the session stays listed and can be retried
+                print(f"Could not restore archived session {chat_history_id}: {str(e)}")
+                return
+            # Messages archived before their usernames were backfilled have none of their own
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages (message_id, chat_history_id, sender_type, message_type, "
+                "text_content, blob_content, username) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(m['message_id'], chat_history_id, m['sender_type'], m['message_type'], m['text_content'],
+                  sqlite3.Binary(m['blob_content']) if m['blob_content'] is not None else None,
+                  m['username'] if m['username'] is not None else archived['username'])
+                 for m in messages]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO session_activity (chat_history_id, username, last_active) "
+                "VALUES (?, ?, ?)",
+                (chat_history_id, archived['username'], time.time())
+            )
+            conn.execute("DELETE FROM archived_sessions WHERE chat_history_id = ?", (chat_history_id,))
+        # The file goes once the restored rows are committed
+        conn.commit()
+        SessionArchive.remove(archived['archive_path'])
+        increment("sessions_restored_total", 1, "Archived chat sessions moved back to the database")
+
+    def compact(self, min_free_ratio: float = 0.2) -> Dict[str, Any]:
+        """Reclaim the space left by archived and deleted sessions.
+
+        Merges the full-text index segments, runs VACUUM once at least
+        ``min_free_ratio`` of the file is free pages, and truncates the WAL.
+        """
+        with self.db.transaction() as conn:
+            if self.search_enabled:
+                conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+        with self.db.transaction() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            vacuumed = pages_before > 0 and free_pages / pages_before >= min_free_ratio
+            if vacuumed:
+                with span("db.vacuum", pages=pages_before):
+                    conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+        return {
+            'bytes_before': pages_before * page_size,
+            'bytes_after': pages_after * page_size,
+            'vacuumed': vacuumed,
+        }
+
+    def archive_stats(self) -> Dict[str, Any]:
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS sessions, COALESCE(SUM(message_count), 0) AS messages, "
+                "COALESCE(SUM(archived_bytes), 0) AS archived_bytes FROM archived_sessions"
+            ).fetchone()
+            return dict(row)
+
+    @staticmethod
+    def _build_match_query(query: str) -> str:
+        """Turn free text into a safe FTS5 query: every term quoted, the last one as a prefix."""
+        terms = [term.replace('"', '""') for term in query.split()]
+        if not terms:
+            return ''
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def search_messages(self, query: str, username: Optional[str] = None,
+                        limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """Search text messages, best matches first.
+
+        Results are ranked with bm25 and carry a snippet with the matched terms
+        wrapped in ``**`` so they render highlighted as markdown. If ``username``
+        is given, only that user's messages are searched.
+        """
+        match_query = self._build_match_query(query)
+        if not self.search_enabled or not match_query:
+            return []
+
+        sql = """
+            SELECT m.message_id, m.chat_history_id, m.sender_type,
+                   snippet(messages_fts, 0, '**', '**', '...', 12) AS snippet,
+                   bm25(messages_fts) AS rank
+            FROM messages_fts
+            JOIN messages m ON m.message_id = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+        """
+        params: List[Any] = [match_query]
+        if username is not None:
+            sql += " AND m.username = ?"
+            params.append(username)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return [
+                {
+                    'message_id': row['message_id'],
+                    'chat_history_id': row['chat_history_id'],
+                    'sender_type': row['sender_type'],
+                    'snippet': row['snippet'],
+                    'rank': row['rank']
+                }
+                for row in cursor.fetchall()
+            ]
+
 class SettingsRepository(BaseRepository):
-    """Handles all settings-related database operations."""
-    
+    """Handles all settings-related database operations.
+
+    Settings are loaded into an in-process cache once and kept there, so reads
+    never touch SQLite. Writes go to the database first and then to the cache,
+    and registered listeners are notified of every change.
+    """
+
+    def __init__(self, db_connection: DatabaseConnection):
+        super().__init__(db_connection)
+        self._cache: Dict[str, Any] = {}
+        self._listeners: List[Callable[[str, Any], None]] = []
+        self._lock = threading.RLock()
+
     def create_table(self) -> None:
-        with self.db.connection as conn:
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS settings (
                     setting_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     setting_name TEXT NOT NULL UNIQUE,
-                    setting_value TEXT NOT NULL
+                    setting_value TEXT NOT NULL,
+                    setting_type TEXT
                 );
             """)
+            # Older databases were created without the type column
+            columns = [row['name'] for row in cursor.execute("PRAGMA table_info(settings)")]
+            if 'setting_type' not in columns:
+                cursor.execute("ALTER TABLE settings ADD COLUMN setting_type TEXT")
             conn.commit()
+        self.load_settings()
+
+    @staticmethod
+    def _encode(value: Any) -> Tuple[str, str]:
+        # bool must be checked before int, since bool is a subclass of int
+        if isinstance(value, bool):
+            return ('bool', '1' if value else '0')
+        if isinstance(value, int):
+            return ('int', str(value))
+        if isinstance(value, float):
+            return ('float', repr(value))
+        if isinstance(value, str):
+            return ('str', value)
+        return ('json', json.dumps(value))
+
+    @staticmethod
+    def _decode(setting_type: Optional[str], raw_value: str) -> Any:
+        if setting_type == 'bool':
+            return raw_value == '1'
+        if setting_type == 'int':
+            return int(raw_value)
+        if setting_type == 'float':
+            return float(raw_value)
+        if setting_type == 'json':
+            return json.loads(raw_value)
+        if setting_type == 'str':
+            return raw_value
+        # Untyped rows were written as str(value); recover the original type
+        if raw_value in ('True', 'False'):
+            return raw_value == 'True'
+        for cast in (int, float):
+            try:
+                return cast(raw_value)
+            except ValueError:
+                pass
+        return raw_value
+
+    def load_settings(self) -> None:
+        """(Re)load every setting from the database into the cache."""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT setting_name, setting_value, setting_type FROM settings")
+            settings = {
+                row['setting_name']: self._decode(row['setting_type'], row['setting_value'])
+                for row in cursor.fetchall()
+            }
+        with self._lock:
+            self._cache = settings
 
     def get_setting(self, setting_name: str, default_value: Any) -> Any:
-        with self.db.connection as conn:
+        with self._lock:
+            hit = setting_name in self._cache
+            value = self._cache.get(setting_name, default_value)
+        increment("cache_requests_total", 1, "Lookups in in-process caches",
+                  cache="settings", result="hit" if hit else "miss")
+        return value
+
+    def get_all_settings(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._cache)
+
+    def update_setting(self, setting_name: str, setting_value: Any) -> None:
+        setting_type, raw_value = self._encode(setting_value)
+        with self._lock:
+            if setting_name in self._cache and self._cache[setting_name] == setting_value \
+                    and type(self._cache[setting_name]) is type(setting_value):
+                return
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT OR REPLACE INTO settings (setting_name, setting_value, setting_type) "
+                    "VALUES (?, ?, ?)",
+                    (setting_name, raw_value, setting_type)
+                )
+                conn.commit()
+            self._cache[setting_name] = setting_value
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(setting_name, setting_value)
+            except Exception as e:
+                print(f"Error in settings listener for '{setting_name}': {str(e)}")
+
+    def subscribe(self, listener: Callable[[str, Any], None]) -> Callable[[], None]:
+        """Register ``listener(setting_name, setting_value)`` for changes.
+
+        Returns a function that removes the listener again.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return unsubscribe
+
+class IngestionJobRepository(BaseRepository):
+    """Handles the persistent queue of background PDF ingestion jobs.
+
+    One job is one uploaded file. ``done_chunks`` is the checkpoint: chunks
+    before it are already stored in the vector database, so an interrupted
+    job resumes from there. A running job whose ``updated_at`` is older than
+    the stale timeout is treated as abandoned (its worker died) and can be
+    claimed again. A job that raised is queued again, keeping its checkpoint,
+    until it has failed ``max_attempts`` times; ``next_attempt_at`` holds it
+    back until its retry delay has passed.
+    """
+
+    def create_table(self) -> None:
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    username TEXT,
+                    file_name TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    chunk_overlap INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    total_chunks INTEGER,
+                    done_chunks INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    worker_id TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0
+                );
+            """)
+            # Older databases were created without the retry columns
+            columns = [row['name'] for row in cursor.execute("PRAGMA table_info(ingestion_jobs)")]
+            if 'attempts' not in columns:
+                cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
             cursor.execute(
-                "SELECT setting_value FROM settings WHERE setting_name = ?",
-                (setting_name,)
+                "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status "
+                "ON ingestion_jobs (status, created_at)"
             )
-            result = cursor.fetchone()
-            
-            if result:
-                return result['setting_value'] # Use dict-like access
-            
-            self.update_setting(setting_name, default_value)
-            return default_value
+            conn.commit()
 
-    def update_setting(self, setting_name: str, setting_value: Any) -> None:
-        with self.db.connection as conn:
+    def create_job(self, job_id: str, file_name: str, file_path: str, chunk_size: int,
+                   chunk_overlap: int, username: Optional[str] = None) -> None:
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO ingestion_jobs (job_id, username, file_name, file_path, chunk_size, "
+                "chunk_overlap, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, username, file_name, file_path, chunk_size, chunk_overlap, now, now)
+            )
+
+    def claim_next_job(self, worker_id: str, stale_after: float) -> Optional[Dict[str, Any]]:
+        """Mark the oldest runnable job as running for ``worker_id`` and return it."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            # The subquery and the update run as one statement, so two processes
+            # sharing the database file can never claim the same job
+            cursor.execute("""
+                UPDATE ingestion_jobs SET status = 'running', worker_id = ?, updated_at = ?
+                WHERE job_id = (
+                    SELECT job_id FROM ingestion_jobs
+                    WHERE (status = 'queued' AND next_attempt_at <= ?)
+                       OR (status = 'running' AND updated_at < ?)
+                    ORDER BY created_at LIMIT 1
+                )
+            """, (worker_id, now, now, now - stale_after))
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute(
+                "SELECT * FROM ingestion_jobs WHERE worker_id = ? AND status = 'running' "
+                "AND updated_at = ?", (worker_id, now)
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def update_progress(self, job_id: str, done_chunks: int, total_chunks: int) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET done_chunks = ?, total_chunks = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (done_chunks, total_chunks, time.time(), job_id)
+            )
+
+    def finish_job(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def retry_job(self, job_id: str, error: str, max_attempts: int, retry_delay: float) -> bool:
+        """Count a failed attempt and queue the job again, or mark it failed after ``max_attempts``.
+
+        The n-th retry waits ``retry_delay * 2 ** (n - 1)`` seconds. Returns
+        True if the job was queued again.
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
+            row = cursor.execute("SELECT attempts FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            attempts = row['attempts'] + 1
+            retry = attempts < max_attempts
             cursor.execute(
-                "INSERT OR REPLACE INTO settings (setting_name, setting_value) VALUES (?, ?)",
-                (setting_name, str(setting_value))
+                "UPDATE ingestion_jobs SET status = ?, error = ?, attempts = ?, next_attempt_at = ?, "
+                "worker_id = NULL, updated_at = ? WHERE job_id = ?",
+                ('queued' if retry else 'failed', error, attempts,
+                 now + retry_delay * 2 ** (attempts - 1) if retry else 0, now, job_id)
             )
             conn.commit()
+            return retry
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def list_jobs(self, username: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        with self.db.transaction() as conn:
+            if username is None:
+                rows = conn.execute(
+                    "SELECT * FROM ingestion_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM ingestion_jobs WHERE username = ? ORDER BY created_at DESC LIMIT ?",
+                    (username, limit)
+                ).fetchall()
+            return [dict(row) for row in rows]
+
+    def delete_job(self, job_id: str) -> None:
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM ingestion_jobs WHERE job_id = ?", (job_id,))
+
+    def delete_finished_jobs(self, username: Optional[str]) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "DELETE FROM ingestion_jobs WHERE username IS ? AND status NOT IN ('queued', 'running')",
+                (username,)
+            )
+
+    def count_unfinished(self) -> int:
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM ingestion_jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+            return row[0]
 
 class DatabaseManager:
     """Main database manager that coordinates all database operations."""
-    
-    def __init__(self, db_path: str):
+
+    def __init__(self, db_path: str, archive_settings: Optional[Dict[str, Any]] = None):
+        archive_settings = archive_settings or {}
         self.db_connection = DatabaseConnection(db_path)
-        self.message_repo = MessageRepository(self.db_connection)
+        # Archived sessions live next to the database unless configured otherwise
+        archive_dir = archive_settings.get("directory") or os.path.join(os.path.dirname(db_path), "archive")
+        self.message_repo = MessageRepository(
+            self.db_connection, SessionArchive(archive_dir, archive_settings.get("compression_level", 10))
+        )
         self.settings_repo = SettingsRepository(self.db_connection)
+        self.ingestion_repo = IngestionJobRepository(self.db_connection)
         self._initialize_database()
 
     def _initialize_database(self) -> None:
         self.message_repo.create_table()
         self.settings_repo.create_table()
+        self.ingestion_repo.create_table()
 
     def close(self) -> None:
         self.db_connection.close()
 
 # Initialize the database manager with configuration
-config = load_config()
-db_manager = DatabaseManager(config["chat_sessions_database_path"])
+config = get_config()
+db_manager = DatabaseManager(config["chat_sessions_database_path"], config.get("session_archive"))
 
 # Streamlit session state management
 def get_db_manager():
@@ -0,0 +1,183 @@
+"""Embedding providers used by VectorDB and SimpleVectorDB.
+
+Select one in config.yaml:
+
+    embeddings:
+      provider: "onnx"      # or "gemini"
+
+``gemini`` calls the Gemini embedding API, sending up to ``batch_size`` texts
+per request. ``onnx`` runs a sentence-embedding model on the CPU through
+onnxruntime, so ingestion and queries work offline with steady latency.
+
+Providers raise EmbeddingError when a text cannot be embedded. There is no
+zero-vector fallback: a zero vector is stored like a real one and silently
+pulls unrelated chunks into retrieval results.
+
+Vectors from different providers are not comparable, and their dimensions
+usually differ. After switching providers, clear the knowledge base and
+ingest the documents again.
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from utils import get_config, get_genai, on_config_reload
+
+class EmbeddingError(RuntimeError):
+    """Raised when a provider fails to embed a text."""
+
+class EmbeddingProvider(ABC):
+    """Turns texts into vectors. Subclasses implement ``embed_documents``."""
+
+    name = "base"
+
+    @abstractmethod
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        pass
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Gemini embedding API; one batchEmbedContents request per ``batch_size`` texts.
+
+    ``client`` is anything with the ``genai.embed_content`` signature and
+    defaults to the configured Gemini SDK.
+    """
+
+    name = "gemini"
+
+    def __init__(self, client=None, model: Optional[str] = None, batch_size: int = 32):
+        config = get_config()
+        self.client = client or get_genai()
+        self.model = model or config["gemini"].get("embedding_model", "embedding-001")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            try:
+                response = self.client.embed_content(model=self.model, content=batch)
+            except Exception as e:
+                raise EmbeddingError(f"Gemini embedding failed for {len(batch)} texts: {str(e)}") from e
+            embeddings.extend(response['embedding'])
+        return embeddings
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    """Sentence embeddings from a local ONNX model, computed on the CPU.
+
+    ``model_path`` is a directory holding ``model.onnx`` and the matching
+    ``tokenizer.json`` (e.g. an ONNX export of all-MiniLM-L6-v2). Texts are
+    sorted by length and padded only to the longest text in their batch, so
+    short chunks do not pay for ``max_length`` tokens.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, max_length: int = 256, batch_size: int = 32,
+                 intra_op_threads: int = 0, pooling: str = "mean", normalize: bool = True):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.pooling = pooling
+        self.normalize = normalize
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        # No fixed length: every batch is padded to its own longest sequence
+        padding = self.tokenizer.padding or {}
+        self.tokenizer.enable_padding(pad_id=padding.get("pad_id", 0),
+                                      pad_token=padding.get("pad_token", "[PAD]"))
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets onnxruntime use one thread per physical core
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        if output.ndim == 2:
+            # The model already pools to one vector per text
+            vectors = output
+        elif self.pooling == "cls":
+            vectors = output[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(output.dtype)
+            vectors = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32)
+
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Similar lengths in one batch means little padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            try:
+                batch_vectors = self._embed_batch([texts[i] for i in indices])
+            except Exception as e:
+                raise EmbeddingError(f"ONNX embedding failed for {len(indices)} texts: {str(e)}") from e
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector.tolist()
+        return vectors
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def create_embedding_provider(settings=None) -> EmbeddingProvider:
+    """Build the provider described by ``settings`` (the ``embeddings`` config section)."""
+    if settings is None:
+        settings = get_config().get("embeddings", {})
+    provider = settings.get("provider", "gemini")
+    batch_size = settings.get("batch_size", 32)
+    if provider == "gemini":
+        return GeminiEmbeddingProvider(batch_size=batch_size)
+    if provider == "onnx":
+        onnx_settings = settings.get("onnx", {})
+        return OnnxEmbeddingProvider(
+            model_path=onnx_settings["model_path"],
+            max_length=onnx_settings.get("max_length", 256),
+            batch_size=batch_size,
+            intra_op_threads=onnx_settings.get("intra_op_threads", 0),
+            pooling=onnx_settings.get("pooling", "mean"),
+            normalize=onnx_settings.get("normalize", True),
+        )
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Return the process-wide configured provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_embedding_provider()
+    return _provider
+
+def _reset_provider(old, new):
+    global _provider
+    with _provider_lock:
+        _provider = None
+
+# The Gemini provider also holds the genai module configured with the old key
+on_config_reload(_reset_provider, sections=("embeddings", "gemini"))
@@ -0,0 +1,261 @@
+"""Background PDF ingestion with a persistent, resumable job queue.
+
+    queue = get_ingestion_queue()
+    job_id = queue.submit("report.pdf", pdf_bytes, username="alice")
+    queue.get_status(job_id)   # {"status": "running", "progress": 0.4, ...}
+
+``submit`` only writes the upload to the spool directory and records a job in
+the chat database, so it returns immediately. Worker threads claim jobs,
+extract and chunk the text, then embed and store the chunks in batches. After
+every batch the number of stored chunks is checkpointed. Chunk ids are derived
+from the job id and the chunk position, so a job interrupted by a restart
+resumes at its checkpoint, and replaying the last batch overwrites rather than
+duplicates it.
+
+A job that fails (say the embedding API or Chroma is briefly unavailable) is
+queued again and resumes at its checkpoint after a growing delay. After
+``ingestion.max_attempts`` failures it is marked failed, and the chunks it had
+stored are deleted, so retrieval never returns part of a document that is not
+listed.
+
+Claiming a job is a single UPDATE, so the Streamlit app and API server
+workers can all run workers against the same database.
+"""
+import os
+import threading
+import uuid
+
+from database_operations import db_manager
+from telemetry import increment, span
+from utils import get_config, on_config_reload
+
+config = get_config()
+ingestion_config = config.get("ingestion", {})
+
+class IngestionQueue:
+    """Worker threads that process the jobs recorded in IngestionJobRepository."""
+
+    def __init__(self, job_repo, spool_dir=None, workers=None, batch_size=None,
+                 poll_interval=None, stale_after=None, max_attempts=None, retry_delay=None):
+        self.job_repo = job_repo
+        self.spool_dir = spool_dir or ingestion_config.get("spool_dir", "./ingestion_spool")
+        self.workers = workers or ingestion_config.get("workers", 2)
+        self.batch_size = batch_size or ingestion_config.get("batch_size", 32)
+        self.poll_interval = poll_interval or ingestion_config.get("poll_interval_seconds", 2.0)
+        # A running job not checkpointed for this long belongs to a dead worker
+        self.stale_after = stale_after or ingestion_config.get("stale_after_seconds", 300)
+        self.max_attempts = max_attempts or ingestion_config.get("max_attempts", 3)
+        self.retry_delay = retry_delay or ingestion_config.get("retry_delay_seconds", 30)
+        # Settings not passed in follow config.yaml when it is reloaded
+        self._from_config = {name for name, value in (("batch_size", batch_size), ("poll_interval", poll_interval),
+                                                      ("stale_after", stale_after), ("max_attempts", max_attempts),
+                                                      ("retry_delay", retry_delay)) if not value}
+        self._threads = []
+        self._vector_dbs = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        on_config_reload(self._apply_config, sections=("ingestion", "chromadb", "embeddings", "gemini"))
+
+    def start(self):
+        """Start the worker threads. Safe to call more than once."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for number in range(self.workers):
+                worker_id = f"{os.getpid()}-{number}-{uuid.uuid4().hex[:8]}"
+                thread = threading.Thread(target=self._worker_loop, args=(worker_id,),
+                                          name=f"ingestion-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Ask the workers to exit after their current batch and wait for them."""
+        self._stop.set()
+        self._wakeup.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, file_name, pdf_bytes, username=None, chunk_size=1000, chunk_overlap=200):
+        """Queue one PDF for ingestion and return its job id."""
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(self.spool_dir, f"{job_id}.pdf")
+        with open(file_path, "wb") as f:
+            f.write(pdf_bytes)
+        self.job_repo.create_job(job_id, file_name, file_path, chunk_size, chunk_overlap,
+                                 username=username)
+        increment("ingestion_jobs_total", 1, "Ingestion jobs by state change", status="queued")
+        self._wakeup.set()
+        return job_id
+
+    def get_status(self, job_id):
+        job = self.job_repo.get_job(job_id)
+        return self._describe(job) if job else None
+
+    def list_jobs(self, username=None, limit=20):
+        return [self._describe(job) for job in self.job_repo.list_jobs(username, limit)]
+
+    @staticmethod
+    def _describe(job):
+        total = job["total_chunks"]
+        if job["status"] == "done":
+            progress = 1.0
+        elif total:
+            progress = job["done_chunks"] / total
+        else:
+            progress = 0.0
+        return {
+            "job_id": job["job_id"],
+            "file_name": job["file_name"],
+            "username": job["username"],
+            "status": job["status"],
+            "done_chunks": job["done_chunks"],
+            "total_chunks": total,
+            "progress": progress,
+            "error": job["error"],
+            "attempts": job["attempts"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+    def _apply_config(self, old, new):
+        settings = new.get("ingestion", {})
+        if "batch_size" in self._from_config:
+            self.batch_size = settings.get("batch_size", 32)
+        if "poll_interval" in self._from_config:
+            self.poll_interval = settings.get("poll_interval_seconds", 2.0)
+        if "stale_after" in self._from_config:
+            self.stale_after = settings.get("stale_after_seconds", 300)
+        if "max_attempts" in self._from_config:
+            self.max_attempts = settings.get("max_attempts", 3)
+        if "retry_delay" in self._from_config:
+            self.retry_delay = settings.get("retry_delay_seconds", 30)
+        # Jobs already running keep their handle; later ones get the new settings
+        with self._lock:
+            self._vector_dbs.clear()
+
+    def _get_vector_db(self, username):
+        # Shared by the workers: Chroma clients cannot be created concurrently
+        with self._lock:
+            if username not in self._vector_dbs:
+                from vectordb_handler import load_vectordb
+                self._vector_dbs[username] = load_vectordb(username)
+            return self._vector_dbs[username]
+
+    def list_documents(self, username=None):
+        """Ingested documents of ``username``; the job id is the document id."""
+        return [job for job in self.list_jobs(username, limit=-1)
+                if job["status"] == "done" and job["username"] == username]
+
+    def delete_document(self, job_id, username=None):
+        """Remove one of ``username``'s documents: its chunks and its job record.
+
+        Returns False if the job is unknown, belongs to someone else or is
+        still being ingested.
+        """
+        job = self.job_repo.get_job(job_id)
+        if job is None or job["username"] != username or job["status"] in ("queued", "running"):
+            return False
+        self._get_vector_db(job["username"]).delete_document(job_id)
+        self.job_repo.delete_job(job_id)
+        return True
+
+    def clear_user(self, username):
+        """Drop every document of ``username`` without touching other users."""
+        self._get_vector_db(username).clear()
+        self.job_repo.delete_finished_jobs(username)
+
+    def _worker_loop(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                job = self.job_repo.claim_next_job(worker_id, self.stale_after)
+            except Exception as e:
+                print(f"Ingestion worker {worker_id} could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run_job(job, self._get_vector_db(job["username"]))
+            except Exception as e:
+                self._handle_failure(job, e)
+
+    def _handle_failure(self, job, error):
+        try:
+            retry = self.job_repo.retry_job(job["job_id"], str(error), self.max_attempts, self.retry_delay)
+        except Exception as e:
+            # Left as running; it is picked up again once it goes stale
+            print(f"Ingestion job {job['job_id']} failed ({str(error)}) and could not be requeued: {str(e)}")
+            return
+        if retry:
+            print(f"Ingestion job {job['job_id']} ({job['file_name']}) failed, will retry: {str(error)}")
+            increment("ingestion_jobs_total", 1, "Ingestion jobs by state change", status="retried")
+            return
+        print(f"Ingestion job {job['job_id']} ({job['file_name']}) failed: {str(error)}")
+        increment("ingestion_jobs_total", 1, "Ingestion jobs by state change", status="failed")
+        # Failed jobs are not listed as documents, so their chunks could never be deleted later
+        try:
+            self._get_vector_db(job["username"]).delete_document(job["job_id"])
+        except Exception as e:
+            print(f"Could not delete the chunks of failed ingestion job {job['job_id']}: {str(e)}")
+        self._remove_spool_file(job["file_path"])
+
+    def _run_job(self, job, vector_db):
+        from pdf_handler import extract_text_from_pdf, get_text_chunks
+
+        job_id = job["job_id"]
+        with span("ingest.job", file_name=job["file_name"], resumed=job["done_chunks"] > 0):
+            with open(job["file_path"], "rb") as f:
+                text = extract_text_from_pdf(f.read())
+            # Chunking is deterministic, so a resumed job sees the same chunks
+            chunks = get_text_chunks(text, job["chunk_size"], job["chunk_overlap"])
+            done = min(job["done_chunks"], len(chunks))
+            self.job_repo.update_progress(job_id, done, len(chunks))
+
+            while done < len(chunks):
+                if self._stop.is_set():
+                    # Left as running; it is picked up again once it goes stale
+                    return
+                batch = chunks[done:done + self.batch_size]
+                positions = range(done, done + len(batch))
+                vector_db.add_texts(
+                    batch,
+                    ids=[f"{job_id}-{i}" for i in positions],
+                    metadatas=[{"document_id": job_id, "source": job["file_name"], "chunk": i,
+                                "chunk_overlap": job["chunk_overlap"]} for i in positions]
+                )
+                done += len(batch)
+                self.job_repo.update_progress(job_id, done, len(chunks))
+
+        self.job_repo.finish_job(job_id, "done")
+        increment("ingestion_jobs_total", 1, "Ingestion jobs by state change", status="done")
+        self._remove_spool_file(job["file_path"])
+        print(f"Ingested {job['file_name']}: {len(chunks)} chunks.")
+
+    @staticmethod
+    def _remove_spool_file(file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+_ingestion_queue = None
+_ingestion_queue_lock = threading.Lock()
+
+def get_ingestion_queue():
+    """Return the process-wide IngestionQueue with its workers running."""
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        with _ingestion_queue_lock:
+            if _ingestion_queue is None:
+                queue = IngestionQueue(db_manager.ingestion_repo)
+                queue.start()
+                _ingestion_queue = queue
+    return _ingestion_queue
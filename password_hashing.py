@@ -0,0 +1,118 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt is memory-hard: every hash needs about 128 * r * n bytes of RAM,
+# which makes large-scale guessing on GPUs/ASICs expensive.
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+SCHEME = "scrypt"
+
+# Hashes written before salting was introduced: hex SHA-256 of the password
+LEGACY_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+class PasswordHasher:
+    """Salted scrypt hashing with a configurable cost.
+
+    Hashes are stored as ``scrypt$n$r$p$salt$key`` so the cost used for each
+    user is known at verification time and can be raised later without
+    invalidating existing passwords.
+    """
+
+    def __init__(self, n=DEFAULT_SCRYPT_N, r=DEFAULT_SCRYPT_R, p=DEFAULT_SCRYPT_P):
+        if n < 2 or n & (n - 1):
+            raise ValueError(f"scrypt n must be a power of two greater than 1, got {n}")
+        self.n = n
+        self.r = r
+        self.p = p
+
+    @staticmethod
+    def _derive(password, salt, n, r, p):
+        # OpenSSL refuses to allocate more than 32 MiB unless told otherwise
+        maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=maxmem, dklen=KEY_BYTES)
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{SCHEME}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(key)}"
+
+    @staticmethod
+    def is_legacy(encoded):
+        return bool(LEGACY_SHA256_PATTERN.match(encoded or ""))
+
+    def verify(self, password, encoded):
+        """Check ``password`` against a stored hash, including legacy SHA-256 hashes."""
+        if self.is_legacy(encoded):
+            candidate = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(candidate, encoded)
+        try:
+            scheme, n, r, p, salt, key = encoded.split("$")
+            if scheme != SCHEME:
+                return False
+            expected = _b64decode(key)
+            candidate = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        except (ValueError, AttributeError):
+            return False
+        return hmac.compare_digest(candidate, expected)
+
+    def needs_rehash(self, encoded):
+        """True if the stored hash is legacy or uses a different cost than configured."""
+        if self.is_legacy(encoded):
+            return True
+        try:
+            scheme, n, r, p, _, _ = encoded.split("$")
+        except (ValueError, AttributeError):
+            return True
+        return scheme != SCHEME or (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+class PasswordPoolBusy(RuntimeError):
+    """Raised when too many hash computations are already queued."""
+
+class PasswordWorkerPool:
+    """Runs hashing and verification on a small, bounded set of worker threads.
+
+    hashlib.scrypt releases the GIL, so keeping the work here caps the CPU
+    and memory a burst of logins can take while other sessions keep running.
+    Submissions beyond ``max_pending`` are rejected instead of queued.
+    """
+
+    def __init__(self, hasher, max_workers=2, max_pending=32):
+        self.hasher = hasher
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, fn, *args, timeout=None):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy("Too many concurrent login attempts, please try again.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=timeout)
+
+    def hash(self, password, timeout=None):
+        return self._run(self.hasher.hash, password, timeout=timeout)
+
+    def verify(self, password, encoded, timeout=None):
+        return self._run(self.hasher.verify, password, encoded, timeout=timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
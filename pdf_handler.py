@@ -1,20 +1,27 @@
-from vectordb_handler import load_vectordb
-from utils import load_config, timeit
-import pypdfium2
+from utils import timeit
 import streamlit as st
 
-config = load_config()
-
 def get_pdf_texts(pdfs_bytes_list):
     return [extract_text_from_pdf(pdf_bytes.getvalue()) for pdf_bytes in pdfs_bytes_list]
 
 def extract_text_from_pdf(pdf_bytes):
+    return "\n".join(extract_pages_from_pdf(pdf_bytes))
+
+def extract_pages_from_pdf(pdf_bytes):
+    """Return the text of every page; ``pdf_bytes`` may also be a file path."""
+    import pypdfium2
     pdf_file = pypdfium2.PdfDocument(pdf_bytes)
-    return "\n".join(pdf_file.get_page(page_number).get_textpage().get_text_range() for page_number in range(len(pdf_file)))
+    try:
+        return [pdf_file.get_page(page_number).get_textpage().get_text_range() for page_number in range(len(pdf_file))]
+    finally:
+        pdf_file.close()
     
-def get_text_chunks(text):
-    chunk_size = st.session_state.chunk_size
-    chunk_overlap = st.session_state.chunk_overlap
+def get_text_chunks(text, chunk_size=None, chunk_overlap=None):
+    # Default to the sizes chosen in the sidebar
+    if chunk_size is None:
+        chunk_size = st.session_state.chunk_size
+    if chunk_overlap is None:
+        chunk_overlap = st.session_state.chunk_overlap
     chunks = []
     
     # Simple text splitting by size with overlap
@@ -24,16 +31,17 @@ def get_text_chunks(text):
     
     return chunks
 
-def get_document_chunks(text_list):
+def get_document_chunks(text_list, chunk_size=None, chunk_overlap=None):
     chunks = []
     for text in text_list:
-        chunks.extend(get_text_chunks(text))
+        chunks.extend(get_text_chunks(text, chunk_size, chunk_overlap))
     return chunks
 
 @timeit
-def add_documents_to_db(pdfs_bytes):
+def add_documents_to_db(pdfs_bytes, chunk_size=None, chunk_overlap=None):
     texts = get_pdf_texts(pdfs_bytes)
-    chunks = get_document_chunks(texts)
+    chunks = get_document_chunks(texts, chunk_size, chunk_overlap)
+    from vectordb_handler import load_vectordb
     vector_db = load_vectordb()
     vector_db.add_texts(chunks)
     print("Documents added to db.")
\ No newline at end of file
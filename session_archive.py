@@ -0,0 +1,142 @@
+# Local Multimodal AI Chat - Multimodal chat application with Gemini
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Move idle chat sessions out of chat_sessions.db into compressed archives.
+
+The app and the API server run an archiver thread that checks every
+``check_interval_hours``. A session without a new message for ``idle_days``
+is written to a zstd-compressed file and its rows are deleted. The archive
+is restored as soon as the session is opened again. After each pass the
+database is compacted, so the hot database stays small.
+
+Run one pass by hand, e.g. from cron with the thread disabled:
+
+    python session_archive.py                  # archive and compact
+    python session_archive.py --idle-days 7
+    python session_archive.py --compact-only
+"""
+import argparse
+import threading
+import time
+
+from database_operations import db_manager
+from utils import get_config
+
+archive_config = get_config().get("session_archive", {})
+
+class SessionArchiver:
+    """Background thread archiving idle sessions of a MessageRepository."""
+
+    def __init__(self, message_repo, idle_days=None, check_interval_hours=None, min_free_ratio=None,
+                 batch_size=100):
+        self.message_repo = message_repo
+        self.idle_days = archive_config.get("idle_days", 30) if idle_days is None else idle_days
+        self.check_interval_hours = check_interval_hours or archive_config.get("check_interval_hours", 6)
+        self.min_free_ratio = (archive_config.get("vacuum_free_ratio", 0.2)
+                               if min_free_ratio is None else min_free_ratio)
+        self.batch_size = batch_size
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def run_once(self, compact=True):
+        """Archive every session idle for ``idle_days``, then compact. Returns a summary."""
+        idle_before = time.time() - self.idle_days * 86400
+        archived = 0
+        skipped = set()
+        while not self._stop.is_set():
+            candidates = [chat_history_id for chat_history_id in
+                          self.message_repo.list_idle_sessions(idle_before, self.batch_size + len(skipped))
+                          if chat_history_id not in skipped]
+            if not candidates:
+                break
+            for chat_history_id in candidates:
+                try:
+                    if self.message_repo.archive_session(chat_history_id, idle_before):
+                        archived += 1
+                    else:
+                        skipped.add(chat_history_id)
+                except Exception as e:
+                    print(f"Could not archive session {chat_history_id}: {str(e)}")
+                    skipped.add(chat_history_id)
+        summary = {"archived": archived}
+        if compact:
+            summary.update(self.message_repo.compact(self.min_free_ratio))
+        return summary
+
+    def start(self):
+        """Start the archiver thread, unless ``idle_days`` is 0. Safe to call more than once."""
+        with self._lock:
+            if self._thread is not None or not self.idle_days:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="session-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                summary = self.run_once()
+                if summary["archived"]:
+                    print(f"Archived {summary['archived']} idle chat sessions.")
+            except Exception as e:
+                print(f"Session archiving failed: {str(e)}")
+            self._stop.wait(self.check_interval_hours * 3600)
+
+_session_archiver = None
+_session_archiver_lock = threading.Lock()
+
+def get_session_archiver():
+    """Return the process-wide SessionArchiver with its thread running."""
+    global _session_archiver
+    if _session_archiver is None:
+        with _session_archiver_lock:
+            if _session_archiver is None:
+                archiver = SessionArchiver(db_manager.message_repo)
+                archiver.start()
+                _session_archiver = archiver
+    return _session_archiver
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--idle-days", type=float, default=archive_config.get("idle_days", 30))
+    parser.add_argument("--compact-only", action="store_true", help="only reclaim free space")
+    parser.add_argument("--vacuum-free-ratio", type=float, default=archive_config.get("vacuum_free_ratio", 0.2),
+                        help="VACUUM once this share of the database is free pages (0 always vacuums)")
+    args = parser.parse_args()
+
+    repo = db_manager.message_repo
+    archiver = SessionArchiver(repo, idle_days=args.idle_days, min_free_ratio=args.vacuum_free_ratio)
+    if args.compact_only:
+        summary = repo.compact(args.vacuum_free_ratio)
+    else:
+        summary = archiver.run_once()
+    summary.update(repo.archive_stats())
+    print(f"Archived now: {summary.get('archived', 0)} sessions")
+    print(f"Database: {summary['bytes_before'] / 2 ** 20:.1f} MiB -> {summary['bytes_after'] / 2 ** 20:.1f} MiB"
+          f"{' (vacuumed)' if summary['vacuumed'] else ''}")
+    print(f"Archive: {summary['sessions']} sessions, {summary['messages']} messages, "
+          f"{summary['archived_bytes'] / 2 ** 20:.1f} MiB")
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Bounded in-memory state of one chat session.
+
+    conversation = ConversationMemory.from_config()
+    conversation.load(message_repo, session_key)
+
+A ConversationMemory keeps two separate lists:
+
+- ``messages``: the tail of the transcript that is rendered. Only the last
+  ``window_messages`` are held; older ones stay in the database and are
+  paged in by ``load_older``, up to ``max_window_messages``.
+- ``prompts``: the last ``prompt_messages`` messages as sent to the model,
+  including the retrieved PDF context of earlier questions. They are never
+  rendered.
+
+``max_bytes`` caps the total held for the session: past it, the oldest
+displayed messages are dropped first, then the oldest prompts.
+"""
+import sys
+
+from utils import get_config
+
+def _size(value):
+    """Approximate memory held by a message field, in bytes."""
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+class ConversationMemory:
+    def __init__(self, window_messages=50, page_size=50, max_window_messages=200, prompt_messages=8,
+                 max_bytes=2_000_000):
+        self.window_messages = window_messages
+        self.page_size = page_size
+        self.max_window_messages = max_window_messages
+        self.prompt_messages = prompt_messages
+        self.max_bytes = max_bytes
+        self.messages = []
+        self.prompts = []
+        self.has_older = False
+        # Grows as older pages are loaded
+        self._limit = window_messages
+
+    @classmethod
+    def from_config(cls, **overrides):
+        settings = {**get_config().get("session_memory", {}), **overrides}
+        return cls(
+            window_messages=settings.get("window_messages", 50),
+            page_size=settings.get("page_size", 50),
+            max_window_messages=settings.get("max_window_messages", 200),
+            prompt_messages=settings.get("prompt_messages", 8),
+            max_bytes=settings.get("max_bytes", 2_000_000),
+        )
+
+    def clear(self):
+        self.messages = []
+        self.prompts = []
+        self.has_older = False
+        self._limit = self.window_messages
+
+    def load(self, message_repo, chat_history_id):
+        """Replace the state with the last messages of ``chat_history_id``."""
+        self.clear()
+        # One extra row tells whether there is anything older
+        rows = message_repo.load_last_k_text_messages(chat_history_id, self.window_messages + 1)
+        self.has_older = len(rows) > self.window_messages
+        self.messages = [self._display(row) for row in rows[-self.window_messages:]]
+        self.prompts = [{"role": m["role"], "content": m["content"]}
+                        for m in self.messages[-self.prompt_messages:]] if self.prompt_messages else []
+        self._enforce_max_bytes()
+
+    def can_load_older(self):
+        return (self.has_older and bool(self.messages) and self.messages[0]["message_id"] is not None
+                and len(self.messages) < self.max_window_messages)
+
+    def load_older(self, message_repo, chat_history_id):
+        """Page the previous ``page_size`` messages in from the database."""
+        if not self.can_load_older():
+            return
+        count = min(self.page_size, self.max_window_messages - len(self.messages))
+        rows = message_repo.load_last_k_text_messages(chat_history_id, count + 1,
+                                                      before_message_id=self.messages[0]["message_id"])
+        self.has_older = len(rows) > count
+        self.messages = [self._display(row) for row in rows[-count:]] + self.messages
+        self._limit = len(self.messages)
+        self._enforce_max_bytes()
+
+    def append(self, role, content, message_id=None):
+        """Add a displayed message; the oldest ones beyond the window are let go."""
+        self.messages.append({"message_id": message_id, "role": role, "content": content})
+        if len(self.messages) > self._limit:
+            del self.messages[:len(self.messages) - self._limit]
+            self.has_older = True
+        self._enforce_max_bytes()
+
+    def prompt_history(self):
+        """A copy of the model-side history, for ChatAPIHandler.chat to append the new prompt to."""
+        return list(self.prompts)
+
+    def record_turn(self, prompt_history, answer):
+        """Keep the prompt the model saw (``prompt_history`` after the chat call) and its answer."""
+        prompts = prompt_history + [{"role": "assistant", "content": answer}]
+        self.prompts = prompts[-self.prompt_messages:] if self.prompt_messages else []
+        self._enforce_max_bytes()
+
+    def memory_usage(self):
+        message_bytes = sum(_size(message) for message in self.messages)
+        prompt_bytes = sum(_size(prompt) for prompt in self.prompts)
+        return {
+            "messages": len(self.messages),
+            "message_bytes": message_bytes,
+            "prompts": len(self.prompts),
+            "prompt_bytes": prompt_bytes,
+            "total_bytes": message_bytes + prompt_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _enforce_max_bytes(self):
+        if not self.max_bytes:
+            return
+        total = self.memory_usage()["total_bytes"]
+        # The newest message and prompt always stay
+        while total > self.max_bytes and len(self.messages) > 1:
+            total -= _size(self.messages.pop(0))
+            self.has_older = True
+        while total > self.max_bytes and len(self.prompts) > 1:
+            total -= _size(self.prompts.pop(0))
+
+    @staticmethod
+    def _display(row):
+        return {"message_id": row["message_id"], "role": row["sender_type"], "content": row["content"]}
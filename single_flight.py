@@ -0,0 +1,86 @@
+"""Coalesce identical concurrent calls into one upstream call.
+
+    query_embeddings = SingleFlight("query_embedding", ttl=30)
+    vector = query_embeddings.do(("gemini", query), lambda: embedder.embed_query(query))
+
+The first caller for a key (the leader) runs the function. Callers that ask
+for the same key while it runs wait for it and get the same result, or the
+same exception. A successful result is then served to later callers for
+``ttl`` seconds. Failures are never cached. Results are shared objects, so
+callers must not modify them.
+
+This works across threads: the Streamlit script threads and the API server's
+thread pool. Each process has its own groups.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, name, ttl=0.0, max_entries=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._calls = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Return ``func()``, sharing one call among concurrent callers of ``key``."""
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                expires_at, result = cached
+                if expires_at > time.monotonic():
+                    self._record("cached")
+                    return result
+                del self._results[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._record("shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._record("leader")
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and self.ttl > 0:
+                    self._results[key] = (time.monotonic() + self.ttl, call.result)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            call.done.set()
+        return call.result
+
+    def forget(self, key=None):
+        """Drop the cached result of ``key``, or all of them."""
+        with self._lock:
+            if key is None:
+                self._results.clear()
+            else:
+                self._results.pop(key, None)
+
+    def _record(self, outcome):
+        # Imported here because telemetry itself reads the config from utils,
+        # which uses this module
+        from telemetry import increment
+        increment("single_flight_calls_total", 1, "Coalesced calls by outcome",
+                  group=self.name, outcome=outcome)
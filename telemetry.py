@@ -0,0 +1,315 @@
+"""Per-stage tracing and metrics for the chat pipeline.
+
+Usage:
+
+    from telemetry import span, increment
+
+    with span("retrieval.chroma_query", k=4):
+        results = collection.query(...)
+    increment("llm_tokens_total", 120, kind="prompt")
+
+Every finished span is observed in the ``span_duration_seconds`` histogram
+and, if ``telemetry.log_spans`` is set, printed as one JSON line. Metrics are
+exposed in Prometheus text format (``render_prometheus`` or the HTTP endpoint
+from ``start_metrics_server``). With ``telemetry.exporter: otel``, spans and
+metrics are also sent through OpenTelemetry's OTLP exporters, configured by
+the usual OTEL_* environment variables.
+
+When ``telemetry.enabled`` is false, ``span`` returns a shared no-op object
+and the metric helpers return immediately.
+"""
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import get_config
+
+# Seconds; covers DB writes (ms) up to slow model calls (tens of seconds)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_settings = get_config().get("telemetry", {})
+enabled = bool(_settings.get("enabled", False))
+log_spans = bool(_settings.get("log_spans", False))
+exporter = _settings.get("exporter", "prometheus")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+_otel = None
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(label_key, extra=()):
+    items = list(label_key) + list(extra)
+    if not items:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + escaped + "}"
+
+class Counter:
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return lines
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def _get_metric(cls, name, description):
+    metric = _metrics.get(name)
+    if metric is None:
+        with _metrics_lock:
+            metric = _metrics.setdefault(name, cls(name, description))
+    return metric
+
+def increment(name, amount=1, description="", **labels):
+    """Add ``amount`` to the counter ``name``."""
+    if not enabled:
+        return
+    _get_metric(Counter, name, description).inc(amount, **labels)
+    if _otel:
+        _otel.add(name, amount, labels)
+
+def observe(name, value, description="", **labels):
+    """Record ``value`` in the histogram ``name``."""
+    if not enabled:
+        return
+    _get_metric(Histogram, name, description).observe(value, **labels)
+    if _otel:
+        _otel.record(name, value, labels)
+
+class Span:
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id",
+                 "start", "duration", "_token", "_otel_span")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self._otel_span = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def mark_first_token(self):
+        """Record the time from span start to the first generated token."""
+        first_token = time.perf_counter() - self.start
+        self.set_attribute("first_token_s", first_token)
+        observe("llm_first_token_seconds", first_token, "Time to first token of a model call")
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else f"{os.getpid():x}-{self.span_id:x}"
+        if _otel:
+            self._otel_span = _otel.start_span(self.name, self.attributes, parent)
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # A generator span resumed in a different context (e.g. a threadpool)
+            pass
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        observe("span_duration_seconds", self.duration, "Duration of each pipeline stage", span=self.name)
+        if self._otel_span is not None:
+            _otel.end_span(self._otel_span, exc)
+        if log_spans:
+            print(json.dumps({
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "span": self.name,
+                "duration_ms": round(self.duration * 1000, 3),
+                **{k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                   for k, v in self.attributes.items()},
+            }), flush=True)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def mark_first_token(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name, **attributes):
+    """Time a pipeline stage. Nested spans share the trace of their parent."""
+    if not enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def render_prometheus():
+    """Return every metric in Prometheus text exposition format."""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in sorted(metrics, key=lambda m: m.name):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """Serve /metrics on a background thread. Safe to call on every rerun."""
+    global _metrics_server
+    if not enabled or exporter != "prometheus":
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            port = port or _settings.get("prometheus_port", 9464)
+            try:
+                _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # Another worker process on this host already serves the port
+                print(f"Metrics endpoint not started on port {port}: {str(e)}")
+                return None
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server",
+                             daemon=True).start()
+    return _metrics_server
+
+class _OpenTelemetryBridge:
+    """Mirrors spans and metrics into OpenTelemetry, exported over OTLP."""
+
+    def __init__(self):
+        from opentelemetry import metrics, trace
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        resource = Resource.create({"service.name": _settings.get("service_name", "final-llm")})
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        meter_provider = MeterProvider(resource=resource,
+                                       metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())])
+        self._trace = trace
+        self._tracer = tracer_provider.get_tracer("final-llm")
+        self._meter = meter_provider.get_meter("final-llm")
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def start_span(self, name, attributes, parent=None):
+        context = None
+        if parent is not None and parent._otel_span is not None:
+            context = self._trace.set_span_in_context(parent._otel_span)
+        return self._tracer.start_span(name, context=context, attributes={
+            k: v for k, v in attributes.items() if isinstance(v, (int, float, str, bool))
+        })
+
+    def end_span(self, otel_span, exc):
+        if exc is not None:
+            otel_span.record_exception(exc)
+        otel_span.end()
+
+    def _instrument(self, name, factory):
+        instrument = self._instruments.get(name)
+        if instrument is None:
+            with self._lock:
+                instrument = self._instruments.get(name)
+                if instrument is None:
+                    instrument = self._instruments[name] = factory(name)
+        return instrument
+
+    def add(self, name, amount, labels):
+        self._instrument(name, self._meter.create_counter).add(amount, labels)
+
+    def record(self, name, value, labels):
+        self._instrument(name, self._meter.create_histogram).record(value, labels)
+
+if enabled and exporter == "otel":
+    try:
+        _otel = _OpenTelemetryBridge()
+    except ImportError as e:
+        print(f"OpenTelemetry export unavailable, keeping in-process metrics only: {str(e)}")
@@ -1,26 +1,87 @@
 from datetime import datetime
 import base64
+import functools
 import yaml
 import requests
 from dotenv import load_dotenv
 import streamlit as st
 import os
+import threading
 import time
-import google.generativeai as genai
+from single_flight import SingleFlight
+from config_service import ConfigService, parse_config
 
 load_dotenv()
 
 def load_config(file_path = "config.yaml"):
-    with open(file_path, "r") as f:
-        return yaml.safe_load(f)
-    
-config = load_config()
-genai.configure(api_key=config["gemini"]["api_key"])
+    """Parse and validate ``file_path``. Modules use get_config(), which is shared and hot-reloaded."""
+    return parse_config(file_path)
+
+_config_service = None
+_config_service_lock = threading.Lock()
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_config_service():
+    """Return the process-wide ConfigService, watching config.yaml for changes."""
+    global _config_service
+    if _config_service is None:
+        with _config_service_lock:
+            if _config_service is None:
+                service = ConfigService()
+                service.on_reload(_reset_genai, sections=("gemini",))
+                service.on_reload(_reset_model_lists, sections=("gemini", "openai", "single_flight"))
+                service.start_watcher()
+                _config_service = service
+    return _config_service
+
+def get_config():
+    """Return the current config.yaml, parsed once and reloaded when the file changes.
+
+    Read it where the value is used rather than keeping it in a module
+    variable, so changed settings take effect without a restart.
+    """
+    return get_config_service().get()
+
+def on_config_reload(callback, sections=None):
+    """Call ``callback(old, new)`` whenever a reload changes one of ``sections``."""
+    get_config_service().on_reload(callback, sections)
+
+def get_genai():
+    """Import and configure google.generativeai on first use.
+
+    The SDK pulls in grpc and protobuf, which is slow, so it is only loaded
+    once a Gemini call is actually made. This is the only place that calls
+    genai.configure; it runs again after the gemini section changes.
+    """
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                gemini_config = get_config()["gemini"]
+                client_options = None
+                if gemini_config.get("api_endpoint"):
+                    # e.g. a local stub server for load testing
+                    client_options = {"api_endpoint": gemini_config["api_endpoint"]}
+                genai.configure(api_key=gemini_config["api_key"], transport="rest",
+                                client_options=client_options)
+                _genai = genai
+    return _genai
+
+def _reset_genai(old, new):
+    global _genai
+    with _genai_lock:
+        _genai = None
 
 def timeit(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        # Imported here because telemetry itself reads the config from this module
+        from telemetry import span
         start_time = time.time()
-        result = func(*args, **kwargs)
+        with span(f"function.{func.__name__}"):
+            result = func(*args, **kwargs)
         end_time = time.time()
         execution_time = end_time - start_time
         print(f"Function '{func.__name__}' executed in {execution_time:.4f} seconds")
@@ -39,7 +100,8 @@ def command(user_input):
 
 def list_openai_models():
     openai_api_key = os.getenv("OPENAI_API_KEY")
-    response = requests.get("https://api.openai.com/v1/models", headers={"Authorization": f"Bearer {openai_api_key}"}).json()
+    base_url = get_config()["openai"].get("base_url", "https://api.openai.com/v1")
+    response = requests.get(f"{base_url}/models", headers={"Authorization": f"Bearer {openai_api_key}"}).json()
     if response.get("error", False):
         st.warning("OpenAI Error: " + response["error"]["message"])
         return []
@@ -49,20 +111,31 @@ def list_openai_models():
 def list_gemini_models():
     try:
         models = [
-            config["gemini"]["model"],  # Text model
-            config["gemini"]["vision_model"]  # Vision model
+            get_config()["gemini"]["model"],  # Text model
+            get_config()["gemini"]["vision_model"]  # Vision model
         ]
         return models
     except Exception as e:
         st.warning(f"Error listing Gemini models: {str(e)}")
         return []
 
+_model_lists = None
+
+def _reset_model_lists(old, new):
+    global _model_lists
+    _model_lists = None
+
 def list_available_models():
-    models = {
+    """Models per endpoint. Called on every sidebar render, so concurrent
+    callers share one listing and the result is reused for a short while."""
+    global _model_lists
+    if _model_lists is None:
+        ttl = get_config().get("single_flight", {}).get("model_list_ttl_seconds", 60)
+        _model_lists = SingleFlight("model_list", ttl=ttl)
+    return _model_lists.do("all", lambda: {
         "gemini": list_gemini_models(),
         "openai": list_openai_models() if os.getenv("OPENAI_API_KEY") else []
-    }
-    return models
+    })
     
 def convert_bytes_to_base64(image_bytes):
     return base64.b64encode(image_bytes).decode("utf-8")
@@ -81,4 +154,5 @@ def get_avatar(sender_type):
 
 def save_config(config):
     with open("config.yaml", "w") as f:
-        yaml.dump(config, f, default_flow_style=False)
\ No newline at end of file
+        yaml.dump(config, f, default_flow_style=False)
+    get_config_service().reload(force=True)
\ No newline at end of file
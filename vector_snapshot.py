@@ -0,0 +1,231 @@
+# Local Multimodal AI Chat - Multimodal chat application with Gemini
+#
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Export a vector collection to a snapshot file and load it elsewhere without re-embedding.
+
+    python vector_snapshot.py export pdfs.vsnap                  # shared Chroma collection
+    python vector_snapshot.py export alice.vsnap --username alice
+    python vector_snapshot.py import pdfs.vsnap                  # on the new replica
+    python vector_snapshot.py export - | ssh replica python vector_snapshot.py import -
+
+A snapshot holds the chunk ids, texts, metadata and float32 embeddings of
+one VectorDB or SimpleVectorDB collection. Neither store has an index file
+that could be copied safely, so the import rebuilds the index (Chroma's
+HNSW graph, SimpleVectorDB's quantized matrix) from the stored vectors as it
+loads them. Nothing is sent to the embedding model.
+
+File layout, all integers little-endian:
+
+    magic      8 bytes  b"VSNAP\\x00\\x01\\n"
+    header     uint32 length, uint32 CRC-32, JSON: source, collection, dim, count, embedder
+    batches    uint32 rows, uint32 payload length, uint32 CRC-32 of what follows
+               rows x dim float32 embeddings
+               zstd-compressed JSON: {"ids": [...], "documents": [...], "metadatas": [...]}
+    end        uint32 0, uint32 payload length, uint32 CRC-32, JSON {"count": n}
+
+Batches are written and read one at a time, so neither side holds the whole
+collection in memory, and the file can be piped between hosts.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+MAGIC = b"VSNAP\x00\x01\n"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<II")
+_BATCH = struct.Struct("<III")
+
+class SnapshotError(ValueError):
+    """A snapshot is truncated, corrupt or does not fit the target store."""
+
+def embedder_identity(embedder):
+    """Provider and model of ``embedder``; vectors from different ones are not interchangeable."""
+    return {
+        "provider": getattr(embedder, "name", None),
+        "model": getattr(embedder, "model", None) or getattr(embedder, "model_path", None),
+    }
+
+def check_compatible(header, embedder, dim=None, force=False):
+    """Raise SnapshotError unless the snapshot was embedded like ``embedder`` (and has ``dim``)."""
+    if dim is not None and header["dim"] is not None and header["dim"] != dim:
+        raise SnapshotError(f"Snapshot has {header['dim']}-dimensional embeddings, the store {dim}")
+    expected = embedder_identity(embedder)
+    if header.get("embedder") != expected and not force:
+        raise SnapshotError(f"Snapshot was embedded with {header.get('embedder')}, this store uses {expected}; "
+                            f"pass force to load it anyway")
+
+class SnapshotWriter:
+    """Writes a snapshot to a binary file object, one batch at a time.
+
+    The header is written with the first batch, once the dimension is known.
+    """
+
+    def __init__(self, f, source, collection, count, embedder, level=3):
+        import zstandard
+
+        self.f = f
+        self.header = {
+            "version": FORMAT_VERSION,
+            "source": source,
+            "collection": collection,
+            "dim": None,
+            # Rows expected when the export started; the end record has the actual count
+            "count": count,
+            "embedder": embedder_identity(embedder),
+            "created_at": time.time(),
+        }
+        self.count = 0
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._header_written = False
+
+    def write_batch(self, ids, embeddings, documents, metadatas=None):
+        embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+        if not len(ids):
+            return
+        if embeddings.shape[0] != len(ids) or len(documents) != len(ids):
+            raise ValueError("ids, embeddings and documents must have the same length")
+        if self.header["dim"] is None:
+            self.header["dim"] = int(embeddings.shape[1])
+        elif embeddings.shape[1] != self.header["dim"]:
+            raise ValueError(f"Expected {self.header['dim']}-dimensional embeddings, got {embeddings.shape[1]}")
+        self._write_header()
+        payload = self._compressor.compress(json.dumps({
+            "ids": list(ids),
+            "documents": list(documents),
+            "metadatas": list(metadatas) if metadatas is not None else [None] * len(ids),
+        }).encode("utf-8"))
+        vectors = embeddings.tobytes()
+        self.f.write(_BATCH.pack(len(ids), len(payload), zlib.crc32(payload, zlib.crc32(vectors))))
+        self.f.write(vectors)
+        self.f.write(payload)
+        self.count += len(ids)
+
+    def close(self):
+        """Write the end record. Returns the number of rows written."""
+        self._write_header()
+        payload = json.dumps({"count": self.count}).encode("utf-8")
+        self.f.write(_BATCH.pack(0, len(payload), zlib.crc32(payload)))
+        self.f.write(payload)
+        self.f.flush()
+        return self.count
+
+    def _write_header(self):
+        if self._header_written:
+            return
+        header = json.dumps(self.header).encode("utf-8")
+        self.f.write(MAGIC + _HEADER.pack(len(header), zlib.crc32(header)) + header)
+        self._header_written = True
+
+class SnapshotReader:
+    """Reads a snapshot from a binary file object; iterate it for its batches.
+
+    Each batch is a dict with ``ids``, ``embeddings`` (a float32 array),
+    ``documents`` and ``metadatas``, checked against its CRC before it is
+    returned. Iteration raises SnapshotError on a truncated or damaged file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        if self._read(len(MAGIC)) != MAGIC:
+            raise SnapshotError("Not a vector snapshot")
+        length, crc = _HEADER.unpack(self._read(_HEADER.size))
+        header = self._read(length)
+        if zlib.crc32(header) != crc:
+            raise SnapshotError("Corrupt snapshot header")
+        self.header = json.loads(header)
+        if self.header.get("version") != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {self.header.get('version')}")
+        self.count = 0
+
+    def __iter__(self):
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor()
+        dim = self.header["dim"]
+        while True:
+            rows, payload_length, crc = _BATCH.unpack(self._read(_BATCH.size))
+            vectors = self._read(rows * dim * 4) if rows else b""
+            payload = self._read(payload_length)
+            if zlib.crc32(payload, zlib.crc32(vectors)) != crc:
+                raise SnapshotError(f"Corrupt batch after {self.count} rows")
+            if rows == 0:
+                expected = json.loads(payload)["count"]
+                if expected != self.count:
+                    raise SnapshotError(f"Snapshot ends after {self.count} of {expected} rows")
+                return
+            batch = json.loads(decompressor.decompress(payload))
+            if not len(batch["ids"]) == len(batch["documents"]) == len(batch["metadatas"]) == rows:
+                raise SnapshotError(f"Inconsistent batch after {self.count} rows")
+            batch["embeddings"] = np.frombuffer(vectors, dtype="<f4").reshape(rows, dim)
+            self.count += rows
+            yield batch
+
+    def _read(self, size):
+        data = self.f.read(size)
+        # Pipes may return less than asked for before the end
+        while len(data) < size:
+            more = self.f.read(size - len(data))
+            if not more:
+                raise SnapshotError(f"Snapshot is truncated after {self.count} rows")
+            data += more
+        return data
+
+def open_output(path):
+    if path == "-":
+        return sys.stdout.buffer
+    # Written beside the target and renamed when complete
+    return open(f"{path}.tmp", "wb")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="snapshot file, or - for stdout/stdin")
+    parser.add_argument("--username", help="the user's collection instead of the shared one")
+    parser.add_argument("--simple-path", help="a SimpleVectorDB directory instead of Chroma")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per batch when exporting")
+    parser.add_argument("--force", action="store_true", help="import even if the embedding model differs")
+    args = parser.parse_args()
+
+    from vectordb_handler import SimpleVectorDB, load_vectordb
+
+    store = SimpleVectorDB(args.simple_path) if args.simple_path else load_vectordb(args.username)
+    # Progress goes to stderr, which stays free when the snapshot is piped
+    start = time.perf_counter()
+    if args.command == "export":
+        f = open_output(args.path)
+        try:
+            count = store.export_snapshot(f, batch_size=args.batch_size)
+            if f is not sys.stdout.buffer:
+                f.close()
+                os.replace(f"{args.path}.tmp", args.path)
+        finally:
+            if f is not sys.stdout.buffer and not f.closed:
+                f.close()
+                os.remove(f"{args.path}.tmp")
+        print(f"Exported {count} chunks in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        f = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+        with f:
+            count = store.import_snapshot(f, force=args.force)
+        print(f"Imported {count} chunks in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -10,155 +10,528 @@ sys.modules['sqlite3'] = sys.modules['pysqlite3'] # Replace the default sqlite3
 # Now, it's safe to import chromadb and other libraries
 import chromadb
 from chromadb.config import Settings
-import google.generativeai as genai
-from utils import load_config
+from utils import get_config, on_config_reload
+from embeddings import EmbeddingError, GeminiEmbeddingProvider, get_embedding_provider
+from telemetry import span
+from single_flight import SingleFlight
+from vector_snapshot import SnapshotReader, SnapshotWriter, check_compatible
+from collections import Counter
 import numpy as np
+import hashlib
 import json
+import uuid
 
-# Load configuration (assuming load_config() is defined in utils.py)
-config = load_config()
+# Identical queries arriving together (many users on the shared knowledge
+# base) share one embedding call and one Chroma query
+single_flight_config = get_config().get("single_flight", {})
+_query_embeddings = SingleFlight("query_embedding", ttl=single_flight_config.get("query_embedding_ttl_seconds", 30))
+_retrievals = SingleFlight("retrieval", ttl=single_flight_config.get("retrieval_ttl_seconds", 5))
+# Bumped on every write to a collection, so cached retrievals never outlive a
+# write made in this process
+_collection_versions = Counter()
+
+def _reset_single_flights(old, new):
+    # Cached vectors may come from another embedding model or collection
+    settings = new.get("single_flight", {})
+    _query_embeddings.ttl = settings.get("query_embedding_ttl_seconds", 30)
+    _retrievals.ttl = settings.get("retrieval_ttl_seconds", 5)
+    _query_embeddings.forget()
+    _retrievals.forget()
+
+on_config_reload(_reset_single_flights, sections=("single_flight", "embeddings", "gemini", "chromadb"))
 
 class Document:
-    def __init__(self, page_content, metadata=None):
+    def __init__(self, page_content, metadata=None, embedding=None, distance=None):
         self.page_content = page_content
         self.metadata = metadata or {}
+        # Set by search_candidates, for re-ranking retrieved chunks
+        self.embedding = embedding
+        self.distance = distance
+
+def collection_name_for(username=None):
+    """Chroma collection holding ``username``'s chunks; None is the shared collection."""
+    base = get_config()["chromadb"]["collection_name"]
+    if username is None:
+        return base
+    # Hashed, because Chroma only accepts [a-zA-Z0-9._-] in collection names
+    return f"{base}-user-{hashlib.sha256(username.encode()).hexdigest()[:16]}"
 
 class VectorDB:
-    def __init__(self):
+    """Chunks of one user's PDFs, or of the shared collection when ``username`` is None.
+
+    Every user has a collection of their own, so a search only walks that
+    user's index and clearing it never touches anyone else's. Chunks carry
+    ``document_id`` and ``source`` metadata, which scopes searches to some
+    documents and lets one document be deleted on its own.
+    """
+
+    def __init__(self, model=None, embedder=None, username=None):
         # Initialize ChromaDB PersistentClient.
         # This will use the patched sqlite3 due to the code at the top of the file.
-        self.client = chromadb.PersistentClient(path=config["chromadb"]["chromadb_path"])
-        self.collection = self.client.get_or_create_collection(
-            name=config["chromadb"]["collection_name"],
-            metadata={"hnsw:space": "cosine"}
-        )
+        chromadb_config = get_config()["chromadb"]
+        self.client = chromadb.PersistentClient(path=chromadb_config["chromadb_path"])
+        self.username = username
+        self.collection_name = collection_name_for(username)
+        self.collection = self._get_collection(self.collection_name)
+        # Users also see the shared corpus (e.g. loaded with bulk_ingest.py)
+        self.shared_collection = None
+        if username is not None and chromadb_config.get("search_shared", True):
+            self.shared_collection = self._get_collection(collection_name_for(None))
         
-        # Configure Gemini for embeddings
-        # Ensure GEMINI_API_KEY is set in your config.json or environment variables
-        genai.configure(api_key=config["gemini"]["api_key"])
-        self.model = genai.GenerativeModel('embedding-001')
+        self.embedder = embedder or _default_embedder(model)
 
-    def add_texts(self, texts):
-        embeddings = []
-        for text in texts:
-            try:
-                # Generate embeddings using Gemini's embedding model
-                # Note: result.prompt_feedback.safety_ratings[0].probability is not the embedding.
-                # The embedding is typically found in result.embedding or similar attribute.
-                # Please verify the correct path to the embedding from Gemini API response.
-                # For 'embedding-001', it's usually `response.embedding.values`.
-                response = self.model.embed_content(model="embedding-001", content=text)
-                embedding = response['embedding'] # Access the embedding values
-                embeddings.append(embedding)
-            except Exception as e:
-                print(f"Error generating embedding for text: '{text[:50]}...' - {str(e)}")
-                # Use a zero vector as fallback if embedding generation fails
-                # The embedding dimension for 'embedding-001' is 768
-                embeddings.append([0.0] * 768) 
-        
+    def _get_collection(self, name):
+        return self.client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+
+    def add_texts(self, texts, ids=None, metadatas=None):
+        """Embed and store ``texts``.
+
+        ``ids`` makes the write idempotent: storing the same ids again replaces
+        the earlier entries, which is how resumed ingestion jobs replay a batch.
+        Without ids every text gets a fresh random one.
+        """
+        if ids is None:
+            ids = [uuid.uuid4().hex for _ in texts]
+        embeddings = self.embed_texts(texts)
+        self.add_embeddings(texts, embeddings, ids, metadatas)
+
+    def embed_texts(self, texts):
+        with span("ingest.embed", texts=len(texts)):
+            return self._embed_texts(texts)
+
+    def add_embeddings(self, texts, embeddings, ids, metadatas=None):
+        """Store already computed embeddings, replacing entries with the same ids."""
         # Add to ChromaDB
         # Ensure that the number of embeddings, documents, and ids match
-        if embeddings and len(embeddings) == len(texts):
-            self.collection.add(
-                embeddings=embeddings,
-                documents=texts,
-                ids=[f"doc_{i}" for i in range(len(texts))]
-            )
+        if embeddings and len(embeddings) == len(texts) == len(ids):
+            with span("ingest.chroma_add", texts=len(texts)):
+                self.collection.upsert(
+                    embeddings=embeddings,
+                    documents=texts,
+                    ids=list(ids),
+                    metadatas=metadatas
+                )
+            _collection_versions[self.collection_name] += 1
         else:
             print("Warning: No embeddings generated or mismatch in lengths. No documents added to ChromaDB.")
 
-    def similarity_search(self, query, k=4):
-        # Generate query embedding
+    def _embed_texts(self, texts):
+        # Raises EmbeddingError rather than storing placeholder vectors
+        return self.embedder.embed_documents(texts)
+
+    def similarity_search(self, query, k=4, document_ids=None):
+        """Return the ``k`` closest chunks, only from ``document_ids`` if given."""
+        _, documents = self.search_candidates(query, k, document_ids, include_embeddings=False)
+        return documents
+
+    def search_candidates(self, query, k=4, document_ids=None, include_embeddings=True):
+        """Like similarity_search, but also return the query embedding, and give
+        every Document its distance and (optionally) its stored embedding.
+
+        Concurrent identical searches share one result; do not modify it.
+        """
+        collections = [self.collection]
+        if not document_ids and self.shared_collection is not None:
+            collections.append(self.shared_collection)
+        key = (
+            self.embedder, query, k, tuple(sorted(document_ids or ())), include_embeddings,
+            tuple((c.name, _collection_versions[c.name]) for c in collections),
+        )
         try:
-            # Correct way to get embedding for query
-            response = self.model.embed_content(model="embedding-001", content=query)
-            query_embedding = response['embedding']
-        except Exception as e:
+            return _retrievals.do(key, lambda: self._search(collections, query, k, document_ids, include_embeddings))
+        except EmbeddingError as e:
             print(f"Error generating query embedding: {str(e)}")
-            query_embedding = [0.0] * 768  # Fallback to zero vector
-        
+            return None, []
+
+    def _search(self, collections, query, k, document_ids, include_embeddings):
+        # Generate query embedding
+        with span("retrieval.query_embed", provider=self.embedder.name):
+            query_embedding = _query_embeddings.do((self.embedder, query), lambda: self.embedder.embed_query(query))
+
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        where = None
+        if document_ids:
+            where = {"document_id": {"$in": list(document_ids)}}
+
         # Search in ChromaDB
         # Note: query_embeddings expects a list of embeddings, even for a single query
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k
-        )
+        hits = []
+        with span("retrieval.chroma_query", k=k, collections=len(collections), filtered=bool(where)):
+            for collection in collections:
+                results = collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=k,
+                    where=where,
+                    include=include
+                )
+                # Ensure results["documents"] is not empty before accessing [0]
+                if results and results["documents"] and results["documents"][0]:
+                    embeddings = results["embeddings"][0] if include_embeddings else [None] * len(results["ids"][0])
+                    hits.extend(
+                        Document(page_content=doc, metadata=metadata, embedding=embedding, distance=distance)
+                        for doc, metadata, embedding, distance in zip(
+                            results["documents"][0], results["metadatas"][0], embeddings, results["distances"][0]
+                        )
+                    )
         
-        # Return results as Document objects
-        # Ensure results["documents"] is not empty before accessing [0]
-        if results and results["documents"] and results["documents"][0]:
-            return [Document(page_content=doc) for doc in results["documents"][0]]
-        else:
-            return [] # Return empty list if no results found
+        # Return results as Document objects, closest first across collections
+        hits.sort(key=lambda document: document.distance)
+        return query_embedding, hits[:k]
+
+    def delete_document(self, document_id):
+        """Remove every chunk of one document."""
+        with span("vectordb.delete_document"):
+            self.collection.delete(where={"document_id": document_id})
+        _collection_versions[self.collection_name] += 1
+
+    def clear(self):
+        """Drop this user's (or the shared) collection entirely."""
+        self.client.delete_collection(self.collection_name)
+        self.collection = self._get_collection(self.collection_name)
+        _collection_versions[self.collection_name] += 1
+
+    def export_snapshot(self, f, batch_size=1000):
+        """Write this collection to ``f`` in the vector_snapshot format; returns the row count.
+
+        The snapshot holds the chunks present when the export starts. Chunks
+        deleted while it runs are left out; chunks added meanwhile are not in it.
+        """
+        with span("vectordb.export_snapshot"):
+            ids = self.collection.get(include=[])["ids"]
+            writer = SnapshotWriter(f, "chroma", self.collection_name, len(ids), self.embedder)
+            for start in range(0, len(ids), batch_size):
+                batch = self.collection.get(ids=ids[start:start + batch_size],
+                                            include=["embeddings", "documents", "metadatas"])
+                writer.write_batch(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+            return writer.close()
+
+    def import_snapshot(self, f, force=False):
+        """Upsert the chunks of a snapshot read from ``f``, without embedding them again.
 
-def load_vectordb():
+        Chunks keep their ids, so importing the same snapshot twice changes
+        nothing. Returns the row count.
+        """
+        reader = SnapshotReader(f)
+        check_compatible(reader.header, self.embedder, force=force)
+        max_batch = self.client.get_max_batch_size()
+        with span("vectordb.import_snapshot"):
+            for batch in reader:
+                for start in range(0, len(batch["ids"]), max_batch):
+                    end = start + max_batch
+                    with span("ingest.chroma_add", texts=end - start):
+                        self.collection.upsert(
+                            ids=batch["ids"][start:end],
+                            embeddings=batch["embeddings"][start:end],
+                            documents=batch["documents"][start:end],
+                            metadatas=batch["metadatas"][start:end] if any(batch["metadatas"]) else None,
+                        )
+                _collection_versions[self.collection_name] += 1
+        return reader.count
+
+def _default_embedder(model):
+    # A model object with embed_content (the genai module or a test double)
+    # keeps working; otherwise use the provider chosen in config.yaml
+    if model is not None:
+        return GeminiEmbeddingProvider(client=model)
+    return get_embedding_provider()
+
+def load_vectordb(username=None):
     # This function will now correctly initialize VectorDB using the patched sqlite3
-    return VectorDB()
+    return VectorDB(username=username)
 
 # --- SimpleVectorDB (if you intend to use this, it's a separate implementation) ---
 # This class seems to be a fallback or alternative if ChromaDB is not used.
-# It uses a local JSON file for storage and manual similarity calculation.
-# It also needs the Gemini API key for embeddings.
+# It keeps its vectors in numpy files and scores them itself.
+# Embeddings come from the same provider as VectorDB.
+STORAGE_MODES = ("float32", "float16", "int8")
+SCAN_BLOCK_ROWS = 4096
+
 class SimpleVectorDB:
-    def __init__(self, db_path="chroma_db"): # Note: This db_path is for a JSON file, not Chroma's path
+    """Flat vector store searched by brute-force dot product.
+
+    Files in ``db_path``, all append-only:
+        meta.json                 vector dimension
+        texts.jsonl               one chunk text per line
+        embeddings.f32            exact float32 vectors, raw row-major
+        embeddings.float16        search matrix for float16 storage
+        embeddings.int8           search matrix for int8 storage
+        embeddings.int8.scales    per-vector float32 scales for int8 storage
+
+    Only the search matrix is held in memory. With ``storage`` float32 it is
+    a full in-memory copy of embeddings.f32, as large as that file. With
+    float16 it takes half of that; with int8 a quarter, each vector being
+    stored as round(v / scale) with scale = max(|v|) / 127. The exact vectors
+    stay on disk, memory-mapped, and are read only to re-rank the best
+    ``rerank_candidates`` hits of a quantized search.
+
+    The matrix grows by doubling its capacity, so adding many small batches
+    costs amortised O(1) copying per row.
+    """
+
+    def __init__(self, db_path="chroma_db", model=None, embedder=None, storage=None,
+                 rerank_candidates=None): # Note: This db_path is for the files above, not Chroma's path
+        settings = get_config().get("simple_vectordb", {})
+        self.storage = storage or settings.get("storage", "float32")
+        if self.storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {self.storage}; choose from {STORAGE_MODES}")
+        self.rerank_candidates = settings.get("rerank_candidates", 0) if rerank_candidates is None \
+            else rerank_candidates
         self.db_path = db_path
-        # Configure Gemini for embeddings (redundant if VectorDB is used, but necessary for SimpleVectorDB)
-        genai.configure(api_key=config["gemini"]["api_key"])
-        self.model = genai.GenerativeModel('embedding-001')
+        self.embedder = embedder or _default_embedder(model)
         os.makedirs(db_path, exist_ok=True)
-        self.vectors_file = os.path.join(db_path, "vectors.json")
+        self.meta_file = os.path.join(db_path, "meta.json")
+        self.texts_file = os.path.join(db_path, "texts.jsonl")
+        self.exact_file = os.path.join(db_path, "embeddings.f32")
+        self.matrix_file = os.path.join(db_path, f"embeddings.{self.storage}")
+        self.scales_file = os.path.join(db_path, "embeddings.int8.scales")
+        # Stores written before the binary layout
+        self.legacy_vectors_file = os.path.join(db_path, "vectors.json")
         self.load_db()
 
     def load_db(self):
-        if os.path.exists(self.vectors_file):
-            with open(self.vectors_file, 'r') as f:
-                self.db = json.load(f)
+        self.texts, self.dim, self.exact, self.matrix, self.scales = [], None, None, None, None
+        # Preallocated rows behind self.matrix and self.scales, which are views of their first rows
+        self._matrix_buffer, self._scales_buffer = None, None
+        if not os.path.exists(self.meta_file):
+            if os.path.exists(self.legacy_vectors_file):
+                with open(self.legacy_vectors_file, 'r') as f:
+                    legacy = json.load(f)
+                self.add_embeddings(legacy["texts"], legacy["embeddings"])
+            return
+
+        with open(self.meta_file, 'r') as f:
+            self.dim = json.load(f)["dim"]
+        with open(self.texts_file, 'r') as f:
+            self.texts = [json.loads(line) for line in f]
+        self.exact = self._map(self.exact_file, np.float32)
+        # A crash between appends can leave one file a batch ahead of another
+        count = min(len(self.texts), len(self.exact))
+        self._truncate(count)
+        self.exact = self._map(self.exact_file, np.float32)
+
+        if self.storage == "float32":
+            # A copy, not the memory map: searches scan every row
+            self._extend_matrix(np.array(self.exact), None)
+            return
+        matrix = self._map(self.matrix_file, self.storage)
+        scales = self._map(self.scales_file, np.float32, flat=True) if self.storage == "int8" else None
+        if len(matrix) == count and (scales is None or len(scales) == count):
+            self._extend_matrix(np.array(matrix), np.array(scales) if scales is not None else None)
         else:
-            self.db = {"texts": [], "embeddings": []}
-            self.save_db()
+            # First load in this storage mode: quantize from the exact vectors
+            matrix, scales = self._quantize(self.exact)
+            self._write(self.matrix_file, matrix, "wb")
+            if scales is not None:
+                self._write(self.scales_file, scales, "wb")
+            self._extend_matrix(matrix, scales)
+
+    def _map(self, path, dtype, flat=False):
+        """Memory-map a raw file as one row per vector (or one value per vector if ``flat``)."""
+        shape = () if flat else (self.dim,)
+        row_bytes = np.dtype(dtype).itemsize * (1 if flat else self.dim)
+        rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if rows == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(rows,) + shape)
+
+    def _truncate(self, count):
+        # Drop whatever a crash left beyond the last complete entry, so the
+        # next append starts on a row boundary in every file
+        files = [(self.exact_file, 4 * self.dim), (self.matrix_file, np.dtype(self.storage).itemsize * self.dim),
+                 (self.scales_file, 4)]
+        for path, row_bytes in files:
+            if os.path.exists(path) and os.path.getsize(path) > count * row_bytes:
+                os.truncate(path, count * row_bytes)
+        if len(self.texts) > count:
+            self.texts = self.texts[:count]
+            with open(self.texts_file, 'w') as f:
+                f.writelines(json.dumps(text) + "\n" for text in self.texts)
+
+    @staticmethod
+    def _write(path, array, mode):
+        with open(path, mode) as f:
+            f.write(np.ascontiguousarray(array).tobytes())
 
-    def save_db(self):
-        with open(self.vectors_file, 'w') as f:
-            json.dump(self.db, f)
+    def _quantize(self, vectors):
+        if self.storage == "float32":
+            return np.asarray(vectors, dtype=np.float32), None
+        if self.storage == "float16":
+            return np.asarray(vectors, dtype=np.float16), None
+        quantized = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            block_scales = np.abs(block).max(axis=1) / 127
+            block_scales[block_scales == 0] = 1
+            quantized[start:start + len(block)] = np.round(block / block_scales[:, None])
+            scales[start:start + len(block)] = block_scales
+        return quantized, scales
 
     def add_texts(self, texts):
-        embeddings = []
-        for text in texts:
+        with span("ingest.embed", texts=len(texts)):
+            embeddings = self.embedder.embed_documents(texts)
+        self.add_embeddings(texts, embeddings)
+
+    def add_embeddings(self, texts, embeddings):
+        """Append already computed embeddings to the store."""
+        if len(texts) == 0:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.meta_file, 'w') as f:
+                json.dump({"dim": self.dim}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+
+        quantized, scales = self._append(texts, vectors)
+        self.texts.extend(texts)
+        self.exact = self._map(self.exact_file, np.float32)
+        self._extend_matrix(quantized, scales)
+
+    def _extend_matrix(self, quantized, scales):
+        """Add rows to the search matrix (and scales), reallocating only when the buffer is full."""
+        count = 0 if self.matrix is None else len(self.matrix)
+        needed = count + len(quantized)
+        if count == 0:
+            # Loaded or first rows: used as they are, no spare capacity yet
+            self._matrix_buffer, self._scales_buffer = quantized, scales
+        else:
+            if needed > len(self._matrix_buffer):
+                capacity = max(needed, 2 * count)
+                buffer = np.empty((capacity, self.dim), dtype=self.matrix.dtype)
+                buffer[:count] = self.matrix
+                self._matrix_buffer = buffer
+                if scales is not None:
+                    scales_buffer = np.empty(capacity, dtype=np.float32)
+                    scales_buffer[:count] = self.scales
+                    self._scales_buffer = scales_buffer
+            # Rows beyond the current views are unused, so searches running now are unaffected
+            self._matrix_buffer[count:needed] = quantized
+            if scales is not None:
+                self._scales_buffer[count:needed] = scales
+        self.matrix = self._matrix_buffer[:needed]
+        self.scales = self._scales_buffer[:needed] if scales is not None else None
+
+    def _append(self, texts, vectors):
+        """Append entries to the files only; returns their search rows and scales."""
+        quantized, scales = self._quantize(vectors)
+        self._write(self.exact_file, vectors, "ab")
+        if self.storage != "float32":
+            self._write(self.matrix_file, quantized, "ab")
+            if scales is not None:
+                self._write(self.scales_file, scales, "ab")
+        # Texts last: on load, the shortest file decides how many entries count
+        with open(self.texts_file, 'a') as f:
+            f.writelines(json.dumps(text) + "\n" for text in texts)
+        return quantized, scales
+
+    def export_snapshot(self, f, batch_size=4096):
+        """Write the store to ``f`` in the vector_snapshot format; returns the row count.
+
+        Entries are only ever appended, so the rows present when the export
+        starts form a consistent snapshot even while more are being added.
+        """
+        count = len(self.texts)
+        collection = os.path.basename(os.path.normpath(self.db_path))
+        with span("vectordb.export_snapshot"):
+            writer = SnapshotWriter(f, "simple", collection, count, self.embedder)
+            for start in range(0, count, batch_size):
+                end = min(start + batch_size, count)
+                # Entries have no ids of their own
+                writer.write_batch([f"{collection}:{row}" for row in range(start, end)],
+                                   self.exact[start:end], self.texts[start:end])
+            return writer.close()
+
+    def import_snapshot(self, f, force=False):
+        """Load a snapshot read from ``f`` into this store, which must be empty.
+
+        Batches go straight to the files; the search matrix is built once at
+        the end. Ids and metadata are not kept. If the import fails part-way
+        (e.g. a truncated or corrupt snapshot), the rows written so far are
+        removed again and the store is left empty. Returns the row count.
+        """
+        if self.texts:
+            raise ValueError(f"{self.db_path} already holds {len(self.texts)} entries; import into an empty store")
+        reader = SnapshotReader(f)
+        check_compatible(reader.header, self.embedder, force=force)
+        with span("vectordb.import_snapshot"):
             try:
-                response = self.model.embed_content(model="embedding-001", content=text)
-                embedding = response['embedding']
-                embeddings.append(embedding)
-            except Exception as e:
-                print(f"Error generating embedding for text: '{text[:50]}...' - {str(e)}")
-                embeddings.append([0.0] * 768)
-        
-        self.db["texts"].extend(texts)
-        self.db["embeddings"].extend(embeddings)
-        self.save_db()
+                for batch in reader:
+                    if self.dim is None:
+                        self.dim = batch["embeddings"].shape[1]
+                        with open(self.meta_file, 'w') as meta:
+                            json.dump({"dim": self.dim}, meta)
+                    self._append(batch["documents"], batch["embeddings"])
+            except BaseException:
+                # Interrupted too: a store holding part of a snapshot looks complete.
+                # The search matrices of every storage mode go as well, as a later
+                # load in that mode would take one of matching length as valid.
+                matrix_files = [os.path.join(self.db_path, f"embeddings.{mode}") for mode in STORAGE_MODES]
+                for path in [self.meta_file, self.texts_file, self.exact_file, self.scales_file] + matrix_files:
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.load_db()
+                raise
+            self.load_db()
+        return reader.count
 
-    def similarity_search(self, query, k=4):
-        if not self.db["texts"]:
+    def memory_usage(self):
+        """Bytes held in memory for search, and what float32 would need."""
+        if self.matrix is None:
+            return {"search_bytes": 0, "float32_bytes": 0}
+        search_bytes = self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return {"search_bytes": search_bytes, "float32_bytes": self.matrix.size * 4}
+
+    def _scores(self, query_vector):
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ query_vector
+        # Widen one cache-sized block at a time into a reused buffer, so no
+        # float32 copy of the whole matrix exists
+        scores = np.empty(len(self.matrix), dtype=np.float32)
+        buffer = np.empty((SCAN_BLOCK_ROWS, self.dim), dtype=np.float32)
+        for start in range(0, len(self.matrix), SCAN_BLOCK_ROWS):
+            block = self.matrix[start:start + SCAN_BLOCK_ROWS]
+            widened = buffer[:len(block)]
+            widened[...] = block
+            np.matmul(widened, query_vector, out=scores[start:start + len(block)])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search_by_vector(self, query_vector, k=4):
+        """Return the indices of the ``k`` best-scoring vectors, best first."""
+        if self.matrix is None or not len(self.matrix):
             return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        scores = self._scores(query_vector)
+        rerank = self.storage != "float32" and self.rerank_candidates > k
+        candidates = min(len(scores), self.rerank_candidates if rerank else k)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        if rerank:
+            # Exact scores for the shortlist, read in file order from the memory map
+            top = np.sort(top)
+            top_scores = np.asarray(self.exact[top], dtype=np.float32) @ query_vector
+        else:
+            top_scores = scores[top]
+        return top[np.argsort(-top_scores, kind="stable")][:k].tolist()
 
-        try:
-            response = self.model.embed_content(model="embedding-001", content=query)
-            query_embedding = response['embedding']
-        except Exception as e:
-            print(f"Error generating query embedding: {str(e)}")
-            query_embedding = [0.0] * 768
+    def similarity_search(self, query, k=4):
+        if not self.texts:
+            return []
 
-        similarities = []
-        for doc_embedding in self.db["embeddings"]:
-            # Ensure both embeddings are numpy arrays for dot product if they aren't already
-            # Or convert to list and use sum(a*b for a,b in zip(query_embedding, doc_embedding))
-            similarity = np.dot(query_embedding, doc_embedding)
-            similarities.append(similarity)
+        with span("retrieval.query_embed", provider=self.embedder.name):
+            try:
+                query_embedding = self.embedder.embed_query(query)
+            except EmbeddingError as e:
+                print(f"Error generating query embedding: {str(e)}")
+                return []
 
-        # Get indices of top k similar documents
-        top_k_indices = np.argsort(similarities)[-k:][::-1]
+        with span("retrieval.scan", vectors=len(self.texts), k=k, storage=self.storage):
+            top_k_indices = self.search_by_vector(query_embedding, k)
         
         # Return Document objects
-        return [Document(page_content=self.db["texts"][idx]) for idx in top_k_indices]
+        return [Document(page_content=self.texts[idx]) for idx in top_k_indices]
 
 # This class seems to be a simple data structure, not a part of the DB logic.
 class SimpleDocument:
@@ -0,0 +1,162 @@
+"""Whisper speech recognition through onnxruntime, for CPU-only hosts.
+
+Select it in config.yaml:
+
+    whisper:
+      backend: "onnx"
+
+The model directory is an ONNX export with separate encoder and decoder
+graphs (no merged decoder), next to the Whisper preprocessor and tokenizer
+files. Export it once with optimum, then quantize the weights to int8:
+
+    optimum-cli export onnx --model openai/whisper-small \\
+        --task automatic-speech-recognition-with-past --no-post-process ./models/whisper-small-onnx
+    python -c "import whisper_onnx; whisper_onnx.quantize_model('./models/whisper-small-onnx')"
+
+Decoding is greedy, like the transformers pipeline's default. With
+``decoder_with_past_model.onnx`` present, every step reuses the attention
+keys and values of the previous steps instead of decoding the whole
+sequence again.
+"""
+import json
+import os
+
+import numpy as np
+
+# Whisper's feature extractor expects 16 kHz audio, in windows of 30 seconds
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+# Decoder positions of the Whisper models, prompt tokens included
+MAX_TARGET_POSITIONS = 448
+
+GRAPHS = ("encoder_model", "decoder_model", "decoder_with_past_model")
+QUANTIZED_SUFFIX = "_quantized"
+
+def quantize_model(model_path):
+    """Write int8 copies (``*_quantized.onnx``) of the graphs in ``model_path``."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    for graph in GRAPHS:
+        source = os.path.join(model_path, f"{graph}.onnx")
+        if not os.path.exists(source):
+            continue
+        target = os.path.join(model_path, f"{graph}{QUANTIZED_SUFFIX}.onnx")
+        # Weights as signed int8 and activations as uint8, the fast path on x86
+        quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+        print(f"Quantized {source} -> {target}")
+
+class OnnxWhisper:
+    """Greedy Whisper transcription with onnxruntime.
+
+    ``language`` is a Whisper language code such as ``"en"``. Without one,
+    multilingual models detect the language of every 30 second window.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path, quantized=True, intra_op_threads=0, language=None, max_new_tokens=224):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        from transformers import WhisperFeatureExtractor
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets onnxruntime use one thread per physical core
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        def load(graph, required=True):
+            path = os.path.join(model_path, f"{graph}{QUANTIZED_SUFFIX if quantized else ''}.onnx")
+            if not os.path.exists(path):
+                if required:
+                    raise FileNotFoundError(f"Missing Whisper ONNX graph: {path}")
+                return None
+            return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        self.encoder = load("encoder_model")
+        self.decoder = load("decoder_model")
+        self.decoder_with_past = load("decoder_with_past_model", required=False)
+
+        self.feature_extractor = WhisperFeatureExtractor.from_pretrained(model_path)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        generation_config = {}
+        generation_config_path = os.path.join(model_path, "generation_config.json")
+        if os.path.exists(generation_config_path):
+            with open(generation_config_path) as f:
+                generation_config = json.load(f)
+
+        token = self.tokenizer.token_to_id
+        self.start_token = generation_config.get("decoder_start_token_id", token("<|startoftranscript|>"))
+        self.end_token = generation_config.get("eos_token_id", token("<|endoftext|>"))
+        self.no_timestamps_token = generation_config.get("no_timestamps_token_id", token("<|notimestamps|>"))
+        self.transcribe_token = generation_config.get("task_to_id", {}).get("transcribe", token("<|transcribe|>"))
+        # English-only models take neither a language nor a task token
+        self.language_tokens = generation_config.get("lang_to_id", {})
+        self.language_token = None
+        if language is not None and self.language_tokens:
+            self.language_token = self.language_tokens[f"<|{language}|>"]
+
+        vocab_size = self.tokenizer.get_vocab_size(with_added_tokens=True)
+        self.suppress = np.zeros(vocab_size, dtype=bool)
+        self.suppress[generation_config.get("suppress_tokens", [])] = True
+        # Timestamp tokens follow <|notimestamps|>; transcripts are plain text
+        self.suppress[self.no_timestamps_token + 1:] = True
+        self.begin_suppress = list(generation_config.get("begin_suppress_tokens", [self.end_token]))
+        self.max_new_tokens = max_new_tokens
+
+    def transcribe(self, audio):
+        window = WINDOW_SECONDS * SAMPLE_RATE
+        texts = [self._transcribe_window(audio[start:start + window]) for start in range(0, len(audio), window)]
+        return " ".join(text for text in texts if text)
+
+    def _transcribe_window(self, audio):
+        features = self.feature_extractor(audio, sampling_rate=SAMPLE_RATE, return_tensors="np").input_features
+        encoder_hidden_states = self.encoder.run(None, {"input_features": features.astype(np.float32)})[0]
+        tokens = self._generate(encoder_hidden_states, self._prompt(encoder_hidden_states))
+        return self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+
+    def _prompt(self, encoder_hidden_states):
+        if not self.language_tokens:
+            return [self.start_token, self.no_timestamps_token]
+        language_token = self.language_token
+        if language_token is None:
+            # One decoder step: the most likely language token after <|startoftranscript|>
+            logits = self._run(self.decoder, input_ids=[[self.start_token]],
+                               encoder_hidden_states=encoder_hidden_states)["logits"][0, -1]
+            candidates = list(self.language_tokens.values())
+            language_token = candidates[int(np.argmax(logits[candidates]))]
+        return [self.start_token, language_token, self.transcribe_token, self.no_timestamps_token]
+
+    def _generate(self, encoder_hidden_states, prompt):
+        tokens = list(prompt)
+        outputs = self._run(self.decoder, input_ids=[tokens], encoder_hidden_states=encoder_hidden_states)
+        past = {}
+        generated = []
+        for step in range(min(self.max_new_tokens, MAX_TARGET_POSITIONS - len(prompt))):
+            logits = outputs["logits"][0, -1].copy()
+            logits[self.suppress[:len(logits)]] = -np.inf
+            if step == 0:
+                logits[self.begin_suppress] = -np.inf
+            token = int(np.argmax(logits))
+            if token == self.end_token:
+                break
+            generated.append(token)
+            tokens.append(token)
+
+            if self.decoder_with_past is None:
+                outputs = self._run(self.decoder, input_ids=[tokens], encoder_hidden_states=encoder_hidden_states)
+                continue
+            # The first step also returns the cross-attention keys and values,
+            # which stay the same for the whole window
+            past.update({name.replace("present", "past_key_values"): value
+                         for name, value in outputs.items() if name.startswith("present")})
+            outputs = self._run(self.decoder_with_past, input_ids=[[token]],
+                                encoder_hidden_states=encoder_hidden_states, **past)
+        return generated
+
+    @staticmethod
+    def _run(session, input_ids, **inputs):
+        feeds = {"input_ids": np.array(input_ids, dtype=np.int64), **inputs}
+        names = {session_input.name for session_input in session.get_inputs()}
+        values = session.run(None, {name: value for name, value in feeds.items() if name in names})
+        return {session_output.name: value for session_output, value in zip(session.get_outputs(), values)}